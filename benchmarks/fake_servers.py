@@ -0,0 +1,631 @@
+"""
+Local stand-ins for Microsoft Graph and the Google Drive v3 API.
+
+They implement just enough of each protocol for the migration tool to run
+unmodified against them: Graph pagination and 302 download redirects, Drive
+listing queries and the resumable upload protocol. Latency, bandwidth caps and
+429 throttling can be injected to reproduce production conditions.
+"""
+import re
+import sys
+import json
+import time
+import uuid
+import zlib
+import random
+import hashlib
+import threading
+import collections
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+
+# Real id of the fake My Drive root, which requests may call 'root'
+DRIVE_ROOT_ID = '0AAfakeMyDriveRoot'
+
+class SyntheticTree:
+    """
+    A OneDrive folder tree generated on demand from a few shape parameters.
+
+    Nothing is stored: item ids encode their position in the tree, and sizes
+    and contents are derived from the id, so trees with millions of items
+    cost no memory. A `duplicate_rate` fraction of files share their contents
+    with others, drawn from `duplicate_pool` distinct contents.
+    """
+    def __init__(self, depth=2, folders_per_folder=5, files_per_folder=20, min_size=1024, max_size=65536, seed=0,
+                 duplicate_rate=0.0, duplicate_pool=10):
+        self.depth = depth
+        self.folders_per_folder = folders_per_folder
+        self.files_per_folder = files_per_folder
+        self.min_size = min_size
+        self.max_size = max_size
+        self.seed = seed
+        self.duplicate_rate = duplicate_rate
+        self.duplicate_pool = duplicate_pool
+
+    @property
+    def folder_count(self):
+        """Folders below the root."""
+        return sum(self.folders_per_folder ** level for level in range(1, self.depth + 1))
+
+    @property
+    def file_count(self):
+        return (self.folder_count + 1) * self.files_per_folder
+
+    def _path(self, item_id):
+        # 'root' -> [], 'd.0.3' -> [0, 3], 'f.0.3.7' -> [0, 3, 7]
+        if item_id == 'root':
+            return []
+        return [int(part) for part in item_id.split('.')[1:]]
+
+    def is_folder(self, item_id):
+        return item_id == 'root' or item_id.startswith('d.')
+
+    def _content_id(self, file_id):
+        """The id whose contents a file has: its own, or a shared duplicate's."""
+        if self.duplicate_rate:
+            draw = zlib.crc32(f'{self.seed}:dup:{file_id}'.encode())
+            if draw / 2 ** 32 < self.duplicate_rate:
+                return f'dup.{draw % self.duplicate_pool}'
+        return file_id
+
+    def size(self, file_id):
+        span = self.max_size - self.min_size + 1
+        return self.min_size + zlib.crc32(f'{self.seed}:{self._content_id(file_id)}'.encode()) % span
+
+    def content(self, file_id, start=0, end=None):
+        """Deterministic file contents, optionally the [start, end) slice only."""
+        size = self.size(file_id)
+        end = size if end is None else min(end, size)
+        pattern = f'{self.seed}:{self._content_id(file_id)}\n'.encode()
+        offset = start % len(pattern)
+        repeats = (end - start + offset) // len(pattern) + 1
+        return (pattern * repeats)[offset:offset + end - start]
+
+    def sha1(self, file_id):
+        return hashlib.sha1(self.content(file_id)).hexdigest().upper()
+
+    def children(self, folder_id):
+        """Graph driveItem resources for the children of a folder, folders first."""
+        path = self._path(folder_id)
+        suffix = ''.join(f'.{part}' for part in path)
+        items = []
+
+        if len(path) < self.depth:
+            for i in range(self.folders_per_folder):
+                child_id = f'd{suffix}.{i}'
+                has_subfolders = len(path) + 1 < self.depth
+                items.append({
+                    'id': child_id,
+                    'name': f'folder_{i}',
+                    'folder': {'childCount': self.files_per_folder + (self.folders_per_folder if has_subfolders else 0)},
+                    'parentReference': {'id': folder_id},
+                })
+
+        for i in range(self.files_per_folder):
+            child_id = f'f{suffix}.{i}'
+            items.append({
+                'id': child_id,
+                'name': f'file_{i}.bin',
+                'size': self.size(child_id),
+                'file': {'mimeType': 'application/octet-stream', 'hashes': {'sha1Hash': self.sha1(child_id)}},
+                'parentReference': {'id': folder_id},
+            })
+
+        return items
+
+
+class _Bandwidth:
+    """
+    Shared link capacity in bytes per second. Each caller books a time slot
+    for its bytes and sleeps until that slot has passed.
+    """
+    def __init__(self, rate):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def consume(self, nbytes):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + nbytes / self.rate
+            wait = self._next - now
+        if wait > 0:
+            time.sleep(wait)
+
+
+class _QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients dropping connections mid-request are expected, e.g. after a 429
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+class _FakeServer:
+    """
+    Base class: a threaded HTTP/1.1 server on localhost with injectable
+    per-request latency, a bandwidth cap and a 429 throttle rate.
+    """
+    handler_class = None
+
+    def __init__(self, latency=0.0, bandwidth=None, throttle_rate=0.0, retry_after=1, seed=0):
+        self.latency = latency
+        self.bandwidth = _Bandwidth(bandwidth)
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self.requests = collections.Counter()
+        self._requests_lock = threading.Lock()
+        self._httpd = None
+
+    def start(self):
+        handler = type(self.handler_class.__name__, (self.handler_class,), {'fake': self})
+        self._httpd = _QuietHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=self._httpd.serve_forever, name=type(self).__name__, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    @property
+    def address(self):
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def count(self, kind):
+        with self._requests_lock:
+            self.requests[kind] += 1
+
+    def should_throttle(self):
+        if not self.throttle_rate:
+            return False
+        with self._rng_lock:
+            return self._rng.random() < self.throttle_rate
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    fake = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _begin(self, kind):
+        """Common request preamble. Returns False if the request was throttled."""
+        self.fake.count(kind)
+        if self.fake.latency:
+            time.sleep(self.fake.latency)
+        if self.fake.should_throttle():
+            self.fake.count('throttled')
+            self._throttle()
+            return False
+        return True
+
+    def _throttle(self):
+        self._send_json(429, {'error': {'code': 429, 'message': 'Too Many Requests'}}, {'Retry-After': str(self.fake.retry_after)})
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_empty(self, status, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        chunks = []
+        while length > 0:
+            chunk = self.rfile.read(min(length, 65536))
+            if not chunk:
+                break
+            self.fake.bandwidth.consume(len(chunk))
+            chunks.append(chunk)
+            length -= len(chunk)
+        return b''.join(chunks)
+
+
+class _GraphHandler(_Handler):
+    # Any drive: /me/drive, /drives/{id}, /users/{id}/drive or /sites/{id}/drive
+    DRIVE = r'^/v1\.0(/me/drive|/drives/[^/]+|/(?:users|sites)/[^/]+/drive)'
+    CHILDREN = re.compile(DRIVE + r'/items/([^/]+)/children$')
+    CONTENT = re.compile(DRIVE + r'/items/([^/]+)/content$')
+    DOWNLOAD = re.compile(r'^/download/([^/]+)$')
+
+    def do_GET(self):
+        parsed = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(parsed.query)
+        tree = self.fake.tree
+
+        match = self.CHILDREN.match(parsed.path)
+        if match:
+            if not self._begin('list_children'):
+                return
+            drive = match.group(1)
+            folder_id = urllib.parse.unquote(match.group(2))
+            if not tree.is_folder(folder_id):
+                self._send_json(404, {'error': {'code': 'itemNotFound'}})
+                return
+            top = min(int(query.get('$top', ['200'])[0]), 1000)
+            skip = int(query.get('$skiptoken', ['0'])[0])
+            children = tree.children(folder_id)
+            payload = {'value': children[skip:skip + top]}
+            if skip + top < len(children):
+                payload['@odata.nextLink'] = f'{self.fake.address}/v1.0{drive}/items/{folder_id}/children?$top={top}&$skiptoken={skip + top}'
+            self._send_json(200, payload)
+            return
+
+        match = self.CONTENT.match(parsed.path)
+        if match:
+            if not self._begin('content'):
+                return
+            # Like Graph, redirect to a pre-authenticated download URL
+            self._send_empty(302, {'Location': f'{self.fake.address}/download/{match.group(2)}'})
+            return
+
+        match = self.DOWNLOAD.match(parsed.path)
+        if match:
+            if not self._begin('download'):
+                return
+            file_id = urllib.parse.unquote(match.group(1))
+            size = tree.size(file_id)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(size))
+            self.end_headers()
+            for start in range(0, size, 65536):
+                chunk = tree.content(file_id, start, start + 65536)
+                self.fake.bandwidth.consume(len(chunk))
+                self.wfile.write(chunk)
+            return
+
+        self._send_json(404, {'error': {'code': 'notFound'}})
+
+
+class FakeGraphServer(_FakeServer):
+    """Serves a SyntheticTree as the signed-in user's OneDrive."""
+    handler_class = _GraphHandler
+
+    def __init__(self, tree, **kwargs):
+        super().__init__(**kwargs)
+        self.tree = tree
+
+    @property
+    def url(self):
+        """Value for the "api_endpoint" of the microsoft config section."""
+        return f'{self.address}/v1.0'
+
+
+# Drive query clauses, matched left to right so quoted names are consumed whole
+_QUOTED = r"'((?:\\.|[^'\\])*)'"
+_QUERY_CLAUSE = re.compile(
+    rf"name\s*=\s*{_QUOTED}"
+    rf"|mimeType\s*(!?=)\s*{_QUOTED}"
+    rf"|{_QUOTED}\s+in\s+parents"
+    r"|trashed\s*=\s*(true|false)"
+)
+
+def _unquote(value):
+    return re.sub(r'\\(.)', r'\1', value)
+
+
+class _DriveHandler(_Handler):
+    FILES = '/drive/v3/files'
+    CHANGES = '/drive/v3/changes'
+    START_PAGE_TOKEN = '/drive/v3/changes/startPageToken'
+    UPLOAD = '/upload/drive/v3/files'
+    COPY = re.compile(r'^/drive/v3/files/([^/]+)/copy$')
+    FILE = re.compile(r'^/drive/v3/files/([^/]+)$')
+
+    def do_GET(self):
+        parsed = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(parsed.query)
+
+        if parsed.path == self.FILES:
+            if not self._begin('list'):
+                return
+            files = self.fake.query(query.get('q', [''])[0])
+            page_size = min(int(query.get('pageSize', ['100'])[0]), 1000)
+            offset = int(query.get('pageToken', ['0'])[0])
+            payload = {'files': files[offset:offset + page_size]}
+            if offset + page_size < len(files):
+                payload['nextPageToken'] = str(offset + page_size)
+            self._send_json(200, payload)
+            return
+
+        match = self.FILE.match(parsed.path)
+        if match:
+            if not self._begin('get'):
+                return
+            file = self.fake.get(urllib.parse.unquote(match.group(1)))
+            if file is None:
+                self._send_json(404, {'error': {'code': 404, 'message': 'File not found'}})
+            else:
+                self._send_json(200, file)
+            return
+
+        if parsed.path == self.START_PAGE_TOKEN:
+            if not self._begin('changes'):
+                return
+            self._send_json(200, {'startPageToken': str(len(self.fake.changes))})
+            return
+
+        if parsed.path == self.CHANGES:
+            if not self._begin('changes'):
+                return
+            # Page tokens are positions in the change log
+            token = query.get('pageToken', [''])[0]
+            if not token.isdigit() or int(token) > len(self.fake.changes):
+                self._send_json(400, {'error': {'code': 400, 'message': 'Invalid Value'}})
+                return
+            start = int(token)
+            end = start + min(int(query.get('pageSize', ['100'])[0]), 1000)
+            payload = {'changes': self.fake.changes[start:end]}
+            if end < len(self.fake.changes):
+                payload['nextPageToken'] = str(end)
+            else:
+                payload['newStartPageToken'] = str(len(self.fake.changes))
+            self._send_json(200, payload)
+            return
+
+        self._send_json(404, {'error': {'code': 404, 'message': 'Not Found'}})
+
+    def do_POST(self):
+        parsed = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(parsed.query)
+        body = self._read_body()
+
+        if parsed.path == self.FILES:
+            if not self._begin('create'):
+                return
+            self._send_json(200, self.fake.create(json.loads(body or b'{}')))
+            return
+
+        match = self.COPY.match(parsed.path)
+        if match:
+            if not self._begin('copy'):
+                return
+            copied = self.fake.copy(urllib.parse.unquote(match.group(1)), json.loads(body or b'{}'))
+            if copied is None:
+                self._send_json(404, {'error': {'code': 404, 'message': 'File not found'}})
+            else:
+                self._send_json(200, copied)
+            return
+
+        if parsed.path == self.UPLOAD and query.get('uploadType') == ['resumable']:
+            if not self._begin('upload_start'):
+                return
+            length = self.headers.get('X-Upload-Content-Length')
+            upload_id = self.fake.start_upload(json.loads(body or b'{}'), int(length) if length is not None else None)
+            self._send_empty(200, {'Location': f'{self.fake.address}{self.UPLOAD}?uploadType=resumable&upload_id={upload_id}'})
+            return
+
+        self._send_json(404, {'error': {'code': 404, 'message': 'Not Found'}})
+
+    def do_PUT(self):
+        parsed = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(parsed.query)
+        upload_id = query.get('upload_id', [None])[0]
+
+        if parsed.path != self.UPLOAD or upload_id is None:
+            self._read_body()
+            self._send_json(404, {'error': {'code': 404, 'message': 'Not Found'}})
+            return
+
+        # Take the whole body before answering so a 429 does not reset the connection
+        data = self._read_body()
+        if not self._begin('upload_chunk'):
+            return
+
+        status, payload, headers = self.fake.put_chunk(upload_id, self.headers.get('Content-Range'), data)
+        if payload is None:
+            self._send_empty(status, headers)
+        else:
+            self._send_json(status, payload, headers)
+
+
+class FakeDriveServer(_FakeServer):
+    """
+    An in-memory Google Drive. Only metadata and checksums of uploaded files
+    are kept, not their contents. Every change is appended to `changes`,
+    which the changes feed serves. Like Drive, it accepts 'root' for the
+    My Drive root folder but reports it as DRIVE_ROOT_ID.
+    """
+    handler_class = _DriveHandler
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.files = {}
+        self.changes = []
+        self._children = collections.defaultdict(list)
+        self._uploads = {}
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        """Value for google_drive.API_ROOT_URL."""
+        return self.address
+
+    def _new_id(self):
+        return uuid.uuid4().hex
+
+    @staticmethod
+    def _resolve(file_id):
+        return DRIVE_ROOT_ID if file_id == 'root' else file_id
+
+    def get(self, file_id):
+        file_id = self._resolve(file_id)
+        if file_id == DRIVE_ROOT_ID:
+            return {'id': DRIVE_ROOT_ID, 'name': 'My Drive', 'mimeType': FOLDER_MIME}
+        with self._lock:
+            return self.files.get(file_id)
+
+    def create(self, metadata, size=0, md5=hashlib.md5().hexdigest(), sha1=hashlib.sha1().hexdigest()):
+        file = {
+            'id': self._new_id(),
+            'name': metadata.get('name', 'Untitled'),
+            'mimeType': metadata.get('mimeType', 'application/octet-stream'),
+            'parents': [self._resolve(parent) for parent in metadata.get('parents') or ['root']],
+        }
+        if file['mimeType'] != FOLDER_MIME:
+            # Drive reports sizes as strings
+            file['size'] = str(size)
+            file['md5Checksum'] = md5
+            file['sha1Checksum'] = sha1
+
+        with self._lock:
+            self.files[file['id']] = file
+            for parent in file['parents']:
+                self._children[parent].append(file['id'])
+            self.changes.append({'fileId': file['id'], 'removed': False, 'file': dict(file)})
+        return file
+
+    def delete(self, file_id):
+        """Deletes a file as a user would, outside the tool."""
+        with self._lock:
+            file = self.files.pop(file_id)
+            for parent in file['parents']:
+                self._children[parent].remove(file_id)
+            self.changes.append({'fileId': file_id, 'removed': True})
+
+    def copy(self, file_id, metadata):
+        """Server-side copy: the new file gets the source's size and checksums."""
+        source = self.files.get(file_id)
+        if source is None:
+            return None
+        metadata = dict(metadata)
+        metadata.setdefault('name', source['name'])
+        metadata.setdefault('mimeType', source['mimeType'])
+        metadata.setdefault('parents', source['parents'])
+        return self.create(metadata, int(source.get('size', 0)), source.get('md5Checksum'), source.get('sha1Checksum'))
+
+    def query(self, q):
+        """Evaluates the subset of the Drive query language the tool uses."""
+        parent = name = None
+        mime_filters = []
+        for match in _QUERY_CLAUSE.finditer(q):
+            if match.group(1) is not None:
+                name = _unquote(match.group(1))
+            elif match.group(2) is not None:
+                mime_filters.append((match.group(2), _unquote(match.group(3))))
+            elif match.group(4) is not None:
+                parent = _unquote(match.group(4))
+
+        with self._lock:
+            ids = self._children.get(self._resolve(parent), []) if parent is not None else list(self.files)
+            candidates = [self.files[file_id] for file_id in ids]
+
+        results = []
+        for file in candidates:
+            if name is not None and file['name'] != name:
+                continue
+            if any((file['mimeType'] == mime) != (op == '=') for op, mime in mime_filters):
+                continue
+            results.append(file)
+        return results
+
+    def start_upload(self, metadata, length):
+        upload_id = self._new_id()
+        with self._lock:
+            self._uploads[upload_id] = {
+                'metadata': metadata,
+                'length': length,
+                'received': 0,
+                'md5': hashlib.md5(),
+                'sha1': hashlib.sha1(),
+            }
+        return upload_id
+
+    def put_chunk(self, upload_id, content_range, data):
+        """
+        Applies one PUT of the resumable protocol.
+        Returns (status, json payload or None, headers).
+        """
+        with self._lock:
+            upload = self._uploads.get(upload_id)
+        if upload is None:
+            return 404, {'error': {'code': 404, 'message': 'Upload session not found'}}, {}
+
+        total = upload['length']
+        if content_range:
+            match = re.match(r'bytes (?:(\d+)-(\d+)|\*)/(\d+|\*)', content_range)
+            if not match:
+                return 400, {'error': {'code': 400, 'message': f'Bad Content-Range {content_range}'}}, {}
+            if match.group(3) != '*':
+                total = int(match.group(3))
+            if match.group(1) is not None and int(match.group(1)) != upload['received']:
+                # Out-of-order chunk; tell the client where we really are
+                return 308, None, self._range_header(upload['received'])
+        elif data:
+            return 400, {'error': {'code': 400, 'message': 'Missing Content-Range'}}, {}
+
+        upload['md5'].update(data)
+        upload['sha1'].update(data)
+        upload['received'] += len(data)
+
+        if total is None or upload['received'] < total:
+            return 308, None, self._range_header(upload['received'])
+        if upload['received'] > total:
+            return 400, {'error': {'code': 400, 'message': 'Received more bytes than declared'}}, {}
+
+        with self._lock:
+            self._uploads.pop(upload_id, None)
+        file = self.create(upload['metadata'], upload['received'], upload['md5'].hexdigest(), upload['sha1'].hexdigest())
+        return 200, file, {}
+
+    @staticmethod
+    def _range_header(received):
+        return {'Range': f'bytes=0-{received - 1}'} if received else {}
+
+
+def fake_onedrive_client(graph_url, **microsoft):
+    """
+    A OneDriveClient for a fake Graph server. MSAL is not set up, since the
+    server accepts any bearer token. `microsoft` adds to its config section.
+    """
+    from onedrive import OneDriveClient
+
+    class FakeOneDriveClient(OneDriveClient):
+        def _build_app(self):
+            return None
+
+    client = FakeOneDriveClient({'microsoft': dict(microsoft, client_id='fake', api_endpoint=graph_url)})
+    client.access_token = 'fake'
+    return client
+
+def use_fake_drive(drive_url):
+    """
+    Points google_drive at a fake Drive server, or back at Google with None.
+    Returns credentials the fake server accepts.
+    """
+    import google_drive
+    from google.auth.credentials import AnonymousCredentials
+
+    google_drive.API_ROOT_URL = drive_url
+    return AnonymousCredentials()
@@ -0,0 +1,241 @@
+"""
+Benchmark harness: runs the real migration code against the fake Graph and
+Drive servers and reports files/s, MB/s, API calls per file and peak RSS.
+
+    python -m benchmarks.harness --shapes small,tiny-files --workers 1,5,10
+
+Each case runs in a fresh subprocess so peak RSS is not polluted by earlier
+cases or by the fake servers, which run in the parent. Results are appended
+to a JSON Lines file and compared against the previous run of the same case.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import subprocess
+
+from benchmarks.fake_servers import SyntheticTree, FakeGraphServer, FakeDriveServer, FOLDER_MIME
+from packing import ARCHIVE_SUFFIX, MANIFEST_SUFFIX
+
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(__file__), 'results.jsonl')
+
+KB = 1024
+MB = 1024 * 1024
+
+# Tree shapes: SyntheticTree keyword arguments
+SHAPES = {
+    'small': dict(depth=2, folders_per_folder=3, files_per_folder=20, min_size=1 * KB, max_size=64 * KB),
+    'tiny-files': dict(depth=1, folders_per_folder=4, files_per_folder=500, min_size=100, max_size=10 * KB),
+    'deep': dict(depth=8, folders_per_folder=2, files_per_folder=3, min_size=1 * KB, max_size=16 * KB),
+    'large-files': dict(depth=1, folders_per_folder=2, files_per_folder=4, min_size=4 * MB, max_size=16 * MB),
+    'million': dict(depth=3, folders_per_folder=10, files_per_folder=900, min_size=512, max_size=4 * KB),
+    # Subfolders of 1600 files under 4 KB, which the pack policy uploads as one archive each
+    'mailbox': dict(depth=2, folders_per_folder=3, files_per_folder=400, min_size=200, max_size=4 * KB),
+    'duplicates': dict(depth=2, folders_per_folder=3, files_per_folder=10, min_size=256 * KB, max_size=1 * MB, duplicate_rate=0.5),
+}
+DEFAULT_SHAPES = ['small', 'tiny-files', 'deep', 'large-files']
+
+# Fields that identify a case when comparing against earlier results
+CASE_KEYS = ('shape', 'workers', 'latency', 'bandwidth', 'throttle_rate', 'spool_bytes', 'dedup', 'pack')
+
+
+def run_case(graph_url, drive_url, workers, spool_path=None, spool_bytes=None, dedup=False, pack=False, log_level='WARNING'):
+    """
+    Runs one migration in this process against already running fake servers.
+    Returns client-side measurements.
+    """
+    import logging
+    import resource
+
+    import metrics
+    import migrate
+    import google_drive
+    from benchmarks.fake_servers import fake_onedrive_client, use_fake_drive
+
+    # Per-file log lines are not what we measure
+    logging.basicConfig(level=log_level)
+
+    od_client = fake_onedrive_client(graph_url)
+    creds = use_fake_drive(drive_url)
+    gd_service = google_drive.build_service(creds)
+
+    # Failures are counted in metrics; the ledger would only pile up in the working directory
+    config = {'workers': workers, 'metrics': {'summary_interval': 3600}, 'failure_ledger': os.devnull}
+    if spool_bytes:
+        config['spool'] = {'path': spool_path, 'max_bytes': spool_bytes, 'upload_workers': workers}
+    if dedup:
+        config['dedup'] = {}
+    if pack:
+        config['pack'] = {}
+
+    start = time.perf_counter()
+    migrate.run_migration(od_client, creds, gd_service, config)
+    elapsed = time.perf_counter() - start
+
+    api_calls = sum(child.snapshot()[2] for _, child in metrics.API_LATENCY.children())
+    return {
+        'seconds': elapsed,
+        'files': metrics.FILES_TRANSFERRED.get() + metrics.FILES_COPIED.get() + metrics.FILES_PACKED.get(),
+        'copied': metrics.FILES_COPIED.get(),
+        'packed': metrics.FILES_PACKED.get(),
+        'bytes': metrics.BYTES_TRANSFERRED.get(),
+        'failed': metrics.FILES_FAILED.get(),
+        'client_api_calls': api_calls,
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def benchmark(shape, workers, latency=0.0, bandwidth=None, throttle_rate=0.0, spool_bytes=None, spool_path=None, dedup=False, pack=False):
+    """
+    Starts fake servers for one case, runs the migration in a subprocess and
+    returns a result record.
+    """
+    tree = SyntheticTree(**SHAPES[shape])
+    server_options = dict(latency=latency, bandwidth=bandwidth, throttle_rate=throttle_rate)
+
+    with FakeGraphServer(tree, **server_options) as graph, FakeDriveServer(**server_options) as drive:
+        command = [
+            sys.executable, '-m', 'benchmarks.harness', '_run-case',
+            '--graph-url', graph.url, '--drive-url', drive.url, '--workers', str(workers),
+        ]
+        if spool_bytes:
+            command += ['--spool-bytes', str(spool_bytes), '--spool-path', spool_path]
+        if dedup:
+            command.append('--dedup')
+        if pack:
+            command.append('--pack')
+
+        completed = subprocess.run(command, capture_output=True, text=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        if completed.returncode != 0:
+            raise RuntimeError(f"Benchmark case {shape}/{workers} failed:\n{completed.stderr}")
+        measured = json.loads(completed.stdout.strip().splitlines()[-1])
+
+        # Packed files are counted from the run's metrics, not the archives holding them
+        uploaded = sum(1 for f in list(drive.files.values())
+                       if f['mimeType'] != FOLDER_MIME and not f['name'].endswith((ARCHIVE_SUFFIX, MANIFEST_SUFFIX)))
+        uploaded += measured['packed']
+        server_calls = sum(graph.requests.values()) + sum(drive.requests.values()) - graph.requests['throttled'] - drive.requests['throttled']
+        throttled = graph.requests['throttled'] + drive.requests['throttled']
+
+    seconds = measured['seconds']
+    return {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'shape': shape,
+        'workers': workers,
+        'latency': latency,
+        'bandwidth': bandwidth,
+        'throttle_rate': throttle_rate,
+        'spool_bytes': spool_bytes,
+        'dedup': dedup,
+        'pack': pack,
+        'expected_files': tree.file_count,
+        'files': measured['files'],
+        'copied': measured['copied'],
+        'packed': measured['packed'],
+        'missing_files': tree.file_count - uploaded,
+        'failed': measured['failed'],
+        'bytes': measured['bytes'],
+        'seconds': round(seconds, 3),
+        'files_per_s': round(measured['files'] / seconds, 2),
+        'mb_per_s': round(measured['bytes'] / MB / seconds, 3),
+        'api_calls_per_file': round(server_calls / max(tree.file_count, 1), 3),
+        'throttled': throttled,
+        'peak_rss_mb': round(measured['peak_rss_mb'], 1),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_results(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def previous_result(history, result):
+    """The most recent earlier result for the same case, if any."""
+    key = tuple(result.get(k) for k in CASE_KEYS)
+    for earlier in reversed(history):
+        if tuple(earlier.get(k) for k in CASE_KEYS) == key:
+            return earlier
+    return None
+
+
+def _change(new, old):
+    if not old:
+        return ''
+    return f" ({(new - old) / old * 100:+.1f}%)"
+
+
+def format_result(result, previous=None):
+    prev = previous or {}
+    return (
+        f"{result['shape']:<12} workers={result['workers']:<3} {'spool ' if result['spool_bytes'] else ''}{'dedup ' if result.get('dedup') else ''}{'pack ' if result.get('pack') else ''}"
+        f"{result['files_per_s']:>9.1f} files/s{_change(result['files_per_s'], prev.get('files_per_s')):<10} "
+        f"{result['mb_per_s']:>8.2f} MB/s{_change(result['mb_per_s'], prev.get('mb_per_s')):<10} "
+        f"{result['api_calls_per_file']:>6.2f} calls/file "
+        f"{result['peak_rss_mb']:>7.1f} MB RSS{_change(result['peak_rss_mb'], prev.get('peak_rss_mb')):<10} "
+        f"missing={result['missing_files']} throttled={result['throttled']}"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the migration against local fake Graph and Drive servers.")
+    parser.add_argument('--shapes', default=','.join(DEFAULT_SHAPES), help=f"Comma-separated tree shapes: {', '.join(SHAPES)}")
+    parser.add_argument('--workers', default='5', help="Comma-separated worker counts to try")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every request")
+    parser.add_argument('--bandwidth', type=float, default=None, help="Link cap per server in MB/s")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument('--spool-bytes', type=int, default=None, help="Enable the download spool with this cap")
+    parser.add_argument('--spool-path', default=os.path.join('/tmp', 'migration-bench-spool'))
+    parser.add_argument('--dedup', action='store_true', help="Copy duplicate files inside Drive instead of uploading them")
+    parser.add_argument('--pack', action='store_true', help="Upload folders of many small files as tar archives")
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help="JSON Lines file results are appended to")
+    args = parser.parse_args(argv)
+
+    shapes = args.shapes.split(',')
+    for shape in shapes:
+        if shape not in SHAPES:
+            parser.error(f"Unknown shape '{shape}'")
+
+    bandwidth = args.bandwidth * MB if args.bandwidth else None
+    history = load_results(args.output)
+
+    for shape in shapes:
+        for workers in (int(w) for w in args.workers.split(',')):
+            result = benchmark(shape, workers, args.latency, bandwidth, args.throttle_rate, args.spool_bytes, args.spool_path, args.dedup, args.pack)
+            print(format_result(result, previous_result(history, result)), flush=True)
+            with open(args.output, 'a') as f:
+                f.write(json.dumps(result) + '\n')
+            history.append(result)
+
+
+def _run_case_main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--graph-url', required=True)
+    parser.add_argument('--drive-url', required=True)
+    parser.add_argument('--workers', type=int, required=True)
+    parser.add_argument('--spool-bytes', type=int)
+    parser.add_argument('--spool-path')
+    parser.add_argument('--dedup', action='store_true')
+    parser.add_argument('--pack', action='store_true')
+    args = parser.parse_args(argv)
+    result = run_case(args.graph_url, args.drive_url, args.workers, args.spool_path, args.spool_bytes, args.dedup, args.pack)
+    print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '_run-case':
+        _run_case_main(sys.argv[2:])
+    else:
+        main()
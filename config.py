@@ -0,0 +1,15 @@
+import os
+import json
+import logging
+
+DEFAULT_CONFIG_PATH = 'config.json'
+
+logger = logging.getLogger(__name__)
+
+def load_config(config_path=DEFAULT_CONFIG_PATH):
+    if not os.path.exists(config_path):
+        logger.error(f"Configuration file {config_path} not found. Please rename config_template.json and fill in your keys.")
+        raise FileNotFoundError(f"{config_path} not found")
+
+    with open(config_path, 'r') as f:
+        return json.load(f)
@@ -0,0 +1,113 @@
+import base64
+import binascii
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Files smaller than this are uploaded even if an identical file exists:
+# a copy is still one API call, and tiny files are not worth the index memory.
+DEFAULT_MIN_SIZE = 256 * 1024
+
+# OneDrive hash name -> (tag, decoder), strongest first. The tag keeps keys
+# built from different algorithms apart.
+HASH_TYPES = [
+    ('sha256Hash', b'\x01', binascii.unhexlify),
+    ('sha1Hash', b'\x02', binascii.unhexlify),
+]
+
+# quickXorHash is not a cryptographic hash: different contents of the same size
+# can share it, and a match would copy the wrong file. Only used when allowed.
+QUICKXOR_HASH_TYPE = ('quickXorHash', b'\x03', base64.b64decode)
+
+# Bytes of the digest kept in a key; 128 bits make accidental collisions negligible
+DIGEST_BYTES = 16
+
+def content_key(size, hashes, allow_quickxor=False):
+    """
+    Compact key for a file's content: tag, size and a truncated digest packed
+    into one short bytes object. Returns None if no usable hash is available.
+    quickXorHash is only used if `allow_quickxor` is set.
+    """
+    hash_types = HASH_TYPES + [QUICKXOR_HASH_TYPE] if allow_quickxor else HASH_TYPES
+    for name, tag, decode in hash_types:
+        value = hashes.get(name)
+        if not value:
+            continue
+        try:
+            digest = decode(value)
+        except (binascii.Error, ValueError):
+            continue
+        return tag + size.to_bytes(8, 'big') + digest[:DIGEST_BYTES]
+    return None
+
+class ContentIndex:
+    """
+    Maps file contents seen during a run to the Drive file that holds them,
+    so duplicates can be created with a server-side copy instead of an upload.
+
+    Only keys and Drive ids are stored, about 200 bytes per indexed file.
+    """
+    def __init__(self, min_size=DEFAULT_MIN_SIZE, allow_quickxor=False):
+        self.min_size = min_size
+        self.allow_quickxor = allow_quickxor
+        self._ids = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def claim(self, item):
+        """
+        Looks up a OneDrive file item. Returns (gd_id, None) if identical
+        content is already in Drive, or (None, claim) if the caller should upload
+        it and then call claim.complete(gd_id) or claim.abandon().
+        Returns (None, None) for files that are not indexed.
+
+        If the same content is being uploaded by another worker, waits for it.
+        """
+        size = item.get('size', 0)
+        if size < self.min_size:
+            return None, None
+        key = content_key(size, item.get('file', {}).get('hashes', {}), self.allow_quickxor)
+        if key is None:
+            return None, None
+
+        while True:
+            with self._lock:
+                gd_id = self._ids.get(key)
+                if gd_id is not None:
+                    return gd_id, None
+                event = self._pending.get(key)
+                if event is None:
+                    event = self._pending[key] = threading.Event()
+                    return None, Claim(self, key, event)
+            # If the upload fails the claim is abandoned and we try to take it over
+            event.wait()
+
+    def _resolve(self, key, event, gd_id):
+        with self._lock:
+            if gd_id is not None:
+                self._ids[key] = gd_id
+            del self._pending[key]
+        event.set()
+
+class Claim:
+    """The right to upload one piece of content; resolve it exactly once."""
+    def __init__(self, index, key, event):
+        self._index = index
+        self._key = key
+        self._event = event
+        self._resolved = False
+
+    def complete(self, gd_id):
+        if not self._resolved:
+            self._resolved = True
+            self._index._resolve(self._key, self._event, gd_id)
+
+    def abandon(self):
+        """Releases the claim without an upload, e.g. after a failure. Safe to call after complete()."""
+        if not self._resolved:
+            self._resolved = True
+            self._index._resolve(self._key, self._event, None)
@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import random
+import logging
+import datetime
+import threading
+
+import urllib3
+
+import metrics
+from onedrive import OneDriveError
+
+logger = logging.getLogger(__name__)
+
+# Error classes recorded in the ledger
+TRANSIENT = 'transient'
+THROTTLED = 'throttled'
+PERMANENT = 'permanent'
+
+# HTTP statuses worth trying again
+TRANSIENT_STATUSES = (408, 500, 502, 503, 504)
+
+# In-process retries of transient and throttled failures
+DEFAULT_RETRIES = 3
+BACKOFF_BASE = 1  # seconds, doubled on each attempt
+BACKOFF_CAP = 60
+
+DEFAULT_LEDGER_PATH = 'failures.jsonl'
+
+class QuotaExceededError(Exception):
+    """A migration pair has used up the upload allowance it was given for this run."""
+
+def classify(error):
+    """Returns TRANSIENT, THROTTLED or PERMANENT for an exception raised by a transfer."""
+    if isinstance(error, QuotaExceededError):
+        # Not worth retrying in this run, but fine in a later one
+        return THROTTLED
+    if isinstance(error, OneDriveError):
+        if error.throttled:
+            return THROTTLED
+        status = error.status_code
+    elif isinstance(error, (OSError, urllib3.exceptions.HTTPError)):
+        # Connection resets, timeouts and truncated downloads
+        return TRANSIENT
+    else:
+        # Imported here so that OneDrive-only commands (plan) do not load the Google client
+        import httplib2
+        from google.auth.exceptions import TransportError
+        from googleapiclient.errors import HttpError
+        import google_drive
+
+        if isinstance(error, HttpError):
+            if google_drive.is_rate_limited(error):
+                return THROTTLED
+            status = error.resp.status
+        elif isinstance(error, (httplib2.HttpLib2Error, TransportError)):
+            return TRANSIENT
+        else:
+            return PERMANENT
+    return TRANSIENT if status in TRANSIENT_STATUSES else PERMANENT
+
+def retry_after(error):
+    """Seconds the server asked us to wait, if it said."""
+    if isinstance(error, OneDriveError):
+        return error.retry_after
+    if isinstance(error, (OSError, urllib3.exceptions.HTTPError)):
+        return None
+    from googleapiclient.errors import HttpError
+    if isinstance(error, HttpError):
+        try:
+            return float(error.resp.get('retry-after'))
+        except (TypeError, ValueError):
+            return None
+    return None
+
+def backoff_delay(attempt, server_delay=None, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """
+    Full jitter: a uniform delay below an exponentially growing ceiling, so
+    workers that failed together do not retry together. Never shorter than
+    a Retry-After the server sent.
+    """
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    if server_delay:
+        delay = max(delay, server_delay)
+    return delay
+
+def call_with_retries(fn, description, retries=DEFAULT_RETRIES):
+    """
+    Calls fn(), retrying transient and throttled failures with jittered backoff.
+    Permanent failures, and the last failure, are raised to the caller.
+    """
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except Exception as e:
+            error_class = classify(e)
+            if error_class == PERMANENT or attempt >= retries:
+                raise
+            delay = backoff_delay(attempt, retry_after(e))
+            metrics.RETRIES.labels(error_class).inc()
+            logger.warning(f"{description} failed ({error_class}: {e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+            attempt += 1
+
+def file_entry(item, gd_parent_id, path):
+    """Work list entry for a OneDrive file going into a Drive folder."""
+    return {
+        'type': 'file',
+        'path': path,
+        'od_id': item.get('id'),
+        'name': item.get('name'),
+        'size': item.get('size', 0),
+        'mime_type': item.get('file', {}).get('mimeType', 'application/octet-stream'),
+        'gd_parent_id': gd_parent_id,
+    }
+
+def folder_entry(od_id, path, gd_parent_id=None, gd_id=None):
+    """
+    Work list entry for a OneDrive folder. `gd_id` is set when the Drive folder
+    already exists, otherwise it is created by name under `gd_parent_id`.
+    """
+    entry = {'type': 'folder', 'path': path, 'od_id': od_id, 'name': os.path.basename(path)}
+    if gd_parent_id is not None:
+        entry['gd_parent_id'] = gd_parent_id
+    if gd_id is not None:
+        entry['gd_id'] = gd_id
+    return entry
+
+class FailureLedger:
+    """
+    Append-only JSON Lines record of the items a run could not transfer.
+    Each line is a work list entry (see file_entry and folder_entry) plus the
+    phase that failed and the error class, so a later run can retry just those.
+    The file is rewritten by every run.
+    """
+    def __init__(self, path=DEFAULT_LEDGER_PATH):
+        self.path = path
+        self.count = 0
+        self._lock = threading.Lock()
+        self._file = open(path, 'w')
+
+    def record(self, phase, error, entry):
+        line = dict(entry, phase=phase, error_class=classify(error), error=str(error),
+                    time=datetime.datetime.now().isoformat(timespec='seconds'))
+        with self._lock:
+            self._file.write(json.dumps(line) + '\n')
+            self._file.flush()
+            self.count += 1
+
+    def carry(self, entry):
+        """Copies an entry of an earlier ledger or work list that this run did not attempt."""
+        with self._lock:
+            self._file.write(json.dumps(entry) + '\n')
+            self._file.flush()
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+def load_work_list(path, skip_permanent=False):
+    """
+    Reads a ledger and returns one work list entry per failed item.
+    With `skip_permanent`, items whose last failure was permanent are left out.
+    """
+    entries = {}
+    with open(path, 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            entries[(entry.get('pair'), entry['type'], entry['od_id'], entry.get('gd_parent_id'), entry.get('gd_id'))] = entry
+
+    if skip_permanent:
+        return [e for e in entries.values() if e['error_class'] != PERMANENT]
+    return list(entries.values())
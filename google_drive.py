@@ -1,31 +1,91 @@
 import os
 import json
 import logging
+import functools
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaIoBaseUpload
 
+import metrics
+import tracing
+
 # If modifying these scopes, delete the file token_google.json.
 SCOPES = ['https://www.googleapis.com/auth/drive']
+DEFAULT_TOKEN_FILE = 'token_google.json'
 
 logger = logging.getLogger(__name__)
 
+# Root URL of the Drive API. Only overridden to point at a local stand-in
+# server, e.g. by the benchmark harness in benchmarks/.
+API_ROOT_URL = None
+
+# Bundled Drive v3 discovery document, trimmed to the about, changes, drives
+# and files resources and the schemas they reference.
+DISCOVERY_DOCUMENT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'drive_v3_discovery.json')
+
+# Reasons Drive uses in 403 responses when it wants clients to back off
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+
+def is_rate_limited(error):
+    if error.resp.status == 429:
+        return True
+    if error.resp.status == 403:
+        return any(reason in str(error.content) for reason in RATE_LIMIT_REASONS)
+    return False
+
+def _execute(request, operation):
+    """
+    Executes a Drive API request, recording its latency and any throttling.
+    """
+    with tracing.span(operation, 'drive'), metrics.API_LATENCY.labels('drive', operation).time():
+        try:
+            return request.execute()
+        except HttpError as e:
+            _record_error(e)
+            raise
+
+def _execute_resumable(request, operation):
+    """
+    Drives a resumable upload chunk by chunk, so each chunk (the last one
+    includes finalization) shows up separately in traces.
+    """
+    with metrics.API_LATENCY.labels('drive', operation).time():
+        response = None
+        chunk = 0
+        try:
+            while response is None:
+                with tracing.span('upload_chunk', 'drive', chunk=chunk):
+                    _, response = request.next_chunk()
+                chunk += 1
+        except HttpError as e:
+            _record_error(e)
+            raise
+        return response
+
+def _record_error(error):
+    metrics.API_ERRORS.labels('drive').inc()
+    if is_rate_limited(error):
+        metrics.API_THROTTLED.labels('drive').inc()
+
 def get_credentials(config):
     """
     Retrieves or generates Google Drive credentials.
+    The token is cached in google.token_file from the config (default token_google.json).
     """
+    token_file = config.get('google', {}).get('token_file', DEFAULT_TOKEN_FILE)
     creds = None
-    # The file token_google.json stores the user's access and refresh tokens, and is
+    # The token file stores the user's access and refresh tokens, and is
     # created automatically when the authorization flow completes for the first
     # time.
-    if os.path.exists('token_google.json'):
+    if os.path.exists(token_file):
         try:
-            with open('token_google.json', 'r') as token:
+            with open(token_file, 'r') as token:
                 creds = Credentials.from_authorized_user_info(json.load(token), SCOPES)
         except Exception as e:
-            logger.error(f"Error loading token_google.json: {e}")
+            logger.error(f"Error loading {token_file}: {e}")
             creds = None
 
     # If there are no (valid) credentials available, let the user log in.
@@ -58,7 +118,7 @@ def get_credentials(config):
 
         # Save the credentials for the next run
         # Securely create file with 600 permissions
-        fd = os.open('token_google.json', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        fd = os.open(token_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
         with os.fdopen(fd, 'w') as token:
             token.write(creds.to_json())
 
@@ -71,6 +131,26 @@ def authenticate(config):
     service = build('drive', 'v3', credentials=creds)
     return service
 
+@functools.lru_cache(maxsize=None)
+def _discovery_document(root_url):
+    with open(DISCOVERY_DOCUMENT, 'r') as f:
+        doc = json.load(f)
+    if root_url:
+        # The client library only swaps the host of upload URLs when given an
+        # api_endpoint, so rewrite the document instead.
+        doc['rootUrl'] = root_url.rstrip('/') + '/'
+        doc['baseUrl'] = doc['rootUrl'] + doc['servicePath']
+    # Returned as text: build_from_document modifies the parsed document,
+    # so every service gets its own copy.
+    return json.dumps(doc)
+
+def build_service(creds):
+    """
+    Builds a Drive v3 service object from the bundled discovery document.
+    Service objects are not thread-safe, so each thread needs its own.
+    """
+    return build_from_document(_discovery_document(API_ROOT_URL), credentials=creds)
+
 def create_folder(service, name, parent_id=None):
     """
     Creates a folder with the given name and parent.
@@ -83,11 +163,23 @@ def create_folder(service, name, parent_id=None):
     if parent_id:
         file_metadata['parents'] = [parent_id]
 
-    file = service.files().create(body=file_metadata, fields='id').execute()
+    file = _execute(service.files().create(body=file_metadata, fields='id', supportsAllDrives=True), 'create_folder')
     logger.info(f"Created new folder '{name}' (ID: {file.get('id')})")
     return file.get('id')
 
 
+def copy_file(service, file_id, name, parent_id):
+    """
+    Creates a copy of an existing Drive file under a new name and parent.
+    The content is duplicated server-side, so no file data is sent.
+    Returns the new file's ID.
+    """
+    file_metadata = {'name': name, 'parents': [parent_id]}
+    file = _execute(service.files().copy(fileId=file_id, body=file_metadata, fields='id', supportsAllDrives=True), 'copy')
+    logger.info(f"Copied file '{name}' from existing file {file_id} (ID: {file.get('id')})")
+    return file.get('id')
+
+
 def create_folder_if_not_exists(service, name, parent_id=None):
     """
     Checks if a folder exists with the given name and parent.
@@ -101,7 +193,7 @@ def create_folder_if_not_exists(service, name, parent_id=None):
         safe_parent_id = parent_id.replace("\\", "\\\\").replace("'", "\\'")
         query += f" and '{safe_parent_id}' in parents"
 
-    results = service.files().list(q=query, spaces='drive', fields='files(id, name)').execute()
+    results = _execute(service.files().list(q=query, spaces='drive', fields='files(id, name)'), 'find')
     items = results.get('files', [])
 
     if items:
@@ -122,7 +214,7 @@ def file_exists(service, name, parent_id=None):
         safe_parent_id = parent_id.replace("\\", "\\\\").replace("'", "\\'")
         query += f" and '{safe_parent_id}' in parents"
 
-    results = service.files().list(q=query, spaces='drive', fields='files(id, name)').execute()
+    results = _execute(service.files().list(q=query, spaces='drive', fields='files(id, name)'), 'find')
     items = results.get('files', [])
 
     if items:
@@ -148,6 +240,10 @@ class StreamWrapper:
     def tell(self):
         return self._pos
 
+def _is_seekable(stream):
+    seekable = getattr(stream, 'seekable', None)
+    return callable(seekable) and seekable()
+
 def upload_file(service, name, parent_id, data_stream, file_size, mimetype='application/octet-stream'):
     """
     Uploads a file from a stream to Google Drive.
@@ -212,6 +308,7 @@ def upload_file(service, name, parent_id, data_stream, file_size, mimetype='appl
             self._stream = stream
             self._size = size
             self._pos = 0
+            self._at_end = False
 
         def read(self, n=None):
             chunk = self._stream.read(n)
@@ -220,12 +317,16 @@ def upload_file(service, name, parent_id, data_stream, file_size, mimetype='appl
             return chunk
 
         def tell(self):
-            return self._pos
+            # MediaIoBaseUpload finds the size with seek(0, 2) followed by tell()
+            return self._size if self._at_end else self._pos
 
         def seek(self, offset, whence=0):
             # We only support seek(0, 2) to return size, or seek(0, 0) if we are at 0.
             if whence == 2 and offset == 0:
+                self._at_end = True
                 return self._size
+            # Any other seek (the library seeks to the current upload offset) ends the size probe
+            self._at_end = False
             if whence == 0 and offset == 0 and self._pos == 0:
                 return 0
             # Otherwise we can't really seek
@@ -235,23 +336,39 @@ def upload_file(service, name, parent_id, data_stream, file_size, mimetype='appl
         def seekable(self):
             return True
 
-    wrapped_stream = SizeableStream(data_stream, file_size)
-    media = MediaIoBaseUpload(wrapped_stream, mimetype=mimetype, resumable=True)
+    if _is_seekable(data_stream):
+        # Local files (e.g. from the spool) can be handed over as-is, which also
+        # lets the client library rewind and resend a chunk on its own.
+        media = MediaIoBaseUpload(data_stream, mimetype=mimetype, resumable=True)
+    else:
+        wrapped_stream = SizeableStream(data_stream, file_size)
+        media = MediaIoBaseUpload(wrapped_stream, mimetype=mimetype, resumable=True)
 
     logger.info(f"Uploading file '{name}'...")
-    file = service.files().create(body=file_metadata, media_body=media, fields='id').execute()
+    file = _execute_resumable(service.files().create(body=file_metadata, media_body=media, fields='id', supportsAllDrives=True), 'upload')
     logger.info(f"Uploaded file '{name}' (ID: {file.get('id')})")
     return file.get('id')
 
 
-def list_folder_contents(service, parent_id):
+# File fields requested when listing folders; size tells whether an earlier
+# run's archive of a packed folder is complete and current
+LIST_FIELDS = 'id, name, mimeType, size'
+# Adds what is needed to compare files against the source without downloading them
+CHECKSUM_FIELDS = 'id, name, mimeType, size, md5Checksum, sha1Checksum, sha256Checksum'
+
+def list_folder_items(service, parent_id, fields=LIST_FIELDS, drive_id=None):
     """
     Lists all files and folders in a specific Google Drive folder.
-    Returns a dictionary mapping names to metadata (id, name, mimeType).
+    Returns a list of file resources with the requested fields.
+    Pass `drive_id` for folders in a shared drive.
     """
-    files_map = {}
+    items = []
     page_token = None
 
+    drive_args = {}
+    if drive_id:
+        drive_args = dict(corpora='drive', driveId=drive_id, includeItemsFromAllDrives=True, supportsAllDrives=True)
+
     # Escape backslashes and single quotes for safety
     safe_parent_id = parent_id.replace("\\", "\\\\").replace("'", "\\'")
 
@@ -260,22 +377,77 @@ def list_folder_contents(service, parent_id):
 
     while True:
         try:
-            results = service.files().list(
+            results = _execute(service.files().list(
                 q=query,
                 spaces='drive',
-                fields='nextPageToken, files(id, name, mimeType)',
+                fields=f'nextPageToken, files({fields})',
                 pageToken=page_token,
-                pageSize=1000  # Maximize page size to reduce calls
-            ).execute()
+                pageSize=1000,  # Maximize page size to reduce calls
+                **drive_args
+            ), 'list')
         except Exception as e:
             logger.error(f"Error listing folder contents: {e}")
             raise
 
-        for file in results.get('files', []):
-            files_map[file['name']] = file
+        items.extend(results.get('files', []))
 
         page_token = results.get('nextPageToken')
         if not page_token:
             break
 
-    return files_map
+    return items
+
+def list_folder_contents(service, parent_id, drive_id=None):
+    """
+    Lists all files and folders in a specific Google Drive folder.
+    Returns a dictionary mapping names to metadata (id, name, mimeType, size).
+    """
+    return {file['name']: file for file in list_folder_items(service, parent_id, drive_id=drive_id)}
+
+# Kept in the destination listing cache (see listing_cache.py)
+CACHE_FIELDS = 'id, name, mimeType, size, md5Checksum'
+CHANGE_FIELDS = f'nextPageToken, newStartPageToken, changes(fileId, removed, file(parents, trashed, {CACHE_FIELDS}))'
+
+def _drive_args(drive_id):
+    if drive_id:
+        return dict(driveId=drive_id, supportsAllDrives=True)
+    return {}
+
+def get_root_id(service):
+    """
+    Returns the real id of My Drive's root folder. Requests accept the alias
+    'root', but responses such as the changes feed report this id.
+    """
+    return _execute(service.files().get(fileId='root', fields='id'), 'get')['id']
+
+def get_start_page_token(service, drive_id=None):
+    """
+    Returns a token for the changes feed from now on, for My Drive or the
+    shared drive `drive_id`.
+    """
+    return _execute(service.changes().getStartPageToken(**_drive_args(drive_id)), 'changes')['startPageToken']
+
+def list_changes(service, page_token, drive_id=None):
+    """
+    Reads the changes feed from `page_token` to its end.
+    Returns (changes, token to continue from next time).
+    """
+    changes = []
+    drive_args = _drive_args(drive_id)
+    if drive_id:
+        drive_args['includeItemsFromAllDrives'] = True
+
+    while True:
+        results = _execute(service.changes().list(
+            pageToken=page_token,
+            spaces='drive',
+            includeRemoved=True,
+            fields=CHANGE_FIELDS,
+            pageSize=1000,
+            **drive_args
+        ), 'changes')
+        changes.extend(results.get('changes', []))
+
+        if 'newStartPageToken' in results:
+            return changes, results['newStartPageToken']
+        page_token = results['nextPageToken']
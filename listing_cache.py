@@ -0,0 +1,171 @@
+import logging
+import sqlite3
+import datetime
+import threading
+
+from googleapiclient.errors import HttpError
+
+import google_drive
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = 'listing_cache.db'
+
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+
+# Seconds a process waits for another one holding the database lock
+BUSY_TIMEOUT = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    id TEXT PRIMARY KEY,
+    parent TEXT,
+    name TEXT NOT NULL,
+    mime_type TEXT NOT NULL,
+    size INTEGER,
+    md5 TEXT
+);
+CREATE INDEX IF NOT EXISTS items_parent ON items (parent);
+-- Folders whose children are all in `items`
+CREATE TABLE IF NOT EXISTS folders (
+    id TEXT PRIMARY KEY,
+    listed_at TEXT NOT NULL
+);
+-- Changes feed position per migration pair and destination drive
+CREATE TABLE IF NOT EXISTS page_tokens (
+    key TEXT PRIMARY KEY,
+    token TEXT NOT NULL
+);
+"""
+
+def _now():
+    return datetime.datetime.now().isoformat(timespec='seconds')
+
+def _row(item, parent_id):
+    size = item.get('size')
+    return (item['id'], parent_id, item['name'], item['mimeType'], int(size) if size is not None else None, item.get('md5Checksum'))
+
+def _resource(row):
+    """A cached row in the shape files().list returns it."""
+    item_id, name, mime_type, size, md5 = row
+    item = {'id': item_id, 'name': name, 'mimeType': mime_type}
+    if size is not None:
+        item['size'] = str(size)
+    if md5 is not None:
+        item['md5Checksum'] = md5
+    return item
+
+class ListingCache:
+    """
+    Persistent copy of the destination tree in SQLite, so folders do not have
+    to be listed again by later runs or by other processes.
+
+    A folder is served from the cache once it has been listed in full. It is
+    kept current by recording the tool's own writes, and by reading the Drive
+    changes feed from a saved page token at the start of each run.
+    """
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        # Shared by the worker threads, which take turns through the lock
+        self._conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        # WAL lets other processes read while one writes
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+
+    def folder(self, folder_id):
+        """
+        Returns the children of a folder as a name -> resource dict, like
+        google_drive.list_folder_contents, or None if it is not cached.
+        """
+        with self._lock:
+            if self._conn.execute('SELECT 1 FROM folders WHERE id = ?', (folder_id,)).fetchone() is None:
+                return None
+            rows = self._conn.execute('SELECT id, name, mime_type, size, md5 FROM items WHERE parent = ?', (folder_id,)).fetchall()
+        return {row[1]: _resource(row) for row in rows}
+
+    def store_folder(self, folder_id, items):
+        """Replaces the cached children of a folder with a complete listing."""
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM items WHERE parent = ?', (folder_id,))
+            self._conn.executemany('INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?, ?)', [_row(item, folder_id) for item in items])
+            self._conn.execute('INSERT OR REPLACE INTO folders VALUES (?, ?)', (folder_id, _now()))
+
+    def record(self, item, parent_id):
+        """
+        Adds a file or folder the tool created. A new folder is empty, so it
+        counts as listed.
+        """
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?, ?)', _row(item, parent_id))
+            if item['mimeType'] == FOLDER_MIME:
+                self._conn.execute('INSERT OR IGNORE INTO folders VALUES (?, ?)', (item['id'], _now()))
+
+    def apply_changes(self, changes):
+        """Applies entries of the Drive changes feed."""
+        with self._lock, self._conn:
+            for change in changes:
+                file = change.get('file')
+                if change.get('removed') or file is None or file.get('trashed'):
+                    self._conn.execute('DELETE FROM items WHERE id = ?', (change['fileId'],))
+                    self._conn.execute('DELETE FROM folders WHERE id = ?', (change['fileId'],))
+                    continue
+                # Drive items have a single parent
+                parent_id = (file.get('parents') or [None])[0]
+                known = self._conn.execute(
+                    'SELECT 1 FROM folders WHERE id = ? UNION ALL SELECT 1 FROM items WHERE id = ?', (parent_id, change['fileId'])).fetchone()
+                if known is None:
+                    # Outside the folders the tool works in
+                    continue
+                self._conn.execute('INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?, ?)', _row(file, parent_id))
+
+    def page_token(self, key):
+        with self._lock:
+            row = self._conn.execute('SELECT token FROM page_tokens WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def save_page_token(self, key, token):
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO page_tokens VALUES (?, ?)', (key, token))
+
+    def refresh(self, service, key, drive_id=None):
+        """
+        Applies what changed in Drive since the last run that used `key`.
+        The first run only saves the current position, before anything is
+        listed, so nothing that happens from then on is missed. If Drive
+        rejects the saved position as invalid (HTTP 400), the cache is reset
+        and starts over; any other error is raised. Returns the number of
+        changes applied.
+        """
+        token = self.page_token(key)
+        if token is None:
+            self.save_page_token(key, google_drive.get_start_page_token(service, drive_id))
+            return 0
+        try:
+            changes, new_token = google_drive.list_changes(service, token, drive_id)
+        except HttpError as e:
+            # Permission and other errors say nothing about the cached folders
+            if e.resp.status != 400:
+                raise
+            logger.warning(f"Drive rejected the changes feed position for {key} ({e}), clearing the listing cache.")
+            self.reset()
+            self.save_page_token(key, google_drive.get_start_page_token(service, drive_id))
+            return 0
+        self.apply_changes(changes)
+        self.save_page_token(key, new_token)
+        return len(changes)
+
+    def reset(self):
+        """
+        Forgets every cached folder, for when the changes feed can no longer
+        be followed. Page tokens are kept: anything cached from now on was
+        listed after them, so other pairs can keep applying changes from there.
+        """
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM items')
+            self._conn.execute('DELETE FROM folders')
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,6 +1,199 @@
-def main():
-    print("Hello from myapp!")
+"""
+Command line entry point for the OneDrive to Google Drive migration tool.
+
+Heavy dependencies (googleapiclient, msal, requests) are imported inside the
+subcommands that need them, so `--help` and listing-only commands start fast.
+"""
+import sys
+import logging
+import argparse
+
+from config import DEFAULT_CONFIG_PATH
+
+LOG_FILE = 'migration.log'
+
+def configure_logging(verbose=False, log_file=LOG_FILE):
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.insert(0, logging.FileHandler(log_file))
+    logging.basicConfig(
+        level=logging.DEBUG if verbose else logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=handlers
+    )
+
+def _load_config(args):
+    """Loads the config with command line overrides. Logs and returns None if it cannot be read."""
+    from config import load_config
+
+    try:
+        config = load_config(args.config)
+    except Exception as e:
+        logging.getLogger(__name__).error(f"Could not load {args.config}: {e}")
+        return None
+    if args.workers is not None:
+        config['workers'] = args.workers
+    return config
+
+def _single_pair(config, command):
+    """
+    The config and roots of the one pair `command` checks: the whole config, or
+    its only entry in "migrations". Logs and returns None if it lists several.
+    """
+    from pairs import pair_config, pair_roots
+
+    specs = config.get('migrations')
+    if not specs:
+        return config, 'root', 'root'
+    if len(specs) > 1:
+        logging.getLogger(__name__).error(
+            f"`{command}` checks a single drive, but the config lists {len(specs)} migrations. "
+            "Use a config with only the pair to check.")
+        return None
+    od_root_id, gd_root_id, _ = pair_roots(specs[0])
+    return pair_config(config, specs[0]), od_root_id, gd_root_id
+
+def _authenticate_onedrive(config):
+    from onedrive import OneDriveClient
+
+    od_client = OneDriveClient(config)
+    od_client.authenticate()
+    return od_client
+
+def cmd_migrate(args):
+    import migrate
+
+    config = _load_config(args)
+    if config is None:
+        return 1
+
+    work_list = None
+    if args.work_list:
+        import verify
+        work_list = verify.load_work_list(args.work_list)
+    return migrate.main(config, work_list)
+
+def cmd_retry_failed(args):
+    import failures
+    import migrate
+
+    config = _load_config(args)
+    if config is None:
+        return 1
+    try:
+        path = args.ledger or config.get('failure_ledger', failures.DEFAULT_LEDGER_PATH)
+        # Read before the run starts, since it rewrites the ledger with what still fails
+        work_list = failures.load_work_list(path, skip_permanent=args.skip_permanent)
+    except Exception as e:
+        logging.getLogger(__name__).error(e)
+        return 1
+
+    if not work_list:
+        logging.getLogger(__name__).info(f"Nothing to retry in {path}.")
+        return 0
+    return migrate.main(config, work_list)
+
+def cmd_plan(args):
+    import plan
+
+    config = _load_config(args)
+    if config is None:
+        return 1
+    pair = _single_pair(config, 'plan')
+    if pair is None:
+        return 1
+    config, od_root_id, _ = pair
+    try:
+        od_client = _authenticate_onedrive(config)
+    except Exception as e:
+        logging.getLogger(__name__).error(f"OneDrive Authentication failed: {e}")
+        return 1
+    result = plan.build_plan(od_client, od_root_id, workers=args.list_workers)
+    print(plan.format_plan(result))
+    if args.output:
+        plan.write_plan(result, args.output)
+    return 1 if result['errors'] else 0
+
+def cmd_verify(args):
+    import google_drive
+    import verify
+
+    config = _load_config(args)
+    if config is None:
+        return 1
+    pair = _single_pair(config, 'verify')
+    if pair is None:
+        return 1
+    config, od_root_id, gd_root_id = pair
+    try:
+        creds = google_drive.get_credentials(config)
+    except Exception as e:
+        logging.getLogger(__name__).error(f"Google Drive Authentication failed: {e}")
+        return 1
+    try:
+        od_client = _authenticate_onedrive(config)
+    except Exception as e:
+        logging.getLogger(__name__).error(f"OneDrive Authentication failed: {e}")
+        return 1
+    report = verify.verify(od_client, creds, od_root_id, gd_root_id, workers=args.list_workers)
+    verify.write_report(report, args.output)
+    print(verify.format_summary(report))
+    summary = report['summary']
+    return 1 if summary['missing'] or summary['mismatched'] or summary['errors'] else 0
+
+def cmd_bench(args):
+    from benchmarks import harness
+
+    harness.main(args.harness_args)
+    return 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='main.py', description="Migrate files from OneDrive to Google Drive.")
+    parser.add_argument('--config', default=DEFAULT_CONFIG_PATH, help="Path to config.json (default: %(default)s)")
+    parser.add_argument('--workers', type=int, help="Number of transfer worker threads")
+    parser.add_argument('-v', '--verbose', action='store_true', help="Enable debug logging")
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+
+    migrate_parser = subparsers.add_parser('migrate', help="Copy the OneDrive tree into Google Drive")
+    migrate_parser.add_argument('--work-list', help="Only transfer the missing and mismatched entries of a verify report")
+    migrate_parser.set_defaults(func=cmd_migrate)
+
+    retry_parser = subparsers.add_parser('retry-failed', help="Retry only the items recorded in the failure ledger")
+    retry_parser.add_argument('--ledger', help="Failure ledger to read (default: failure_ledger from config, or failures.jsonl)")
+    retry_parser.add_argument('--skip-permanent', action='store_true', help="Leave out items whose failure was classified permanent")
+    retry_parser.set_defaults(func=cmd_retry_failed)
+
+    plan_parser = subparsers.add_parser('plan', help="List the OneDrive tree and summarise what would be transferred")
+    plan_parser.add_argument('--list-workers', type=int, default=8, help="Folders listed concurrently (default: %(default)s)")
+    plan_parser.add_argument('--output', help="Also write the plan as JSON to this file")
+    plan_parser.set_defaults(func=cmd_plan)
+
+    verify_parser = subparsers.add_parser('verify', help="Compare both trees by listing only and write a diff")
+    verify_parser.add_argument('--list-workers', type=int, default=16, help="Folders compared concurrently (default: %(default)s)")
+    verify_parser.add_argument('--output', default='verify.json', help="Where to write the diff (default: %(default)s)")
+    verify_parser.set_defaults(func=cmd_verify)
+
+    # Everything after 'bench' is handed to benchmarks.harness, including --help
+    bench_parser = subparsers.add_parser('bench', help="Benchmark against local fake Graph and Drive servers", add_help=False)
+    bench_parser.set_defaults(func=cmd_bench)
+
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args, extra = parser.parse_known_args(argv)
+    if args.command == 'bench':
+        args.harness_args = extra
+    elif extra:
+        parser.error(f"unrecognized arguments: {' '.join(extra)}")
+    if not args.command:
+        parser.print_help()
+        return 2
+
+    # Benchmarks write their own report; everything else logs like the migration
+    configure_logging(args.verbose, log_file=None if args.command == 'bench' else LOG_FILE)
+    return args.func(args)
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,320 @@
+import time
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds. Uploads of large files can legitimately take minutes.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+class _Value:
+    """A single counter or gauge value. Updates are a lock and an add."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self._value -= amount
+
+    def set(self, value):
+        with self._lock:
+            self._value = value
+
+    def get(self):
+        with self._lock:
+            return self._value
+
+
+class _Timer:
+    __slots__ = ('_histogram', '_start')
+
+    def __init__(self, histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._histogram.observe(time.perf_counter() - self._start)
+        return False
+
+
+class _HistogramValue:
+    """Fixed-bucket histogram. `observe` is a bisect plus three adds under a lock."""
+    def __init__(self, buckets):
+        self._lock = threading.Lock()
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self._sum = 0.0
+        self._count = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def time(self):
+        """Context manager that observes the duration of the block."""
+        return _Timer(self)
+
+    def snapshot(self):
+        with self._lock:
+            return list(self._counts), self._sum, self._count
+
+    def quantile(self, q):
+        """
+        Estimates a quantile as the upper bound of the bucket it falls in.
+        Returns None if nothing has been observed yet.
+        """
+        counts, _, total = self.snapshot()
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for bound, count in zip(self._buckets, counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class _Metric:
+    """
+    A named metric with optional labels. Metrics without labels can be updated
+    directly; labelled ones go through `labels(...)` first.
+    """
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def children(self):
+        with self._lock:
+            return list(self._children.items())
+
+    def __getattr__(self, attr):
+        # Forward inc/set/observe/... for unlabelled metrics
+        if attr.startswith('_') or not self.__dict__.get('_default'):
+            raise AttributeError(attr)
+        return getattr(self._default, attr)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _Value()
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def __iter__(self):
+        return iter(list(self._metrics))
+
+
+REGISTRY = Registry()
+
+# Throughput
+FILES_TRANSFERRED = REGISTRY.register(Counter('migration_files_transferred_total', 'Files uploaded to Google Drive'))
+BYTES_TRANSFERRED = REGISTRY.register(Counter('migration_bytes_transferred_total', 'Bytes uploaded to Google Drive'))
+FILES_FAILED = REGISTRY.register(Counter('migration_files_failed_total', 'Files that could not be transferred'))
+FILES_COPIED = REGISTRY.register(Counter('migration_files_copied_total', 'Duplicate files created with a server-side Drive copy'))
+BYTES_COPIED = REGISTRY.register(Counter('migration_bytes_copied_total', 'Bytes of duplicate files that did not need uploading'))
+FILES_PACKED = REGISTRY.register(Counter('migration_files_packed_total', 'Files uploaded inside a tar archive'))
+ARCHIVES_UPLOADED = REGISTRY.register(Counter('migration_archives_uploaded_total', 'Tar archives of small-file folders uploaded to Google Drive'))
+# Per migration pair (source drive -> destination), for runs that migrate several
+PAIR_FILES = REGISTRY.register(Counter('migration_pair_files_total', 'Files uploaded or copied, per migration pair', ('pair',)))
+PAIR_BYTES = REGISTRY.register(Counter('migration_pair_bytes_total', 'Bytes uploaded, per migration pair', ('pair',)))
+PAIR_FAILED = REGISTRY.register(Counter('migration_pair_files_failed_total', 'Files that could not be transferred, per migration pair', ('pair',)))
+FOLDERS_SCANNED = REGISTRY.register(Counter('migration_folders_scanned_total', 'OneDrive folders listed'))
+DESTINATION_LISTINGS = REGISTRY.register(Counter('migration_destination_listings_total', 'Google Drive folder contents looked up, by where they came from', ('source',)))
+
+# Pipeline state
+QUEUE_DEPTH = REGISTRY.register(Gauge('migration_queue_depth', 'Files waiting for a transfer worker'))
+SPOOL_USED_BYTES = REGISTRY.register(Gauge('migration_spool_used_bytes', 'Bytes reserved in the download spool'))
+
+# API calls, labelled by api ("graph" or "drive") and operation
+API_LATENCY = REGISTRY.register(Histogram('migration_api_request_seconds', 'Latency of Graph and Drive API calls', ('api', 'operation')))
+API_THROTTLED = REGISTRY.register(Counter('migration_api_throttled_total', 'API responses that asked us to slow down', ('api',)))
+API_ERRORS = REGISTRY.register(Counter('migration_api_errors_total', 'Failed API calls, including throttled ones', ('api',)))
+RETRIES = REGISTRY.register(Counter('migration_retries_total', 'Operations retried after a transient or throttled failure', ('error_class',)))
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = []
+    for name, value in pairs:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{name}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+
+def render_prometheus(registry=REGISTRY):
+    """
+    Renders all metrics in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in registry:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for values, child in metric.children():
+            if metric.kind == 'histogram':
+                counts, total_sum, total_count = child.snapshot()
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    labels = _format_labels(metric.labelnames, values, ('le', _format_bound(bound)))
+                    lines.append(f"{metric.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(metric.labelnames, values)
+                lines.append(f"{metric.name}_sum{labels} {total_sum}")
+                lines.append(f"{metric.name}_count{labels} {total_count}")
+            else:
+                labels = _format_labels(metric.labelnames, values)
+                lines.append(f"{metric.name}{labels} {child.get()}")
+    return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes are frequent, keep them out of migration.log
+        pass
+
+
+def start_http_server(port, addr='127.0.0.1'):
+    """
+    Serves /metrics on a daemon thread. Binds to localhost unless told otherwise.
+    Returns the server so callers can shut it down.
+    """
+    server = ThreadingHTTPServer((addr, port), _MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True)
+    thread.start()
+    logger.info(f"Serving metrics on http://{addr}:{server.server_address[1]}/metrics")
+    return server
+
+
+def _p99(api):
+    """Worst p99 across all operations of one API."""
+    worst = None
+    for (child_api, _), child in API_LATENCY.children():
+        if child_api != api:
+            continue
+        value = child.quantile(0.99)
+        if value is not None and (worst is None or value > worst):
+            worst = value
+    return worst
+
+
+def _format_seconds(value):
+    return 'n/a' if value is None else f"{value:g}s"
+
+
+class SummaryLogger:
+    """
+    Logs a one-line progress summary every `interval` seconds on a daemon thread.
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='metrics-summary', daemon=True)
+        self._last = (time.monotonic(), 0, 0)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.log_summary()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.log_summary()
+
+    def log_summary(self):
+        now = time.monotonic()
+        files = FILES_TRANSFERRED.get()
+        transferred = BYTES_TRANSFERRED.get()
+        last_time, last_files, last_bytes = self._last
+        elapsed = max(now - last_time, 1e-9)
+        self._last = (now, files, transferred)
+
+        logger.info(
+            f"Progress: {files} files ({(files - last_files) / elapsed:.1f}/s), "
+            f"{transferred / 1e6:.1f} MB ({(transferred - last_bytes) / 1e6 / elapsed:.2f} MB/s), "
+            f"{FILES_COPIED.get()} copied, {FILES_PACKED.get()} packed, {FILES_FAILED.get()} failed, queue {QUEUE_DEPTH.get()}, "
+            f"throttled graph={API_THROTTLED.labels('graph').get()} drive={API_THROTTLED.labels('drive').get()}, "
+            f"p99 graph={_format_seconds(_p99('graph'))} drive={_format_seconds(_p99('drive'))}"
+        )
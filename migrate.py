@@ -1,36 +1,36 @@
+import io
 import os
-import json
+import sys
 import logging
 import datetime
 import concurrent.futures
 import threading
 
 # Import our modules
+import failures
 import google_drive
-from onedrive import OneDriveClient
+import metrics
+import packing
+import tracing
+from config import load_config
+from pairs import MigrationPair, DEFAULT_PAIR, build_pairs
+from scheduler import FairExecutor
+from spool import SpoolDirectory
+from content_index import ContentIndex, DEFAULT_MIN_SIZE as DEFAULT_DEDUP_MIN_SIZE
+from listing_cache import ListingCache, DEFAULT_CACHE_PATH
 
 # Global thread-local storage for thread-safe Google Drive service access
 thread_local_data = threading.local()
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("migration.log"),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
-def load_config():
-    config_path = 'config.json'
-    if not os.path.exists(config_path):
-        logger.error(f"Configuration file {config_path} not found. Please rename config_template.json and fill in your keys.")
-        raise FileNotFoundError("config.json not found")
+DEFAULT_WORKERS = 5
 
-    with open(config_path, 'r') as f:
-        return json.load(f)
+# Seconds between progress summary lines, override with "metrics": {"summary_interval": ...}
+DEFAULT_SUMMARY_INTERVAL = 60
+
+# Optional download spool, enabled by a "spool" section in config.json
+DEFAULT_SPOOL_UPLOAD_WORKERS = 5
 
 def get_timestamped_name(filename):
     """
@@ -43,21 +43,85 @@ def get_timestamped_name(filename):
 
 def get_thread_safe_service(creds):
     """
-    Returns a thread-local Google Drive service instance.
+    Returns a thread-local Google Drive service instance for `creds`.
     """
-    if not hasattr(thread_local_data, 'service'):
+    if not hasattr(thread_local_data, 'services'):
+        thread_local_data.services = {}
+    # Workers are shared by migration pairs, each with its own credentials
+    service = thread_local_data.services.get(id(creds))
+    if service is None:
         # Re-build service for this thread to ensure thread safety
-        thread_local_data.service = google_drive.build('drive', 'v3', credentials=creds)
-    return thread_local_data.service
+        service = thread_local_data.services[id(creds)] = google_drive.build_service(creds)
+    return service
+
+def _record_failure(ledger, phase, error, entry, pair=None):
+    if ledger:
+        if pair:
+            entry = dict(entry, pair=pair.name)
+        ledger.record(phase, error, entry)
+
+def _cache_id(pair, gd_folder_id):
+    """
+    The id a folder has in the listing cache. The changes feed reports the
+    real id of My Drive's root, never the 'root' alias.
+    """
+    if gd_folder_id == 'root' and pair.gd_my_drive_id:
+        return pair.gd_my_drive_id
+    return gd_folder_id
 
-def process_file_upload(od_client, creds, item, gd_parent_id, current_path, gd_folder_contents):
+def list_destination(gd_service, gd_parent_id, pair=None):
+    """
+    Returns the contents of a Drive folder as a name -> resource dict, from the
+    listing cache of `pair` if it holds the folder, otherwise from the API.
+    """
+    gd_drive_id = pair.gd_drive_id if pair else None
+    cache = pair.listing_cache if pair else None
+    if cache is None:
+        metrics.DESTINATION_LISTINGS.labels('api').inc()
+        return google_drive.list_folder_contents(gd_service, gd_parent_id, gd_drive_id)
+
+    cache_id = _cache_id(pair, gd_parent_id)
+    contents = cache.folder(cache_id)
+    if contents is not None:
+        metrics.DESTINATION_LISTINGS.labels('cache').inc()
+        return contents
+    metrics.DESTINATION_LISTINGS.labels('api').inc()
+    items = google_drive.list_folder_items(gd_service, gd_parent_id, google_drive.CACHE_FIELDS, gd_drive_id)
+    cache.store_folder(cache_id, items)
+    return {file['name']: file for file in items}
+
+def _remember(pair, gd_id, name, gd_parent_id, mime_type, size=None):
+    """Adds a file or folder this run created to the listing cache."""
+    if pair and pair.listing_cache is not None and gd_id:
+        pair.listing_cache.record({'id': gd_id, 'name': name, 'mimeType': mime_type, 'size': size}, _cache_id(pair, gd_parent_id))
+
+def _count_transferred(pair, size):
+    metrics.FILES_TRANSFERRED.inc()
+    metrics.BYTES_TRANSFERRED.inc(size)
+    if pair:
+        pair.files.inc()
+        pair.bytes.inc(size)
+
+def _count_failed(pair):
+    metrics.FILES_FAILED.inc()
+    if pair:
+        pair.failed.inc()
+
+def process_file_upload(od_client, creds, item, gd_parent_id, current_path, gd_folder_contents, spool=None, upload_executor=None, ledger=None, content_index=None, pair=None):
     """
     Handles the upload of a single file in a thread-safe manner.
+    If a spool is given, the file is downloaded into it and the upload is handed
+    off to `upload_executor`, so this worker can move on to the next download.
+    If a content index is given, files already uploaded elsewhere are copied in Drive instead.
+    Transient failures are retried; what still fails is recorded in `ledger`.
+    Uploads count against the upload quota of `pair`, if it has one.
     """
+    metrics.QUEUE_DEPTH.dec()
+    entry = failures.file_entry(item, gd_parent_id, current_path)
+    phase = 'transfer'
+    claim = None
+    reserved = 0
     try:
-        # Use thread-local service
-        gd_service = get_thread_safe_service(creds)
-
         item_name = item.get('name')
         item_id = item.get('id')
 
@@ -80,32 +144,258 @@ def process_file_upload(od_client, creds, item, gd_parent_id, current_path, gd_f
         file_size = item.get('size', 0)
         file_mime = item.get('file', {}).get('mimeType', 'application/octet-stream')
 
-        # Get stream from OneDrive
-        file_stream = od_client.get_file_stream(item_id)
+        if content_index is not None:
+            with tracing.span('dedup_lookup', 'worker', path=current_path):
+                source_id, claim = content_index.claim(item)
+            if source_id and copy_duplicate(creds, source_id, target_name, gd_parent_id, file_size, current_path, pair, file_mime):
+                return
+
+        if pair:
+            pair.reserve(file_size)
+            reserved = file_size
+
+        if spool and upload_executor and spool.fits(file_size):
+            phase = 'download'
+            # Blocks while the spool is full, i.e. until uploads catch up
+            spooled = spool.reserve(file_size)
+            try:
+                with tracing.span('spool_write', 'worker', path=current_path, size=file_size):
+                    failures.call_with_retries(lambda: spooled.write_from(od_client.get_file_stream(item_id)), f"Download of {current_path}")
+            except Exception:
+                spooled.discard()
+                raise
+
+            upload_executor.submit(tracing.queued(upload_spooled_file, 'upload_queue_wait', path=current_path), creds, spooled, target_name, gd_parent_id, file_mime, current_path, ledger, entry, claim, pair)
+            # The upload worker resolves the claim and the quota reservation now
+            claim = None
+            return
+
+        # Use thread-local service
+        gd_service = get_thread_safe_service(creds)
+
+        def transfer():
+            # Get stream from OneDrive
+            file_stream = od_client.get_file_stream(item_id)
 
-        # Upload to Google Drive
-        google_drive.upload_file(gd_service, target_name, gd_parent_id, file_stream, file_size, file_mime)
+            # Upload to Google Drive
+            return google_drive.upload_file(gd_service, target_name, gd_parent_id, file_stream, file_size, file_mime)
+
+        with tracing.span('transfer', 'worker', path=current_path, size=file_size):
+            # A retry downloads the file again; the stream cannot be rewound
+            gd_id = failures.call_with_retries(transfer, f"Transfer of {current_path}")
+        _count_transferred(pair, file_size)
+        _remember(pair, gd_id, target_name, gd_parent_id, file_mime, file_size)
+        if claim:
+            claim.complete(gd_id)
 
     except Exception as e:
+        _count_failed(pair)
         logger.error(f"Error transferring file {current_path}: {e}")
+        _record_failure(ledger, phase, e, entry, pair)
+        if reserved:
+            pair.release(reserved)
+    finally:
+        # Let workers waiting on this content upload it themselves
+        if claim:
+            claim.abandon()
+
+def copy_duplicate(creds, source_id, target_name, gd_parent_id, file_size, current_path, pair=None, file_mime='application/octet-stream'):
+    """
+    Creates a file as a Drive-side copy of identical content that was already
+    uploaded. Returns False if the copy failed and the file should be uploaded.
+    """
+    gd_service = get_thread_safe_service(creds)
+    try:
+        with tracing.span('copy', 'worker', path=current_path, size=file_size):
+            gd_id = failures.call_with_retries(lambda: google_drive.copy_file(gd_service, source_id, target_name, gd_parent_id), f"Copy of {current_path}")
+    except Exception as e:
+        logger.warning(f"Could not copy {current_path} from existing file {source_id} ({e}), uploading instead")
+        return False
+    metrics.FILES_COPIED.inc()
+    metrics.BYTES_COPIED.inc(file_size)
+    if pair:
+        pair.files.inc()
+    _remember(pair, gd_id, target_name, gd_parent_id, file_mime, file_size)
+    return True
+
+def upload_spooled_file(creds, spooled, target_name, gd_parent_id, file_mime, current_path, ledger=None, entry=None, claim=None, pair=None):
+    """
+    Uploads a file from the spool, retrying from the local copy on failure.
+    The spooled file is always discarded afterwards to free its space.
+    """
+    try:
+        gd_service = get_thread_safe_service(creds)
 
-def sync_folder(od_client, gd_service, od_folder_id, gd_parent_id, path_prefix="", executor=None, futures=None, creds=None):
+        def upload():
+            with tracing.span('upload_from_spool', 'worker', path=current_path), spooled.open() as f:
+                return google_drive.upload_file(gd_service, target_name, gd_parent_id, f, spooled.size, file_mime)
+
+        gd_id = failures.call_with_retries(upload, f"Upload of {current_path} from spool")
+        _count_transferred(pair, spooled.size)
+        _remember(pair, gd_id, target_name, gd_parent_id, file_mime, spooled.size)
+        if claim:
+            claim.complete(gd_id)
+    except Exception as e:
+        _count_failed(pair)
+        logger.error(f"Error transferring file {current_path}: {e}")
+        if entry is not None:
+            _record_failure(ledger, 'upload', e, entry, pair)
+        if pair:
+            pair.release(spooled.size)
+    finally:
+        spooled.discard()
+        if claim:
+            claim.abandon()
+
+def pack_folder(od_client, creds, archive, item_name, gd_parent_id, current_path, od_folder_id, upload_archive=True, ledger=None, pair=None):
+    """
+    Uploads the files of a folder's subtree as one tar archive, built while it
+    is uploaded, followed by its manifest. With `upload_archive` False only the
+    manifest is uploaded, for an archive that an earlier run already stored.
+    """
+    metrics.QUEUE_DEPTH.dec()
+    entry = failures.folder_entry(od_folder_id, current_path, gd_parent_id=gd_parent_id)
+    phase = 'pack'
+    reserved = 0
+    try:
+        gd_service = get_thread_safe_service(creds)
+        if upload_archive:
+            if pair:
+                pair.reserve(archive.size)
+                reserved = archive.size
+
+            def upload():
+                stream = packing.ArchiveStream(archive, od_client)
+                try:
+                    return google_drive.upload_file(gd_service, item_name + packing.ARCHIVE_SUFFIX, gd_parent_id, stream, archive.size, packing.ARCHIVE_MIME)
+                finally:
+                    stream.close()
+
+            with tracing.span('pack', 'worker', path=current_path, size=archive.size, files=len(archive)):
+                # A retry downloads every member again
+                gd_id = failures.call_with_retries(upload, f"Upload of {current_path} as an archive")
+            _remember(pair, gd_id, item_name + packing.ARCHIVE_SUFFIX, gd_parent_id, packing.ARCHIVE_MIME, archive.size)
+            metrics.ARCHIVES_UPLOADED.inc()
+            metrics.FILES_PACKED.inc(len(archive))
+            metrics.BYTES_TRANSFERRED.inc(archive.size)
+            if pair:
+                pair.files.inc(len(archive))
+                pair.bytes.inc(archive.size)
+
+        phase = 'manifest'
+        manifest = archive.manifest(current_path)
+        gd_id = failures.call_with_retries(
+            lambda: google_drive.upload_file(gd_service, item_name + packing.MANIFEST_SUFFIX, gd_parent_id, io.BytesIO(manifest), len(manifest), 'application/json'),
+            f"Upload of the manifest of {current_path}")
+        _remember(pair, gd_id, item_name + packing.MANIFEST_SUFFIX, gd_parent_id, 'application/json', len(manifest))
+        logger.info(f"Packed {len(archive)} files of {current_path} into {item_name + packing.ARCHIVE_SUFFIX}")
+
+    except Exception as e:
+        if phase == 'pack':
+            metrics.FILES_FAILED.inc(len(archive))
+            if pair:
+                pair.failed.inc(len(archive))
+            if reserved:
+                pair.release(reserved)
+        logger.error(f"Error packing folder {current_path}: {e}")
+        _record_failure(ledger, phase, e, entry, pair)
+
+def _size(gd_file):
+    """Size of a listed Drive file, None if the listing did not include it."""
+    try:
+        return int(gd_file['size'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def try_pack_folder(od_client, item, gd_parent_id, current_path, gd_folder_contents, executor=None, futures=None, creds=None, ledger=None, packer=None, pair=None, listings=None):
+    """
+    Queues a folder to be packed into one archive if `packer` says it should be.
+    Returns (packed, subtree_packer): whether it was queued (or already packed),
+    and otherwise the packer to try on its subfolders, None if none can qualify.
+    Folders already in `listings` are not listed again. If the folder is not
+    packed, the folders listed while deciding are added to `listings` for
+    sync_folder; if it is, its subtree is removed from `listings`.
+    """
+    item_name = item.get('name')
+    if item_name in gd_folder_contents:
+        # Already migrated as a folder, or the name is taken
+        return False, packer
+    if not packer.may_qualify(item):
+        return False, packer
+
+    def list_children(folder_id):
+        if listings is not None and folder_id in listings:
+            return listings[folder_id]
+        return failures.call_with_retries(lambda: list(od_client.get_drive_items(folder_id)), f"Listing folder {current_path}")
+
+    scanned = {}
+    try:
+        with tracing.span('pack_scan', 'scan', path=current_path):
+            archive, reason = packer.scan(list_children, item.get('id'), scanned)
+    except Exception as e:
+        # Synced file by file, which lists the subtree again and records what fails
+        logger.warning(f"Could not scan {current_path} for packing: {e}")
+        return False, packer
+    if archive is None:
+        if listings is not None:
+            listings.update(scanned)
+        # A subtree with too few files has no subfolder with enough of them
+        return False, None if reason == packing.TOO_FEW_FILES else packer
+
+    archive_name = item_name + packing.ARCHIVE_SUFFIX
+    existing = gd_folder_contents.get(archive_name)
+    if existing is not None and _size(existing) != archive.size:
+        # The folder changed since it was packed, or the name belongs to another file
+        logger.warning(f"{archive_name} in Google Drive does not match {current_path}, syncing it file by file")
+        if listings is not None:
+            listings.update(scanned)
+        return False, None
+    if listings is not None:
+        # Nothing below a packed folder is synced, so nothing would take these out
+        for folder_id in scanned:
+            listings.pop(folder_id, None)
+
+    upload_archive = existing is None
+    if not upload_archive and item_name + packing.MANIFEST_SUFFIX in gd_folder_contents:
+        logger.info(f"Skipping {current_path}: already packed into {archive_name}")
+        return True, None
+
+    metrics.QUEUE_DEPTH.inc()
+    args = (od_client, creds, archive, item_name, gd_parent_id, current_path, item.get('id'), upload_archive, ledger, pair)
+    if executor:
+        future = executor.submit(tracing.queued(pack_folder, path=current_path), *args)
+        if futures is not None:
+            futures.append(future)
+    else:
+        pack_folder(*args)
+    return True, None
+
+def sync_folder(od_client, gd_service, od_folder_id, gd_parent_id, path_prefix="", executor=None, futures=None, creds=None, spool=None, upload_executor=None, ledger=None, content_index=None, pair=None, packer=None, listings=None):
     """
     Recursively syncs a OneDrive folder to a Google Drive folder.
+    `listings` holds OneDrive folders already listed while scanning for packing.
     """
     logger.info(f"Scanning folder: {path_prefix if path_prefix else 'Root'}")
+    metrics.FOLDERS_SCANNED.inc()
 
     # Optimization: Pre-fetch Google Drive folder contents to avoid N API calls
     try:
-        gd_folder_contents = google_drive.list_folder_contents(gd_service, gd_parent_id)
+        with tracing.span('list_destination', 'scan', path=path_prefix):
+            gd_folder_contents = failures.call_with_retries(
+                lambda: list_destination(gd_service, gd_parent_id, pair), f"Listing Google Drive folder {gd_parent_id}")
     except Exception as e:
         logger.error(f"Failed to list Google Drive folder {gd_parent_id}: {e}")
+        _record_failure(ledger, 'list_destination', e, failures.folder_entry(od_folder_id, path_prefix, gd_id=gd_parent_id), pair)
         return
 
     try:
-        items = od_client.get_drive_items(od_folder_id)
+        items = listings.pop(od_folder_id, None) if listings else None
+        if items is None:
+            # Listed up front so a failure on a later page is retried with the rest
+            items = failures.call_with_retries(lambda: list(od_client.get_drive_items(od_folder_id)), f"Listing folder {path_prefix or 'Root'}")
     except Exception as e:
         logger.error(f"Failed to list items for folder {path_prefix}: {e}")
+        _record_failure(ledger, 'list_source', e, failures.folder_entry(od_folder_id, path_prefix, gd_id=gd_parent_id), pair)
         return
 
     for item in items:
@@ -117,6 +407,14 @@ def sync_folder(od_client, gd_service, od_folder_id, gd_parent_id, path_prefix="
 
         if item_type == 'folder':
             # Handle Folder
+            subtree_packer = packer
+            subtree_listings = listings
+            if packer and creds:
+                if subtree_listings is None:
+                    subtree_listings = {}
+                packed, subtree_packer = try_pack_folder(od_client, item, gd_parent_id, current_path, gd_folder_contents, executor, futures, creds, ledger, packer, pair, subtree_listings)
+                if packed:
+                    continue
             try:
                 # Check cache first
                 existing_folder = gd_folder_contents.get(item_name)
@@ -127,18 +425,23 @@ def sync_folder(od_client, gd_service, od_folder_id, gd_parent_id, path_prefix="
                     # Not in cache (or name conflict with file), create it
                     # Note: create_folder_if_not_exists performs a check, which is redundant if we trust our cache.
                     # Optimization: Use create_folder directly to avoid the redundant API call.
-                    gd_folder_id = google_drive.create_folder(gd_service, item_name, gd_parent_id)
-
-                # Recurse
-                sync_folder(od_client, gd_service, item_id, gd_folder_id, current_path, executor, futures, creds)
+                    gd_folder_id = failures.call_with_retries(
+                        lambda: google_drive.create_folder(gd_service, item_name, gd_parent_id), f"Creating folder {current_path}")
+                    _remember(pair, gd_folder_id, item_name, gd_parent_id, 'application/vnd.google-apps.folder')
             except Exception as e:
                 logger.error(f"Error processing folder {current_path}: {e}")
+                _record_failure(ledger, 'create_folder', e, failures.folder_entry(item_id, current_path, gd_parent_id=gd_parent_id), pair)
+                continue
+
+            # Recurse
+            sync_folder(od_client, gd_service, item_id, gd_folder_id, current_path, executor, futures, creds, spool, upload_executor, ledger, content_index, pair, subtree_packer, subtree_listings)
 
         elif item_type == 'file':
             # Handle File
             if executor and creds:
                 # Submit to thread pool
-                future = executor.submit(process_file_upload, od_client, creds, item, gd_parent_id, current_path, gd_folder_contents)
+                metrics.QUEUE_DEPTH.inc()
+                future = executor.submit(tracing.queued(process_file_upload, path=current_path), od_client, creds, item, gd_parent_id, current_path, gd_folder_contents, spool, upload_executor, ledger, content_index, pair)
                 if futures is not None:
                     futures.append(future)
             else:
@@ -147,62 +450,275 @@ def sync_folder(od_client, gd_service, od_folder_id, gd_parent_id, path_prefix="
                 # We need a creds object here if we use process_file_upload, or pass gd_service if we used the old way.
                 # But since we refactored, process_file_upload expects creds.
                 if creds:
-                    process_file_upload(od_client, creds, item, gd_parent_id, current_path, gd_folder_contents)
+                    metrics.QUEUE_DEPTH.inc()
+                    process_file_upload(od_client, creds, item, gd_parent_id, current_path, gd_folder_contents, spool, upload_executor, ledger, content_index, pair)
                 else:
                     logger.error(f"Cannot process file {current_path}: Credentials missing.")
 
-def main():
-    logger.info("Starting Migration Tool...")
+def sync_work_list(od_client, gd_service, work_list, executor=None, futures=None, creds=None, spool=None, upload_executor=None, ledger=None, content_index=None, pair=None, packer=None):
+    """
+    Transfers only the entries of a work list, from a verify report (see
+    verify.load_work_list) or a failure ledger (see failures.load_work_list).
+    Each destination folder is listed once; folders are synced in full.
+    """
+    by_parent = {}
+    for entry in work_list:
+        if entry['type'] == 'folder' and entry.get('gd_id'):
+            # Exists on both sides, but was not synced
+            sync_folder(od_client, gd_service, entry['od_id'], entry['gd_id'], entry['path'], executor, futures, creds, spool, upload_executor, ledger, content_index, pair, packer)
+            continue
+        by_parent.setdefault(entry['gd_parent_id'], []).append(entry)
+
+    for gd_parent_id, entries in by_parent.items():
+        try:
+            gd_folder_contents = failures.call_with_retries(
+                lambda: list_destination(gd_service, gd_parent_id, pair), f"Listing Google Drive folder {gd_parent_id}")
+        except Exception as e:
+            logger.error(f"Failed to list Google Drive folder {gd_parent_id}: {e}")
+            for entry in entries:
+                _record_failure(ledger, 'list_destination', e, entry, pair)
+            continue
+
+        for entry in entries:
+            if entry['type'] == 'folder':
+                folder_item = {'id': entry['od_id'], 'name': entry['name'], 'folder': {}}
+                subtree_packer = packer
+                listings = {}
+                if packer:
+                    packed, subtree_packer = try_pack_folder(od_client, folder_item, gd_parent_id, entry['path'], gd_folder_contents, executor, futures, creds, ledger, packer, pair, listings)
+                    if packed:
+                        continue
+                try:
+                    existing_folder = gd_folder_contents.get(entry['name'])
+                    if existing_folder and existing_folder['mimeType'] == 'application/vnd.google-apps.folder':
+                        gd_folder_id = existing_folder['id']
+                    else:
+                        gd_folder_id = failures.call_with_retries(
+                            lambda: google_drive.create_folder(gd_service, entry['name'], gd_parent_id), f"Creating folder {entry['path']}")
+                        _remember(pair, gd_folder_id, entry['name'], gd_parent_id, 'application/vnd.google-apps.folder')
+                except Exception as e:
+                    logger.error(f"Error processing folder {entry['path']}: {e}")
+                    _record_failure(ledger, 'create_folder', e, entry, pair)
+                    continue
+                sync_folder(od_client, gd_service, entry['od_id'], gd_folder_id, entry['path'], executor, futures, creds, spool, upload_executor, ledger, content_index, pair, subtree_packer, listings)
+                continue
+
+            # Rebuild the listing fields process_file_upload reads
+            item = {'id': entry['od_id'], 'name': entry['name'], 'size': entry['size'], 'file': {'mimeType': entry['mime_type']}}
+            metrics.QUEUE_DEPTH.inc()
+            future = executor.submit(tracing.queued(process_file_upload, path=entry['path']), od_client, creds, item, gd_parent_id, entry['path'], gd_folder_contents, spool, upload_executor, ledger, content_index, pair)
+            if futures is not None:
+                futures.append(future)
+
+def run_migration(od_client, creds, gd_service, config, od_root_id='root', gd_root_id='root', work_list=None):
+    """
+    Syncs an authenticated OneDrive folder into a Google Drive folder using the
+    worker pools and optional features (spool, metrics, tracing) set up in `config`.
+    If `work_list` is given, only those entries are transferred instead of the whole tree.
+    Returns the number of failures recorded.
+    """
+    pair = MigrationPair(DEFAULT_PAIR, od_client, creds, od_root_id, gd_root_id, gd_service=gd_service)
+    return run_pairs(config, [pair], None if work_list is None else {DEFAULT_PAIR: work_list})
 
-    # 1. Load Config
+def _refresh_listing_cache(pair, gd_service):
+    """
+    Brings the listing cache up to date with the pair's destination drive.
+    If the changes feed cannot be read, the pair lists folders from the API
+    for this run and the feed is read from the same position next time.
+    """
+    key = f"{pair.name}:{pair.gd_drive_id or 'my-drive'}"
     try:
-        config = load_config()
+        with tracing.span('refresh_listing_cache', 'scan'):
+            pair.gd_my_drive_id = failures.call_with_retries(
+                lambda: google_drive.get_root_id(gd_service), f"Looking up the My Drive root for '{pair.name}'")
+            if pair.gd_root_id == 'root':
+                pair.gd_root_id = pair.gd_my_drive_id
+            changes = failures.call_with_retries(
+                lambda: pair.listing_cache.refresh(gd_service, key, pair.gd_drive_id), f"Reading the Drive changes feed for '{pair.name}'")
+        logger.info(f"[{pair.name}] Applied {changes} Drive changes to the listing cache.")
     except Exception as e:
-        logger.error(e)
-        return
+        logger.error(f"[{pair.name}] Could not read the Drive changes feed, not using the listing cache: {e}")
+        pair.listing_cache = None
 
-    # 2. Authenticate Google Drive
-    logger.info("Authenticating with Google Drive...")
+def _crawl(pair, work_list, executor, futures, spool, upload_executor, ledger, content_index, packer):
+    """Walks one pair's tree (or work list) on its own thread, queueing file transfers."""
     try:
-        # Get credentials separately for thread safety
-        creds = google_drive.get_credentials(config)
-        # Create main thread service
-        gd_service = google_drive.build('drive', 'v3', credentials=creds)
+        gd_service = pair.gd_service or google_drive.build_service(pair.creds)
+        if pair.listing_cache is not None:
+            _refresh_listing_cache(pair, gd_service)
+        if work_list is not None:
+            logger.info(f"[{pair.name}] Transferring {len(work_list)} entries from the work list.")
+            sync_work_list(pair.od_client, gd_service, work_list, executor=executor, futures=futures, creds=pair.creds, spool=spool, upload_executor=upload_executor, ledger=ledger, content_index=content_index, pair=pair, packer=packer)
+        else:
+            sync_folder(pair.od_client, gd_service, pair.od_root_id, pair.gd_root_id, executor=executor, futures=futures, creds=pair.creds, spool=spool, upload_executor=upload_executor, ledger=ledger, content_index=content_index, pair=pair, packer=packer)
     except Exception as e:
-        logger.error(f"Google Drive Authentication failed: {e}")
-        return
+        logger.error(f"[{pair.name}] Sync failed: {e}")
 
-    # 3. Authenticate OneDrive
-    logger.info("Authenticating with OneDrive...")
-    try:
-        od_client = OneDriveClient(config)
-        od_client.authenticate()
-    except Exception as e:
-        logger.error(f"OneDrive Authentication failed: {e}")
-        return
+def run_pairs(config, pairs, work_lists=None):
+    """
+    Runs the migration of every pair at once. Each pair is crawled on its own
+    thread, and all pairs share the worker pools, which serve them in turn so
+    a large drive cannot starve a small one. With `work_lists` (pair name ->
+    entries), only pairs that have one are run, and only those entries.
+    Entries of pairs that are not run are kept in the new failure ledger.
+    Returns the number of entries in the failure ledger.
+    """
+    not_run = {}
+    if work_lists is not None:
+        names = {pair.name for pair in pairs}
+        not_run = {name: entries for name, entries in work_lists.items() if name not in names}
+        pairs = [pair for pair in pairs if pair.name in work_lists]
+
+    # Observability: periodic summary line, plus an optional Prometheus endpoint
+    metrics_config = config.get('metrics', {})
+    if metrics_config.get('port'):
+        metrics.start_http_server(metrics_config['port'], metrics_config.get('address', '127.0.0.1'))
+    summary = metrics.SummaryLogger(metrics_config.get('summary_interval', DEFAULT_SUMMARY_INTERVAL)).start()
+
+    # Optional tracing: per-file phase timeline exported as Chrome trace-event JSON
+    tracing_config = config.get('tracing')
+    if tracing_config:
+        tracing.enable(tracing_config.get('max_events', tracing.DEFAULT_MAX_EVENTS))
+
+    # Optimization: shared worker pool for parallel file uploads, fair across pairs
+    max_workers = config.get('workers', DEFAULT_WORKERS)
+    logger.info(f"Using {max_workers} worker threads for file uploads.")
 
-    # 4. Start Sync
-    logger.info("Authentication successful. Starting sync from OneDrive Root.")
+    # Optional spool: downloads fill a local directory, a separate pool drains it
+    spool = None
+    upload_pool = None
+    spool_config = config.get('spool')
+    if spool_config:
+        spool = SpoolDirectory(spool_config['path'], spool_config['max_bytes'])
+        upload_workers = spool_config.get('upload_workers', DEFAULT_SPOOL_UPLOAD_WORKERS)
+        upload_pool = FairExecutor(upload_workers, thread_name_prefix='upload')
+        logger.info(f"Spooling downloads in {spool.path} (cap {spool.max_bytes} bytes, {upload_workers} upload threads).")
+
+    # Optional deduplication: identical files after the first are copied inside Drive.
+    # Each pair has its own index, since copies cannot cross accounts.
+    dedup_config = config.get('dedup')
+    if dedup_config is not None:
+        logger.info(f"Deduplicating files of {dedup_config.get('min_size', DEFAULT_DEDUP_MIN_SIZE)} bytes or more by content hash.")
+
+    # Optional packing: subtrees of many tiny files are uploaded as one tar archive
+    packer = None
+    pack_config = config.get('pack')
+    if pack_config is not None:
+        packer = packing.PackPolicy(
+            pack_config.get('max_file_size', packing.DEFAULT_MAX_FILE_SIZE),
+            pack_config.get('min_files', packing.DEFAULT_MIN_FILES),
+            pack_config.get('max_files', packing.DEFAULT_MAX_FILES),
+            pack_config.get('prefetch', packing.DEFAULT_PREFETCH))
+        logger.info(f"Packing folders of {packer.min_files} to {packer.max_files} files under {packer.max_file_size} bytes into tar archives.")
+
+    # Optional listing cache: destination folders listed by earlier runs are not listed again
+    listing_cache = None
+    cache_config = config.get('listing_cache')
+    if cache_config is not None:
+        listing_cache = ListingCache(cache_config.get('path', DEFAULT_CACHE_PATH))
+        for pair in pairs:
+            pair.listing_cache = listing_cache
+        logger.info(f"Caching Google Drive folder listings in {listing_cache.path}.")
+
+    # Items that still fail after in-process retries, for `main.py retry-failed`
+    ledger = failures.FailureLedger(config.get('failure_ledger', failures.DEFAULT_LEDGER_PATH))
+    for name, entries in not_run.items():
+        # The ledger is rewritten, so entries of pairs that did not authenticate or were renamed would be lost
+        logger.warning(f"[{name}] No such migration pair in this run; keeping its {len(entries)} entries in {ledger.path}.")
+        for entry in entries:
+            ledger.carry(dict(entry, pair=name))
 
-    # Get OneDrive Root ID (usually 'root')
-    od_root_id = 'root'
+    futures = []
+    try:
+        with FairExecutor(max_workers, thread_name_prefix='transfer') as pool:
+            crawlers = []
+            for pair in pairs:
+                content_index = None
+                if dedup_config is not None:
+                    content_index = ContentIndex(dedup_config.get('min_size', DEFAULT_DEDUP_MIN_SIZE), dedup_config.get('allow_quickxor', False))
+                upload_executor = upload_pool.tenant(pair.name) if upload_pool else None
+                work_list = work_lists[pair.name] if work_lists is not None else None
+                crawler = threading.Thread(
+                    target=_crawl, name=f'crawl-{pair.name}',
+                    args=(pair, work_list, pool.tenant(pair.name), futures, spool, upload_executor, ledger, content_index, packer))
+                crawler.start()
+                crawlers.append(crawler)
+            for crawler in crawlers:
+                crawler.join()
+
+            # Wait for all uploads to complete
+            logger.info("Scanning complete. Waiting for file uploads to finish...")
+            concurrent.futures.wait(futures)
+    finally:
+        # Every download has finished (or failed), so all spooled uploads are queued
+        if upload_pool:
+            upload_pool.shutdown(wait=True)
+        if spool is not None:
+            spool.close()
+        summary.stop()
+        ledger.close()
+        if listing_cache is not None:
+            listing_cache.close()
+            logger.info(f"Listing cache: {metrics.DESTINATION_LISTINGS.labels('cache').get()} folders from the cache, {metrics.DESTINATION_LISTINGS.labels('api').get()} listed.")
+        if len(pairs) > 1:
+            for pair in pairs:
+                logger.info(pair.summary())
+        if ledger.count:
+            logger.warning(f"{ledger.count} failures recorded in {ledger.path}. Run `python main.py retry-failed` to retry them.")
+        if tracing_config:
+            tracing.export_chrome_trace(tracing_config.get('path', 'trace.json'))
+    return ledger.count
+
+def main(config=None, work_list=None):
+    """
+    Runs the migration described by `config`. Returns the process exit status:
+    non-zero if the config could not be loaded, a pair could not be
+    authenticated, or any item failed.
+    """
+    logger.info("Starting Migration Tool...")
 
-    # Get Google Drive Root ID
-    gd_root_id = 'root'
+    # 1. Load Config
+    if config is None:
+        try:
+            config = load_config()
+        except Exception as e:
+            logger.error(e)
+            return 1
+
+    # Entries of a verify report do not say which pair they belong to
+    specs = config.get('migrations') or [{'name': DEFAULT_PAIR}]
+    if work_list is not None and len(specs) > 1 and any('pair' not in entry for entry in work_list):
+        logger.error("config.json lists several migrations, but the work list has entries without a 'pair'. Add the pair's name to each entry.")
+        return 1
+
+    # 2. Authenticate every migration pair
+    try:
+        pairs = build_pairs(config)
+    except ValueError as e:
+        logger.error(e)
+        return 1
+    if not pairs:
+        logger.error("No migration pair could be authenticated.")
+        return 1
+    # Pairs that failed to authenticate were logged by build_pairs and are not migrated
+    unauthenticated = len(specs) - len(pairs)
 
-    # Optimization: Use ThreadPoolExecutor for parallel file uploads
-    max_workers = 5
-    logger.info(f"Using {max_workers} worker threads for file uploads.")
+    # 3. Start Sync
+    logger.info(f"Authentication successful. Starting sync of {len(pairs)} migration pair(s).")
 
-    futures = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        sync_folder(od_client, gd_service, od_root_id, gd_root_id, executor=executor, futures=futures, creds=creds)
+    work_lists = None
+    if work_list is not None:
+        # Ledger entries name the pair they belong to; others belong to the only pair
+        work_lists = {}
+        for entry in work_list:
+            work_lists.setdefault(entry.get('pair', specs[0]['name']), []).append(entry)
 
-        # Wait for all uploads to complete
-        logger.info("Scanning complete. Waiting for file uploads to finish...")
-        concurrent.futures.wait(futures)
+    failed = run_pairs(config, pairs, work_lists)
 
     logger.info("Migration completed.")
+    return 1 if failed or unauthenticated else 0
 
 if __name__ == "__main__":
-    main()
+    from main import configure_logging
+    configure_logging()
+    sys.exit(main())
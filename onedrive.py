@@ -4,22 +4,63 @@ import logging
 import requests
 import msal
 
+import metrics
+import tracing
+
 # MS Graph API endpoints
 GRAPH_API_ENDPOINT = 'https://graph.microsoft.com/v1.0'
 SCOPES = ['Files.Read']  # We only need read access to migrate
+# Reading other users' drives and SharePoint document libraries
+SHARED_SCOPES = ['Files.Read.All', 'Sites.Read.All']
+# App-only (client credentials) tokens carry the permissions granted to the app
+APP_SCOPES = ['https://graph.microsoft.com/.default']
+
+# Drive read by default. Others: /drives/{drive-id}, /users/{user-id}/drive, /sites/{site-id}/drive
+DEFAULT_DRIVE = '/me/drive'
+DEFAULT_TOKEN_CACHE = 'token_onedrive.bin'
 
 logger = logging.getLogger(__name__)
 
+class OneDriveError(Exception):
+    """A Graph API request failed with `status_code`, possibly asking us to wait `retry_after` seconds."""
+    def __init__(self, message, status_code=None, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+    @property
+    def throttled(self):
+        # Graph signals throttling with 429, and sometimes 503 with Retry-After
+        return self.status_code == 429 or (self.status_code == 503 and self.retry_after is not None)
+
+def _error(response, message):
+    """Builds the OneDriveError for a failed response and records it in metrics."""
+    try:
+        retry_after = float(response.headers['Retry-After'])
+    except (KeyError, ValueError):
+        retry_after = None
+    error = OneDriveError(message, response.status_code, retry_after)
+
+    metrics.API_ERRORS.labels('graph').inc()
+    if error.throttled:
+        metrics.API_THROTTLED.labels('graph').inc()
+    return error
+
 class OneDriveClient:
-    def __init__(self, config):
+    def __init__(self, config, session=None):
         self.client_id = config['microsoft']['client_id']
         self.client_secret = config['microsoft'].get('client_secret')
-        self.authority = "https://login.microsoftonline.com/common"
-        self.token_cache_file = "token_onedrive.bin"
+        self.authority = config['microsoft'].get('authority', "https://login.microsoftonline.com/common")
+        self.token_cache_file = config['microsoft'].get('token_cache', DEFAULT_TOKEN_CACHE)
+        self.api_endpoint = config['microsoft'].get('api_endpoint', GRAPH_API_ENDPOINT)
+        self.drive = config['microsoft'].get('drive', DEFAULT_DRIVE).rstrip('/')
+        self.app_only = config['microsoft'].get('app_only', False)
+        self.scopes = SCOPES if self.drive == DEFAULT_DRIVE else SHARED_SCOPES
         self.app = self._build_app()
         self.access_token = None
         # Optimization: Use a session for connection pooling
-        self.session = requests.Session()
+        # Clients for several drives can share one, and with it the connection pool
+        self.session = session or requests.Session()
 
     def _build_app(self):
         cache = msal.SerializableTokenCache()
@@ -51,10 +92,22 @@ class OneDriveClient:
                 f.write(cache.serialize())
 
     def authenticate(self):
+        if self.app_only:
+            # No user involved; needs a client secret and application permissions
+            if not self.client_secret:
+                raise ValueError("app_only requires a client_secret in the microsoft section")
+            result = self.app.acquire_token_for_client(scopes=APP_SCOPES)
+            if "access_token" not in result:
+                logger.error(result.get("error_description"))
+                raise Exception("Could not authenticate with OneDrive")
+            self.access_token = result['access_token']
+            logger.info("OneDrive authentication successful.")
+            return
+
         accounts = self.app.get_accounts()
         result = None
         if accounts:
-            result = self.app.acquire_token_silent(SCOPES, account=accounts[0])
+            result = self.app.acquire_token_silent(self.scopes, account=accounts[0])
 
         if not result:
             logger.info("No suitable token exists in cache. Let's get a new one from User.")
@@ -64,7 +117,7 @@ class OneDriveClient:
             # Actually, most Personal setups are easier with Device Code Flow or Interactive.
             # Let's try Device Code Flow as it's very reliable for CLI.
 
-            flow = self.app.initiate_device_flow(scopes=SCOPES)
+            flow = self.app.initiate_device_flow(scopes=self.scopes)
             if "user_code" not in flow:
                 raise ValueError("Fail to create device flow. Err: %s" % flow)
 
@@ -89,14 +142,15 @@ class OneDriveClient:
         """
         # Optimization: Increase page size ($top) to reduce number of API calls.
         # We avoid $select to ensure we don't accidentally miss fields needed by consumers.
-        url = f'{GRAPH_API_ENDPOINT}/me/drive/items/{item_id}/children?$top=1000'
+        url = f'{self.api_endpoint}{self.drive}/items/{item_id}/children?$top=1000'
 
         while url:
             # Use session for connection pooling
-            response = self.session.get(url, headers=self.get_headers())
+            with tracing.span('list_children', 'graph', item_id=item_id), metrics.API_LATENCY.labels('graph', 'list_children').time():
+                response = self.session.get(url, headers=self.get_headers())
             if response.status_code != 200:
                 logger.error(f"Error fetching items: {response.text}")
-                raise Exception(f"Error fetching OneDrive items for {item_id}")
+                raise _error(response, f"Error fetching OneDrive items for {item_id}")
 
             data = response.json()
             for item in data.get('value', []):
@@ -110,11 +164,13 @@ class OneDriveClient:
         The caller should use response.iter_content() or similar,
         or pass the raw stream to the upload function.
         """
-        url = f'{GRAPH_API_ENDPOINT}/me/drive/items/{file_id}/content'
+        url = f'{self.api_endpoint}{self.drive}/items/{file_id}/content'
         # stream=True is crucial here to not load the whole file into memory
         # Use session for connection pooling
-        response = self.session.get(url, headers=self.get_headers(), stream=True)
+        # Measures time to response headers; the body is consumed by the uploader
+        with tracing.span('download_ttfb', 'graph', item_id=file_id), metrics.API_LATENCY.labels('graph', 'download').time():
+            response = self.session.get(url, headers=self.get_headers(), stream=True)
         if response.status_code != 200:
             logger.error(f"Error downloading file {file_id}: {response.text}")
-            raise Exception(f"Error downloading file {file_id}")
+            raise _error(response, f"Error downloading file {file_id}")
         return response.raw
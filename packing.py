@@ -0,0 +1,218 @@
+import io
+import os
+import json
+import logging
+import datetime
+import tarfile
+import threading
+import collections
+import concurrent.futures
+
+import failures
+
+logger = logging.getLogger(__name__)
+
+# A subtree is packed when every file in it is smaller than max_file_size
+# and it holds between min_files and max_files files.
+DEFAULT_MAX_FILE_SIZE = 10 * 1024
+DEFAULT_MIN_FILES = 1000
+# Bounds the archive, which is rebuilt from scratch if its upload fails
+DEFAULT_MAX_FILES = 20000
+# Members downloaded ahead of the one being written, in parallel
+DEFAULT_PREFETCH = 8
+
+ARCHIVE_SUFFIX = '.tar'
+ARCHIVE_MIME = 'application/x-tar'
+MANIFEST_SUFFIX = '.tar.manifest.json'
+
+# PAX headers carry long and non-ASCII names without truncation
+TAR_FORMAT = tarfile.PAX_FORMAT
+TAR_ENCODING = 'utf-8'
+TAR_ERRORS = 'surrogateescape'
+
+# Why PackPolicy.scan rejected a subtree
+TOO_FEW_FILES = 'too few files'
+TOO_MANY_FILES = 'too many files'
+FILE_TOO_LARGE = 'file too large'
+
+class PackPolicy:
+    """
+    Decides which OneDrive folders are uploaded as a single tar archive
+    instead of one Drive file per OneDrive file.
+    """
+    def __init__(self, max_file_size=DEFAULT_MAX_FILE_SIZE, min_files=DEFAULT_MIN_FILES, max_files=DEFAULT_MAX_FILES, prefetch=DEFAULT_PREFETCH):
+        self.max_file_size = max_file_size
+        self.min_files = min_files
+        self.max_files = max_files
+        self.prefetch = prefetch
+
+    def may_qualify(self, folder_item):
+        """
+        Cheap check on a folder item before its subtree is listed. Graph reports
+        the total size of a folder's contents, which rules out big subtrees.
+        """
+        size = folder_item.get('size')
+        return size is None or size < self.max_file_size * self.max_files
+
+    def scan(self, list_children, folder_id, listings=None):
+        """
+        Lists the subtree under `folder_id` with list_children(folder_id).
+        Returns (archive, None) if it should be packed, otherwise (None, reason)
+        with one of TOO_FEW_FILES, TOO_MANY_FILES or FILE_TOO_LARGE.
+        Stops listing as soon as the subtree is ruled out. Each folder listed
+        is stored in `listings` (folder id -> items) if given, for reuse.
+        """
+        members = []
+        pending = [(folder_id, '')]
+        while pending:
+            current_id, prefix = pending.pop()
+            children = list_children(current_id)
+            if listings is not None:
+                listings[current_id] = children
+            for item in children:
+                path = f"{prefix}{item.get('name')}"
+                if 'folder' in item:
+                    pending.append((item.get('id'), path + '/'))
+                    continue
+                if item.get('size', 0) >= self.max_file_size:
+                    return None, FILE_TOO_LARGE
+                if len(members) >= self.max_files:
+                    return None, TOO_MANY_FILES
+                members.append((path, item))
+
+        if len(members) < self.min_files:
+            # So does every folder below
+            return None, TOO_FEW_FILES
+        members.sort(key=lambda member: member[0])
+        return Archive(members, self.prefetch), None
+
+def _mtime(item):
+    value = item.get('lastModifiedDateTime')
+    if not value:
+        return 0
+    try:
+        return int(datetime.datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp())
+    except ValueError:
+        return 0
+
+def _round_up(size, unit):
+    return -(-size // unit) * unit
+
+class Archive:
+    """
+    The tar layout of a set of OneDrive files. Header sizes depend only on
+    names and metadata, so the exact archive size and every member's offset
+    are known before anything is downloaded.
+    """
+    def __init__(self, members, prefetch=DEFAULT_PREFETCH):
+        self.prefetch = prefetch
+        self.members = []
+        self.entries = []
+        offset = 0
+        for path, item in members:
+            info = tarfile.TarInfo(path)
+            info.size = item.get('size', 0)
+            info.mtime = _mtime(item)
+            info.mode = 0o644
+            header = len(info.tobuf(TAR_FORMAT, TAR_ENCODING, TAR_ERRORS))
+            self.members.append((info, item))
+            self.entries.append({
+                'path': path,
+                'od_id': item.get('id'),
+                'size': info.size,
+                'offset': offset + header,
+                'modified': item.get('lastModifiedDateTime'),
+                'hashes': item.get('file', {}).get('hashes', {}),
+            })
+            offset += header + _round_up(info.size, tarfile.BLOCKSIZE)
+        # End-of-archive marker, then padding to a whole record
+        self.size = _round_up(offset + 2 * tarfile.BLOCKSIZE, tarfile.RECORDSIZE)
+
+    def __len__(self):
+        return len(self.members)
+
+    def write(self, od_client, fileobj):
+        """
+        Writes the archive to `fileobj`. Members are small, so up to `prefetch`
+        of them are downloaded into memory in parallel, ahead of the writer.
+        """
+        def download(info, item):
+            return failures.call_with_retries(
+                lambda: od_client.get_file_stream(item.get('id')).read(), f"Download of {info.name} for packing")
+
+        members = iter(self.members)
+        with concurrent.futures.ThreadPoolExecutor(max(self.prefetch, 1), thread_name_prefix='pack-download') as pool, \
+                tarfile.open(fileobj=fileobj, mode='w|', format=TAR_FORMAT, encoding=TAR_ENCODING, errors=TAR_ERRORS) as tar:
+            window = collections.deque()
+            for info, item in members:
+                window.append((info, pool.submit(download, info, item)))
+                if len(window) < self.prefetch:
+                    continue
+                info, future = window.popleft()
+                # Raises if the download is shorter than the listed size
+                tar.addfile(info, io.BytesIO(future.result()))
+            while window:
+                info, future = window.popleft()
+                tar.addfile(info, io.BytesIO(future.result()))
+
+    def manifest(self, source_path):
+        """JSON listing of the archive's members, uploaded next to it."""
+        return json.dumps({
+            'source_path': source_path,
+            'format': 'tar',
+            'size': self.size,
+            'files': self.entries,
+        }, indent=1).encode('utf-8')
+
+class _CountingWriter:
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self.written = 0
+
+    def write(self, data):
+        self._fileobj.write(data)
+        self.written += len(data)
+        return len(data)
+
+class ArchiveStream:
+    """
+    Read end of an archive that a background thread writes into an OS pipe,
+    so only a pipe buffer of it is held in memory and nothing touches the disk.
+    An error while building the archive is raised from read() at the point
+    the data runs out.
+    """
+    def __init__(self, archive, od_client):
+        read_fd, write_fd = os.pipe()
+        self._reader = os.fdopen(read_fd, 'rb')
+        self._writer = os.fdopen(write_fd, 'wb')
+        self._error = None
+        self._thread = threading.Thread(target=self._write, args=(archive, od_client), name='pack-writer', daemon=True)
+        self._thread.start()
+
+    def _write(self, archive, od_client):
+        try:
+            counter = _CountingWriter(self._writer)
+            archive.write(od_client, counter)
+            if counter.written != archive.size:
+                raise ValueError(f"Archive is {counter.written} bytes, expected {archive.size}")
+        except Exception as e:
+            # Includes BrokenPipeError when the reader gave up first
+            self._error = e
+        finally:
+            try:
+                self._writer.close()
+            except OSError:
+                pass
+
+    def read(self, n=-1):
+        data = self._reader.read(n)
+        if n is None or n < 0 or len(data) < n:
+            # The writer closed its end, successfully or not
+            self._thread.join()
+            if self._error:
+                raise self._error
+        return data
+
+    def close(self):
+        self._reader.close()
+        self._thread.join()
@@ -0,0 +1,141 @@
+import os
+import re
+import logging
+import threading
+
+import google_drive
+import metrics
+from failures import QuotaExceededError
+from onedrive import OneDriveClient, DEFAULT_TOKEN_CACHE
+
+logger = logging.getLogger(__name__)
+
+# Name of the pair a config without a "migrations" list describes
+DEFAULT_PAIR = 'default'
+
+class MigrationPair:
+    """
+    One source drive and the Drive folder it is migrated into, with its own
+    credentials, counters and optional cap on uploaded bytes.
+    """
+    def __init__(self, name, od_client, creds, od_root_id='root', gd_root_id='root', gd_drive_id=None, max_upload_bytes=None, gd_service=None):
+        self.name = name
+        self.od_client = od_client
+        self.creds = creds
+        # Service used by the pair's crawl thread; built from `creds` if not given
+        self.gd_service = gd_service
+        self.od_root_id = od_root_id
+        self.gd_root_id = gd_root_id
+        # Set when the destination is in a shared drive
+        self.gd_drive_id = gd_drive_id
+        self.max_upload_bytes = max_upload_bytes
+        # Set by migrate.run_pairs when the destination listing cache is enabled
+        self.listing_cache = None
+        # Real id behind Drive's 'root' alias, resolved for the listing cache
+        self.gd_my_drive_id = None
+
+        self.files = metrics.PAIR_FILES.labels(name)
+        self.bytes = metrics.PAIR_BYTES.labels(name)
+        self.failed = metrics.PAIR_FAILED.labels(name)
+        self._reserved = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, size):
+        """
+        Claims `size` bytes of the pair's upload allowance before an upload.
+        Raises QuotaExceededError once the allowance is used up.
+        """
+        with self._lock:
+            if self.max_upload_bytes is not None and self._reserved + size > self.max_upload_bytes:
+                raise QuotaExceededError(f"Upload quota of {self.max_upload_bytes} bytes for '{self.name}' is used up")
+            self._reserved += size
+
+    def release(self, size):
+        """Gives back bytes reserved for an upload that failed."""
+        with self._lock:
+            self._reserved -= size
+
+    def summary(self):
+        return (
+            f"[{self.name}] {self.files.get()} files, {self.bytes.get() / 1e6:.1f} MB uploaded, "
+            f"{self.failed.get()} failed"
+        )
+
+def _pair_path(path, name):
+    """`path` with the pair's name added before the extension: token_google.json -> token_google_sales.json."""
+    root, ext = os.path.splitext(path)
+    return f"{root}_{re.sub(r'[^A-Za-z0-9_.-]', '_', name)}{ext}"
+
+def pair_config(config, spec):
+    """
+    The config for one entry of config['migrations']: its "microsoft" and
+    "google" sections override the top-level ones, and "source" selects the drive.
+    Token files the entry does not set itself get the pair's name added, so
+    pairs never share a login by accident.
+    """
+    merged = dict(config)
+    merged['microsoft'] = dict(config.get('microsoft', {}), **spec.get('microsoft', {}))
+    merged['google'] = dict(config.get('google', {}), **spec.get('google', {}))
+    if 'source' in spec:
+        merged['microsoft']['drive'] = spec['source']
+    if 'token_cache' not in spec.get('microsoft', {}):
+        merged['microsoft']['token_cache'] = _pair_path(merged['microsoft'].get('token_cache', DEFAULT_TOKEN_CACHE), spec['name'])
+    if 'token_file' not in spec.get('google', {}):
+        merged['google']['token_file'] = _pair_path(merged['google'].get('token_file', google_drive.DEFAULT_TOKEN_FILE), spec['name'])
+    return merged
+
+def pair_roots(spec):
+    """
+    The (OneDrive root id, Drive root id, shared drive id) an entry of
+    config['migrations'] migrates between.
+    """
+    destination = spec.get('destination', {})
+    gd_drive_id = destination.get('shared_drive_id')
+    # The root folder of a shared drive has the drive's id
+    gd_root_id = destination.get('folder_id') or gd_drive_id or 'root'
+    return spec.get('source_folder', 'root'), gd_root_id, gd_drive_id
+
+def build_pairs(config):
+    """
+    Authenticates every pair listed in config['migrations'], or the single
+    /me/drive -> My Drive pair when there is no list. Pairs that fail to
+    authenticate are logged and left out. All OneDrive clients share one
+    HTTP session and its connection pool.
+    """
+    specs = config.get('migrations') or [{'name': DEFAULT_PAIR}]
+    names = [spec.get('name') for spec in specs]
+    if None in names or len(set(names)) != len(names):
+        raise ValueError("Every entry in 'migrations' needs a unique 'name'")
+
+    pairs = []
+    session = None
+    for spec in specs:
+        name = spec['name']
+        # The single pair of a config without a list keeps the top-level token files
+        merged = pair_config(config, spec) if config.get('migrations') else config
+
+        logger.info(f"[{name}] Authenticating with Google Drive...")
+        try:
+            creds = google_drive.get_credentials(merged)
+        except Exception as e:
+            logger.error(f"[{name}] Google Drive Authentication failed: {e}")
+            continue
+
+        logger.info(f"[{name}] Authenticating with OneDrive...")
+        try:
+            od_client = OneDriveClient(merged, session)
+            od_client.authenticate()
+        except Exception as e:
+            logger.error(f"[{name}] OneDrive Authentication failed: {e}")
+            continue
+        session = od_client.session
+
+        od_root_id, gd_root_id, gd_drive_id = pair_roots(spec)
+        pairs.append(MigrationPair(
+            name, od_client, creds,
+            od_root_id=od_root_id,
+            gd_root_id=gd_root_id,
+            gd_drive_id=gd_drive_id,
+            max_upload_bytes=spec.get('max_upload_bytes'),
+        ))
+    return pairs
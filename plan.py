@@ -0,0 +1,119 @@
+import os
+import json
+import logging
+import concurrent.futures
+
+import failures
+
+logger = logging.getLogger(__name__)
+
+# Folders listed concurrently while walking a tree
+DEFAULT_LIST_WORKERS = 8
+
+# Upper bounds (bytes) of the size classes reported by a plan
+SIZE_CLASSES = [
+    ('<10KB', 10 * 1024),
+    ('<1MB', 1024 * 1024),
+    ('<100MB', 100 * 1024 * 1024),
+    ('>=100MB', None),
+]
+
+def walk_onedrive(od_client, root_id='root', workers=DEFAULT_LIST_WORKERS, errors=None):
+    """
+    Yields (path, item) for every file and folder below `root_id`.
+    Folders are listed concurrently, so items arrive in no particular order.
+    Throttled and transient listing errors are retried. Folders that still
+    cannot be listed are logged and appended to `errors` if given.
+    """
+    def list_folder(folder_id, path):
+        try:
+            items = failures.call_with_retries(lambda: list(od_client.get_drive_items(folder_id)), f"Listing folder {path or 'Root'}")
+            return path, items, None
+        except Exception as e:
+            return path, [], e
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(list_folder, root_id, '')}
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                path, items, error = future.result()
+                if error:
+                    logger.error(f"Failed to list items for folder {path or 'Root'}: {error}")
+                    if errors is not None:
+                        errors.append({'path': path, 'error': str(error)})
+                    continue
+
+                for item in items:
+                    item_path = os.path.join(path, item.get('name'))
+                    if 'folder' in item:
+                        pending.add(pool.submit(list_folder, item.get('id'), item_path))
+                    yield item_path, item
+
+def size_class(size):
+    for name, limit in SIZE_CLASSES:
+        if limit is None or size < limit:
+            return name
+
+def build_plan(od_client, root_id='root', workers=DEFAULT_LIST_WORKERS):
+    """
+    Lists the OneDrive tree without transferring anything and summarises
+    what a migration would have to move.
+    """
+    errors = []
+    plan = {
+        'folders': 0,
+        'files': 0,
+        'bytes': 0,
+        'size_classes': {name: {'files': 0, 'bytes': 0} for name, _ in SIZE_CLASSES},
+        'largest_files': [],
+        'errors': errors,
+    }
+    largest = []
+
+    for path, item in walk_onedrive(od_client, root_id, workers, errors):
+        if 'folder' in item:
+            plan['folders'] += 1
+            continue
+
+        size = item.get('size', 0)
+        plan['files'] += 1
+        plan['bytes'] += size
+        bucket = plan['size_classes'][size_class(size)]
+        bucket['files'] += 1
+        bucket['bytes'] += size
+        largest.append((size, path))
+        if len(largest) > 100:
+            # Keep memory flat on huge drives
+            largest = sorted(largest, reverse=True)[:10]
+
+    plan['largest_files'] = [{'path': path, 'size': size} for size, path in sorted(largest, reverse=True)[:10]]
+    return plan
+
+def _format_bytes(value):
+    if value < 1024:
+        return f"{value} B"
+    for unit in ('KB', 'MB', 'GB', 'TB'):
+        value /= 1024
+        if value < 1024 or unit == 'TB':
+            return f"{value:.1f} {unit}"
+
+def format_plan(plan):
+    lines = [
+        f"Folders: {plan['folders']}",
+        f"Files:   {plan['files']} ({_format_bytes(plan['bytes'])})",
+        "By size:",
+    ]
+    for name, bucket in plan['size_classes'].items():
+        lines.append(f"  {name:<8} {bucket['files']:>10} files  {_format_bytes(bucket['bytes']):>12}")
+    if plan['largest_files']:
+        lines.append("Largest files:")
+        for entry in plan['largest_files']:
+            lines.append(f"  {_format_bytes(entry['size']):>12}  {entry['path']}")
+    if plan['errors']:
+        lines.append(f"Folders that could not be listed: {len(plan['errors'])}")
+    return '\n'.join(lines)
+
+def write_plan(plan, path):
+    with open(path, 'w') as f:
+        json.dump(plan, f, indent=2)
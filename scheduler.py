@@ -0,0 +1,100 @@
+import logging
+import threading
+import collections
+import concurrent.futures
+
+logger = logging.getLogger(__name__)
+
+class FairExecutor:
+    """
+    A thread pool shared by several tenants, e.g. the source drives of one run.
+
+    Each tenant has its own FIFO queue, and idle workers take one task from each
+    tenant with queued work in turn. A tenant with a million queued files therefore
+    gets the same share of the workers as one with ten, instead of starving it.
+    """
+    def __init__(self, max_workers, thread_name_prefix='worker'):
+        self.max_workers = max_workers
+        self._queues = {}
+        # Tenants with queued tasks, in the order they will be served
+        self._ready = collections.deque()
+        self._cond = threading.Condition()
+        self._shutdown = False
+        self._threads = []
+        for i in range(max_workers):
+            thread = threading.Thread(target=self._work, name=f'{thread_name_prefix}-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def tenant(self, name):
+        """Returns an executor that queues tasks as `name`."""
+        return TenantExecutor(self, name)
+
+    def pending(self, name):
+        with self._cond:
+            return len(self._queues.get(name, ()))
+
+    def _submit(self, name, fn, args, kwargs):
+        future = concurrent.futures.Future()
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("cannot schedule new futures after shutdown")
+            queue = self._queues.setdefault(name, collections.deque())
+            if not queue:
+                self._ready.append(name)
+            queue.append((future, fn, args, kwargs))
+            self._cond.notify()
+        return future
+
+    def _next_task(self):
+        with self._cond:
+            while not self._ready:
+                if self._shutdown:
+                    return None
+                self._cond.wait()
+            name = self._ready.popleft()
+            queue = self._queues[name]
+            task = queue.popleft()
+            if queue:
+                # Back of the line until every other tenant has had a turn
+                self._ready.append(name)
+            return task
+
+    def _work(self):
+        while True:
+            task = self._next_task()
+            if task is None:
+                return
+            future, fn, args, kwargs = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    def shutdown(self, wait=True):
+        """Stops accepting tasks. Already queued tasks still run."""
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown(wait=True)
+
+class TenantExecutor:
+    """One tenant's view of a FairExecutor. Has the submit() of a concurrent.futures Executor."""
+    def __init__(self, pool, name):
+        self._pool = pool
+        self.name = name
+
+    def submit(self, fn, *args, **kwargs):
+        return self._pool._submit(self.name, fn, args, kwargs)
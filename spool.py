@@ -0,0 +1,172 @@
+import os
+import shutil
+import logging
+import tempfile
+import threading
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Files in the spool directory are created with this prefix so that leftovers
+# from an interrupted run can be recognised and removed safely.
+SPOOL_PREFIX = 'spool-'
+
+# Each process spools into its own subdirectory, named after its pid, so that
+# several migrations can share one spool path without removing each other's files.
+PROCESS_DIR_PREFIX = 'proc-'
+
+# Copy buffer used when draining a download into the spool.
+COPY_BUFFER_SIZE = 1024 * 1024
+
+class SpoolFullError(Exception):
+    """Raised when a file can never fit in the spool, regardless of how much is drained."""
+
+
+class SpoolDirectory:
+    """
+    A local staging area (disk or tmpfs) that sits between OneDrive downloads and
+    Google Drive uploads.
+
+    The total size of all spooled files never exceeds `max_bytes`: space is reserved
+    *before* a download starts and only released once the upload that consumes the
+    file has finished, so downloaders block instead of overfilling the directory.
+
+    Files are written to a subdirectory of `root` owned by this process, which
+    `close()` removes. Subdirectories left by processes that are no longer
+    running are removed at startup.
+    """
+    def __init__(self, root, max_bytes):
+        if max_bytes <= 0:
+            raise ValueError("Spool max_bytes must be positive")
+
+        self.root = root
+        self.path = os.path.join(root, f'{PROCESS_DIR_PREFIX}{os.getpid()}')
+        self.max_bytes = max_bytes
+        self._used = 0
+        self._cond = threading.Condition()
+
+        # Directory is private to the current user, spooled files may be sensitive
+        os.makedirs(root, mode=0o700, exist_ok=True)
+        self._remove_stale_directories()
+        os.makedirs(self.path, mode=0o700, exist_ok=True)
+
+    def _remove_stale_directories(self):
+        for entry in os.listdir(self.root):
+            if not entry.startswith(PROCESS_DIR_PREFIX):
+                continue
+            try:
+                pid = int(entry[len(PROCESS_DIR_PREFIX):])
+            except ValueError:
+                continue
+            # Our own pid can only be left over from an earlier process that had it
+            if pid != os.getpid() and _process_alive(pid):
+                continue
+            try:
+                shutil.rmtree(os.path.join(self.root, entry))
+            except OSError as e:
+                logger.warning(f"Could not remove stale spool directory {entry}: {e}")
+
+    def close(self):
+        """Removes this process's spool directory and anything still in it."""
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    @property
+    def used_bytes(self):
+        with self._cond:
+            return self._used
+
+    def fits(self, size):
+        """
+        Returns True if a file of this size can ever be spooled.
+        Larger files must bypass the spool and be streamed directly.
+        """
+        return size <= self.max_bytes
+
+    def reserve(self, size):
+        """
+        Blocks until `size` bytes are available, then returns a SpooledFile
+        that owns the reservation.
+        """
+        if not self.fits(size):
+            raise SpoolFullError(f"{size} bytes exceeds spool capacity of {self.max_bytes} bytes")
+
+        with self._cond:
+            while self._used + size > self.max_bytes:
+                self._cond.wait()
+            self._used += size
+            metrics.SPOOL_USED_BYTES.set(self._used)
+
+        return SpooledFile(self, size)
+
+    def _release(self, size):
+        with self._cond:
+            self._used -= size
+            metrics.SPOOL_USED_BYTES.set(self._used)
+            self._cond.notify_all()
+
+
+def _process_alive(pid):
+    if os.name != 'posix':
+        # Signalling a process is not a harmless probe elsewhere; never remove its files
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # The process exists but belongs to another user
+        return True
+    return True
+
+
+class SpooledFile:
+    """
+    A single file held in the spool. Call `discard()` once it is no longer needed
+    to delete it and give its reserved space back to the spool.
+    """
+    def __init__(self, spool, size):
+        self._spool = spool
+        self.size = size
+        self.path = None
+
+    def write_from(self, stream):
+        """
+        Drains `stream` into a new file in the spool.
+        Fails if the stream yields more or fewer bytes than were reserved,
+        leaving nothing behind so the write can be tried again.
+        """
+        fd, self.path = tempfile.mkstemp(prefix=SPOOL_PREFIX, dir=self._spool.path)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                # Never write past the reservation; one extra byte is enough to detect overrun
+                remaining = self.size + 1
+                while remaining > 0:
+                    chunk = stream.read(min(COPY_BUFFER_SIZE, remaining))
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    remaining -= len(chunk)
+
+                written = f.tell()
+
+            if written != self.size:
+                raise IOError(f"Expected {self.size} bytes but received {'more' if written > self.size else written}")
+        except Exception:
+            os.remove(self.path)
+            self.path = None
+            raise
+
+    def open(self):
+        return open(self.path, 'rb')
+
+    def discard(self):
+        if self.path:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+        if self._spool:
+            self._spool._release(self.size)
+            self._spool = None
@@ -0,0 +1,29 @@
+import os
+import sys
+import unittest
+
+# Ensure we can import the modules under test
+sys.path.append(os.getcwd())
+import google_drive
+from benchmarks.fake_servers import SyntheticTree, FakeGraphServer, FakeDriveServer, fake_onedrive_client, use_fake_drive
+
+class FakeServersTestCase(unittest.TestCase):
+    """
+    Runs each test against fresh fake Graph and Drive servers, with
+    self.od_client, self.creds and self.service connected to them.
+    """
+    # SyntheticTree parameters of the OneDrive side
+    tree_shape = {'depth': 2, 'folders_per_folder': 2, 'files_per_folder': 3}
+    # FakeDriveServer parameters
+    drive_options = {}
+
+    def setUp(self):
+        self.tree = SyntheticTree(**self.tree_shape)
+        self.graph = FakeGraphServer(self.tree).start()
+        self.addCleanup(self.graph.stop)
+        self.drive = FakeDriveServer(**self.drive_options).start()
+        self.addCleanup(self.drive.stop)
+        self.od_client = fake_onedrive_client(self.graph.url)
+        self.creds = use_fake_drive(self.drive.url)
+        self.addCleanup(use_fake_drive, None)
+        self.service = google_drive.build_service(self.creds)
@@ -0,0 +1,66 @@
+import hashlib
+import os
+import sys
+import unittest
+
+# Ensure we can import the benchmark package and the modules under test
+sys.path.append(os.getcwd())
+import google_drive
+import migrate
+from benchmarks.fake_servers import SyntheticTree, FOLDER_MIME
+from tests.helpers import FakeServersTestCase
+
+class TestFakeServers(FakeServersTestCase):
+    tree_shape = {'depth': 1, 'folders_per_folder': 2, 'files_per_folder': 1200, 'min_size': 10, 'max_size': 200}
+
+    def test_synthetic_tree_shape(self):
+        self.assertEqual(self.tree.folder_count, 2)
+        self.assertEqual(self.tree.file_count, 3600)
+        self.assertEqual(len(self.tree.children('d.1')), 1200)
+        self.assertEqual(len(self.tree.content('f.1.7')), self.tree.size('f.1.7'))
+        self.assertEqual(self.tree.content('f.1.7', 3, 9), self.tree.content('f.1.7')[3:9])
+
+    def test_graph_pagination(self):
+        items = list(self.od_client.get_drive_items('root'))
+        self.assertEqual(len(items), 1202)
+        self.assertEqual(self.graph.requests['list_children'], 2)
+
+    def test_download_follows_redirect(self):
+        data = self.od_client.get_file_stream('f.0.5').read()
+        self.assertEqual(data, self.tree.content('f.0.5'))
+        self.assertEqual(self.graph.requests['content'], 1)
+        self.assertEqual(self.graph.requests['download'], 1)
+
+    def test_resumable_upload_of_stream(self):
+        stream = self.od_client.get_file_stream('f.0.5')
+        size = self.tree.size('f.0.5')
+        file_id = google_drive.upload_file(self.service, 'a.bin', 'root', stream, size)
+
+        uploaded = self.drive.files[file_id]
+        self.assertEqual(uploaded['size'], str(size))
+        self.assertEqual(uploaded['md5Checksum'], hashlib.md5(self.tree.content('f.0.5')).hexdigest())
+
+    def test_listing_queries(self):
+        folder_id = google_drive.create_folder(self.service, "it's", 'root')
+        self.assertEqual(google_drive.create_folder_if_not_exists(self.service, "it's", 'root'), folder_id)
+        self.assertIsNone(google_drive.file_exists(self.service, "it's", 'root'))
+        self.assertEqual(set(google_drive.list_folder_contents(self.service, 'root')), {"it's"})
+
+    def test_throttling(self):
+        self.graph.throttle_rate = 1.0
+        with self.assertRaises(Exception):
+            list(self.od_client.get_drive_items('root'))
+        self.assertEqual(self.graph.requests['throttled'], 1)
+
+    def test_full_migration(self):
+        tree = SyntheticTree(depth=2, folders_per_folder=2, files_per_folder=3)
+        self.graph.tree = tree
+        migrate.run_migration(self.od_client, self.creds, self.service, {'workers': 4, 'failure_ledger': os.devnull})
+
+        files = [f for f in self.drive.files.values() if f['mimeType'] != FOLDER_MIME]
+        folders = [f for f in self.drive.files.values() if f['mimeType'] == FOLDER_MIME]
+        self.assertEqual(len(files), tree.file_count)
+        self.assertEqual(len(folders), tree.folder_count)
+
+if __name__ == '__main__':
+    unittest.main()
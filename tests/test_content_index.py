@@ -0,0 +1,139 @@
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+# Ensure we can import the modules under test
+sys.path.append(os.getcwd())
+import content_index
+import metrics
+import migrate
+import verify
+from benchmarks.fake_servers import FOLDER_MIME
+from tests.helpers import FakeServersTestCase
+
+SHA1 = 'A94A8FE5CCB19BA61C4C0873D391E987982FBBD3'
+
+def item(item_id, size=1000, hashes=None):
+    return {'id': item_id, 'name': f'{item_id}.bin', 'size': size, 'file': {'mimeType': 'text/plain', 'hashes': {'sha1Hash': SHA1} if hashes is None else hashes}}
+
+class TestContentKey(unittest.TestCase):
+
+    def test_key_depends_on_size_and_algorithm(self):
+        key = content_index.content_key(10, {'sha1Hash': SHA1})
+        self.assertEqual(len(key), 1 + 8 + content_index.DIGEST_BYTES)
+        self.assertEqual(key, content_index.content_key(10, {'sha1Hash': SHA1.lower()}))
+        self.assertNotEqual(key, content_index.content_key(11, {'sha1Hash': SHA1}))
+        self.assertNotEqual(key, content_index.content_key(10, {'quickXorHash': 'qUqP5cyxm6YcTAhz05Hph5gvu9M='}, allow_quickxor=True))
+
+    def test_prefers_strongest_hash_and_skips_unusable(self):
+        both = content_index.content_key(10, {'sha1Hash': SHA1, 'sha256Hash': 'ab' * 32})
+        self.assertEqual(both[:1], b'\x01')
+        self.assertEqual(content_index.content_key(10, {'sha1Hash': 'not hex', 'quickXorHash': 'qUqP5cyxm6YcTAhz05Hph5gvu9M='}, allow_quickxor=True)[:1], b'\x03')
+        self.assertIsNone(content_index.content_key(10, {'crc32Hash': '0x1234'}))
+
+    def test_quickxor_ignored_by_default(self):
+        hashes = {'quickXorHash': 'qUqP5cyxm6YcTAhz05Hph5gvu9M='}
+        self.assertIsNone(content_index.content_key(10, hashes))
+        self.assertIsNone(content_index.content_key(10, dict(hashes, sha1Hash='not hex')))
+        index = content_index.ContentIndex(min_size=1)
+        self.assertEqual(index.claim(item('a', hashes=hashes)), (None, None))
+        self.assertEqual(len(index), 0)
+
+class TestContentIndex(unittest.TestCase):
+
+    def test_first_claim_uploads_and_later_ones_copy(self):
+        index = content_index.ContentIndex(min_size=100)
+
+        gd_id, claim = index.claim(item('a'))
+        self.assertIsNone(gd_id)
+        claim.complete('gd_a')
+        claim.abandon()
+
+        self.assertEqual(index.claim(item('b')), ('gd_a', None))
+        self.assertEqual(len(index), 1)
+
+    def test_small_and_unhashed_files_are_not_indexed(self):
+        index = content_index.ContentIndex(min_size=100)
+        self.assertEqual(index.claim(item('a', size=99)), (None, None))
+        self.assertEqual(index.claim(item('b', hashes={})), (None, None))
+
+    def test_duplicate_waits_for_in_flight_upload(self):
+        index = content_index.ContentIndex(min_size=0)
+        _, claim = index.claim(item('a'))
+        results = []
+
+        waiter = threading.Thread(target=lambda: results.append(index.claim(item('b'))))
+        waiter.start()
+        time.sleep(0.05)
+        self.assertEqual(results, [])
+
+        claim.complete('gd_a')
+        waiter.join(1)
+        self.assertEqual(results, [('gd_a', None)])
+
+    def test_abandoned_claim_passes_to_a_waiter(self):
+        index = content_index.ContentIndex(min_size=0)
+        _, claim = index.claim(item('a'))
+        results = []
+
+        waiter = threading.Thread(target=lambda: results.append(index.claim(item('b'))))
+        waiter.start()
+        claim.abandon()
+        waiter.join(1)
+
+        gd_id, new_claim = results[0]
+        self.assertIsNone(gd_id)
+        self.assertIsInstance(new_claim, content_index.Claim)
+
+class TestMigrateDedup(unittest.TestCase):
+
+    @patch('migrate.google_drive')
+    def test_duplicate_is_copied_without_download(self, mock_gd):
+        mock_service = MagicMock()
+        mock_od_client = MagicMock()
+        mock_gd.upload_file.return_value = 'gd_a'
+        index = content_index.ContentIndex(min_size=0)
+
+        with patch('migrate.get_thread_safe_service', return_value=mock_service):
+            migrate.process_file_upload(mock_od_client, MagicMock(), item('a'), 'gd_root', 'a.bin', {}, content_index=index)
+            migrate.process_file_upload(mock_od_client, MagicMock(), item('b'), 'gd_other', 'b.bin', {}, content_index=index)
+
+        mock_od_client.get_file_stream.assert_called_once_with('a')
+        mock_gd.copy_file.assert_called_once_with(mock_service, 'gd_a', 'b.bin', 'gd_other')
+
+    @patch('migrate.google_drive')
+    def test_failed_copy_falls_back_to_upload(self, mock_gd):
+        mock_od_client = MagicMock()
+        mock_gd.copy_file.side_effect = ValueError("source deleted")
+        index = content_index.ContentIndex(min_size=0)
+        _, claim = index.claim(item('a'))
+        claim.complete('gd_a')
+
+        with patch('migrate.get_thread_safe_service'):
+            migrate.process_file_upload(mock_od_client, MagicMock(), item('b'), 'gd_root', 'b.bin', {}, content_index=index)
+
+        mock_od_client.get_file_stream.assert_called_once_with('b')
+        mock_gd.upload_file.assert_called_once()
+
+class TestDedupEndToEnd(FakeServersTestCase):
+    tree_shape = {'depth': 1, 'folders_per_folder': 2, 'files_per_folder': 10, 'min_size': 1000, 'max_size': 2000, 'duplicate_rate': 0.5, 'duplicate_pool': 3}
+
+    def test_duplicates_are_copied_in_drive(self):
+        copied_before = metrics.FILES_COPIED.get()
+        migrate.run_migration(self.od_client, self.creds, self.service, {'workers': 4, 'dedup': {'min_size': 0}, 'failure_ledger': os.devnull})
+
+        files = [f for f in self.drive.files.values() if f['mimeType'] != FOLDER_MIME]
+        self.assertEqual(len(files), self.tree.file_count)
+        self.assertGreater(self.drive.requests['copy'], 0)
+        self.assertEqual(self.drive.requests['upload_start'] + self.drive.requests['copy'], self.tree.file_count)
+        self.assertEqual(metrics.FILES_COPIED.get() - copied_before, self.drive.requests['copy'])
+
+        # Copies carry the right content
+        report = verify.verify(self.od_client, self.creds, workers=4)
+        self.assertEqual(report['summary']['mismatched'] + report['summary']['missing'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
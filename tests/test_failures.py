@@ -0,0 +1,151 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+# Ensure we can import the modules under test
+sys.path.append(os.getcwd())
+import failures
+import main
+import migrate
+from onedrive import OneDriveError
+from benchmarks.fake_servers import FOLDER_MIME
+from tests.helpers import FakeServersTestCase
+
+def http_error(status, content=b'', headers=None):
+    resp = httplib2.Response(dict(headers or {}, status=status))
+    return HttpError(resp, content)
+
+class TestClassify(unittest.TestCase):
+
+    def test_drive_errors(self):
+        self.assertEqual(failures.classify(http_error(429)), failures.THROTTLED)
+        self.assertEqual(failures.classify(http_error(403, b'{"reason": "userRateLimitExceeded"}')), failures.THROTTLED)
+        self.assertEqual(failures.classify(http_error(403, b'{"reason": "insufficientFilePermissions"}')), failures.PERMANENT)
+        self.assertEqual(failures.classify(http_error(503)), failures.TRANSIENT)
+        self.assertEqual(failures.classify(http_error(404)), failures.PERMANENT)
+
+    def test_graph_errors(self):
+        self.assertEqual(failures.classify(OneDriveError("x", 429)), failures.THROTTLED)
+        self.assertEqual(failures.classify(OneDriveError("x", 503, retry_after=5)), failures.THROTTLED)
+        self.assertEqual(failures.classify(OneDriveError("x", 503)), failures.TRANSIENT)
+        self.assertEqual(failures.classify(OneDriveError("x", 404)), failures.PERMANENT)
+
+    def test_other_errors(self):
+        self.assertEqual(failures.classify(ConnectionResetError()), failures.TRANSIENT)
+        self.assertEqual(failures.classify(IOError("Expected 5 bytes but received 3")), failures.TRANSIENT)
+        self.assertEqual(failures.classify(ValueError()), failures.PERMANENT)
+
+    def test_retry_after(self):
+        self.assertEqual(failures.retry_after(OneDriveError("x", 429, retry_after=7.0)), 7.0)
+        self.assertEqual(failures.retry_after(http_error(429, headers={'retry-after': '3'})), 3.0)
+        self.assertIsNone(failures.retry_after(http_error(500)))
+
+class TestRetries(unittest.TestCase):
+
+    def test_backoff_is_jittered_and_capped(self):
+        delays = [failures.backoff_delay(10) for _ in range(50)]
+        self.assertTrue(all(0 <= d <= failures.BACKOFF_CAP for d in delays))
+        self.assertGreater(len(set(delays)), 1)
+        self.assertGreaterEqual(failures.backoff_delay(0, server_delay=30), 30)
+
+    @patch('failures.time.sleep')
+    def test_transient_failures_are_retried(self, mock_sleep):
+        fn = MagicMock(side_effect=[ConnectionResetError(), OneDriveError("x", 429, retry_after=2), 'ok'])
+
+        self.assertEqual(failures.call_with_retries(fn, 'test'), 'ok')
+        self.assertEqual(fn.call_count, 3)
+        self.assertGreaterEqual(mock_sleep.call_args_list[1][0][0], 2)
+
+    @patch('failures.time.sleep')
+    def test_permanent_and_exhausted_failures_are_raised(self, mock_sleep):
+        fn = MagicMock(side_effect=ValueError("bad"))
+        with self.assertRaises(ValueError):
+            failures.call_with_retries(fn, 'test')
+        self.assertEqual(fn.call_count, 1)
+
+        fn = MagicMock(side_effect=ConnectionResetError())
+        with self.assertRaises(ConnectionResetError):
+            failures.call_with_retries(fn, 'test', retries=2)
+        self.assertEqual(fn.call_count, 3)
+
+class TestLedger(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'failures.jsonl')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_record_and_load(self):
+        item = {'id': 'od_1', 'name': 'a.txt', 'size': 5, 'file': {'mimeType': 'text/plain'}}
+        ledger = failures.FailureLedger(self.path)
+        ledger.record('transfer', ConnectionResetError(), failures.file_entry(item, 'gd_root', 'a.txt'))
+        ledger.record('upload', http_error(404), failures.file_entry(item, 'gd_root', 'a.txt'))
+        ledger.record('list_source', OneDriveError("x", 429), failures.folder_entry('od_2', os.path.join('x', 'docs'), gd_id='gd_2'))
+        ledger.close()
+
+        entries = failures.load_work_list(self.path)
+        self.assertEqual(len(entries), 2)
+        file_entry = next(e for e in entries if e['type'] == 'file')
+        self.assertEqual((file_entry['phase'], file_entry['error_class']), ('upload', failures.PERMANENT))
+        self.assertEqual(file_entry['mime_type'], 'text/plain')
+
+        entries = failures.load_work_list(self.path, skip_permanent=True)
+        self.assertEqual([(e['name'], e['error_class']) for e in entries], [('docs', failures.THROTTLED)])
+
+    def test_process_file_upload_records_failure(self):
+        mock_od_client = MagicMock()
+        mock_od_client.get_file_stream.side_effect = OneDriveError("gone", 404)
+        ledger = failures.FailureLedger(self.path)
+
+        item = {'id': 'od_1', 'name': 'a.txt', 'size': 5, 'file': {}}
+        with patch('migrate.get_thread_safe_service'):
+            migrate.process_file_upload(mock_od_client, MagicMock(), item, 'gd_root', 'a.txt', {}, ledger=ledger)
+        ledger.close()
+
+        entries = failures.load_work_list(self.path)
+        self.assertEqual([(e['od_id'], e['phase'], e['error_class']) for e in entries], [('od_1', 'transfer', failures.PERMANENT)])
+        mock_od_client.get_file_stream.assert_called_once()
+
+    def test_retry_failed_command(self):
+        with open(self.path, 'w') as f:
+            f.write('')
+        with patch('config.load_config', return_value={'failure_ledger': self.path}), \
+             patch('migrate.main') as mock_migrate, \
+             patch('main.configure_logging'):
+            self.assertEqual(main.main(['retry-failed']), 0)
+        mock_migrate.assert_not_called()
+
+class TestRetryFailedRun(FakeServersTestCase):
+    drive_options = {'retry_after': 0}
+
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.config = {'workers': 4, 'failure_ledger': os.path.join(self.tmpdir.name, 'failures.jsonl')}
+
+    @patch('failures.time.sleep')
+    def test_rerun_from_ledger_completes_tree(self, mock_sleep):
+        self.drive.throttle_rate = 1.0
+        migrate.run_migration(self.od_client, self.creds, self.service, self.config)
+
+        entries = failures.load_work_list(self.config['failure_ledger'])
+        self.assertEqual([(e['type'], e['od_id'], e['phase'], e['error_class']) for e in entries], [('folder', 'root', 'list_destination', failures.THROTTLED)])
+        self.assertEqual(self.drive.requests['list'], failures.DEFAULT_RETRIES + 1)
+
+        self.drive.throttle_rate = 0.0
+        migrate.run_migration(self.od_client, self.creds, self.service, self.config, work_list=entries)
+
+        files = [f for f in self.drive.files.values() if f['mimeType'] != FOLDER_MIME]
+        self.assertEqual(len(files), self.tree.file_count)
+        self.assertEqual(failures.load_work_list(self.config['failure_ledger']), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+# Ensure we can import the modules under test
+sys.path.append(os.getcwd())
+import migrate
+from listing_cache import ListingCache
+from benchmarks.fake_servers import FOLDER_MIME, DRIVE_ROOT_ID
+from tests.helpers import FakeServersTestCase
+
+def file(file_id, name, parent=None, size=10):
+    item = {'id': file_id, 'name': name, 'mimeType': 'text/plain', 'size': str(size), 'md5Checksum': 'ab'}
+    if parent:
+        item['parents'] = [parent]
+    return item
+
+class TestListingCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'cache.db')
+        self.cache = ListingCache(self.path)
+
+    def tearDown(self):
+        self.cache.close()
+        self.tmp.cleanup()
+
+    def test_listed_folders_persist(self):
+        self.assertIsNone(self.cache.folder('p'))
+        self.cache.store_folder('p', [file('a', 'a.txt'), {'id': 'd', 'name': 'docs', 'mimeType': FOLDER_MIME}])
+        self.cache.close()
+
+        self.cache = ListingCache(self.path)
+        self.assertEqual(self.cache.folder('p'), {
+            'a.txt': file('a', 'a.txt'),
+            'docs': {'id': 'd', 'name': 'docs', 'mimeType': FOLDER_MIME},
+        })
+        # Its subfolder has not been listed
+        self.assertIsNone(self.cache.folder('d'))
+
+    def test_created_folder_counts_as_listed(self):
+        self.cache.store_folder('p', [])
+        self.cache.record({'id': 'd', 'name': 'docs', 'mimeType': FOLDER_MIME}, 'p')
+        self.cache.record({'id': 'b', 'name': 'b.txt', 'mimeType': 'text/plain', 'size': 5}, 'd')
+
+        self.assertEqual(set(self.cache.folder('p')), {'docs'})
+        self.assertEqual(self.cache.folder('d'), {'b.txt': {'id': 'b', 'name': 'b.txt', 'mimeType': 'text/plain', 'size': '5'}})
+
+    def test_changes_update_known_folders_only(self):
+        self.cache.store_folder('p', [file('a', 'a.txt'), file('b', 'b.txt')])
+        self.cache.store_folder('q', [])
+
+        self.cache.apply_changes([
+            {'fileId': 'a', 'removed': True},
+            {'fileId': 'b', 'file': dict(file('b', 'b.txt', 'q'))},
+            {'fileId': 'c', 'file': dict(file('c', 'c.txt', 'p'), trashed=True)},
+            {'fileId': 'd', 'file': file('d', 'new.txt', 'p')},
+            {'fileId': 'e', 'file': file('e', 'elsewhere.txt', 'unknown')},
+        ])
+
+        self.assertEqual(set(self.cache.folder('p')), {'new.txt'})
+        self.assertEqual(set(self.cache.folder('q')), {'b.txt'})
+        self.assertIsNone(self.cache.folder('unknown'))
+
+    @patch('google_drive.get_start_page_token', return_value='20')
+    @patch('google_drive.list_changes')
+    def test_rejected_page_token_resets_the_cache(self, mock_list, mock_start):
+        mock_list.side_effect = HttpError(httplib2.Response({'status': 400}), b'Invalid Value')
+        self.cache.store_folder('p', [file('a', 'a.txt')])
+        self.cache.save_page_token('a:my-drive', '5')
+        self.cache.save_page_token('b:my-drive', '7')
+
+        self.assertEqual(self.cache.refresh(MagicMock(), 'a:my-drive'), 0)
+
+        self.assertIsNone(self.cache.folder('p'))
+        self.assertEqual((self.cache.page_token('a:my-drive'), self.cache.page_token('b:my-drive')), ('20', '7'))
+
+    @patch('google_drive.list_changes')
+    def test_throttled_changes_feed_is_raised(self, mock_list):
+        mock_list.side_effect = HttpError(httplib2.Response({'status': 429}), b'')
+        self.cache.store_folder('p', [])
+        self.cache.save_page_token('a:my-drive', '5')
+
+        with self.assertRaises(HttpError):
+            self.cache.refresh(MagicMock(), 'a:my-drive')
+        self.assertEqual(self.cache.folder('p'), {})
+
+    @patch('google_drive.get_root_id', return_value=DRIVE_ROOT_ID)
+    @patch('google_drive.list_changes')
+    def test_forbidden_changes_feed_disables_only_that_pair(self, mock_list, mock_root):
+        mock_list.side_effect = HttpError(httplib2.Response({'status': 403}), b'insufficientFilePermissions')
+        self.cache.store_folder('p', [file('a', 'a.txt')])
+        self.cache.save_page_token('a:my-drive', '5')
+        denied = migrate.MigrationPair('a', MagicMock(), MagicMock())
+        other = migrate.MigrationPair('b', MagicMock(), MagicMock())
+        denied.listing_cache = other.listing_cache = self.cache
+
+        migrate._refresh_listing_cache(denied, MagicMock())
+
+        self.assertIsNone(denied.listing_cache)
+        self.assertIs(other.listing_cache, self.cache)
+        self.assertEqual(set(self.cache.folder('p')), {'a.txt'})
+        self.assertEqual(self.cache.page_token('a:my-drive'), '5')
+
+class TestListingCacheEndToEnd(FakeServersTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.config = {'workers': 4, 'listing_cache': {'path': os.path.join(self.tmp.name, 'cache.db')}, 'failure_ledger': os.devnull}
+
+    def find(self, name, parent):
+        return [f for f in self.drive.files.values() if f['name'] == name and parent in f['parents']]
+
+    def test_later_runs_read_folders_from_the_cache(self):
+        migrate.run_migration(self.od_client, self.creds, self.service, self.config)
+        # Only the root existed before; created folders are known to be empty
+        self.assertEqual(self.drive.requests['list'], 1)
+
+        # A file deleted in Drive between runs reaches the cache through the changes feed
+        folder = self.find('folder_0', DRIVE_ROOT_ID)[0]
+        deleted = self.find('file_1.bin', folder['id'])[0]
+        self.drive.delete(deleted['id'])
+
+        migrate.run_migration(self.od_client, self.creds, self.service, self.config)
+
+        self.assertEqual(self.drive.requests['list'], 1)
+        self.assertEqual(len(self.find('file_1.bin', folder['id'])), 1)
+        # The top level is cached under the root's real id, so its files are
+        # known to exist: none is uploaded again under the same name
+        self.assertEqual(len(self.find('folder_0', DRIVE_ROOT_ID)), 1)
+        top_level = [f['name'] for f in self.drive.files.values() if DRIVE_ROOT_ID in f['parents']]
+        self.assertEqual(len(top_level), len(set(top_level)))
+
+    def test_rejected_page_token_starts_the_cache_over(self):
+        migrate.run_migration(self.od_client, self.creds, self.service, self.config)
+        cache = ListingCache(self.config['listing_cache']['path'])
+        cache.save_page_token('default:my-drive', '999999')
+        cache.close()
+
+        migrate.run_migration(self.od_client, self.creds, self.service, self.config)
+
+        # Every folder was listed again, and none was created twice
+        self.assertEqual(self.drive.requests['list'], 1 + self.tree.folder_count + 1)
+        folders = [f for f in self.drive.files.values() if f['mimeType'] == FOLDER_MIME]
+        self.assertEqual(len(folders), self.tree.folder_count)
+
+    def test_unreadable_changes_feed_disables_the_cache_for_the_run(self):
+        pair = migrate.MigrationPair('default', self.od_client, self.creds)
+        pair.listing_cache = MagicMock()
+        pair.listing_cache.refresh.side_effect = ValueError("invalid page token")
+
+        migrate._refresh_listing_cache(pair, self.service)
+
+        self.assertIsNone(pair.listing_cache)
+
+if __name__ == '__main__':
+    unittest.main()
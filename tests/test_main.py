@@ -0,0 +1,146 @@
+import os
+import subprocess
+import sys
+import unittest
+from unittest.mock import MagicMock, patch
+
+# Ensure we can import main
+sys.path.append(os.getcwd())
+import main
+import plan
+from onedrive import OneDriveError
+
+class TestCli(unittest.TestCase):
+
+    def test_help_does_not_import_heavy_dependencies(self):
+        code = (
+            "import sys, main\n"
+            "try:\n"
+            "    main.main(['--help'])\n"
+            "except SystemExit:\n"
+            "    pass\n"
+            "heavy = [m for m in ('googleapiclient', 'msal', 'requests', 'google_auth_oauthlib') if m in sys.modules]\n"
+            "print('heavy:' + ','.join(heavy))\n"
+        )
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip().splitlines()[-1], 'heavy:')
+
+    def test_plan_does_not_import_google_client(self):
+        code = (
+            "import sys, plan, failures\n"
+            "error = ConnectionResetError('reset')\n"
+            "failures.classify(error), failures.retry_after(error)\n"
+            "print('google:' + ','.join(m for m in ('googleapiclient', 'google.auth', 'httplib2') if m in sys.modules))\n"
+        )
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip().splitlines()[-1], 'google:')
+
+    def test_workers_flag_overrides_config(self):
+        with patch('config.load_config', return_value={'workers': 5}) as mock_load, \
+             patch('migrate.main', return_value=0) as mock_migrate, \
+             patch('main.configure_logging'):
+            self.assertEqual(main.main(['--config', 'other.json', '--workers', '12', 'migrate']), 0)
+
+        mock_load.assert_called_with('other.json')
+        mock_migrate.assert_called_with({'workers': 12}, None)
+
+    def test_migrate_status_is_passed_through(self):
+        with patch('config.load_config', return_value={}), \
+             patch('migrate.main', return_value=1), \
+             patch('main.configure_logging'):
+            self.assertEqual(main.main(['migrate']), 1)
+
+    def test_missing_config_is_an_error_in_every_command(self):
+        with patch('main.configure_logging'), self.assertLogs('main', 'ERROR'):
+            for command in ('migrate', 'retry-failed', 'plan', 'verify'):
+                self.assertEqual(main.main(['--config', 'does-not-exist.json', command]), 1, command)
+
+    def test_authentication_failure_is_an_error(self):
+        # A config with only a "migrations" list has no top-level "microsoft" section
+        config = {'migrations': [{'name': 'sales'}]}
+        with patch('config.load_config', return_value=config), \
+             patch('google_drive.get_credentials', return_value=MagicMock()), \
+             patch('main.configure_logging'), self.assertLogs('main', 'ERROR'):
+            for command in ('plan', 'verify'):
+                self.assertEqual(main.main([command]), 1, command)
+
+    def test_several_migrations_rejected_by_single_pair_commands(self):
+        config = {'migrations': [{'name': 'a'}, {'name': 'b'}]}
+        with patch('config.load_config', return_value=config), \
+             patch('main._authenticate_onedrive') as mock_auth, \
+             patch('main.configure_logging'), self.assertLogs('main', 'ERROR') as logs:
+            for command in ('plan', 'verify'):
+                self.assertEqual(main.main([command]), 1, command)
+        mock_auth.assert_not_called()
+        self.assertIn('2 migrations', logs.output[0])
+
+    def test_plan_uses_the_only_pair(self):
+        config = {'microsoft': {'client_id': 'x'}, 'migrations': [{'name': 'sales', 'source': 'drives/abc', 'source_folder': 'F1'}]}
+        with patch('config.load_config', return_value=config), \
+             patch('main._authenticate_onedrive') as mock_auth, \
+             patch('plan.build_plan', return_value={'errors': []}) as mock_plan, \
+             patch('plan.format_plan', return_value=''), \
+             patch('main.configure_logging'):
+            self.assertEqual(main.main(['plan']), 0)
+        self.assertEqual(mock_auth.call_args[0][0]['microsoft']['drive'], 'drives/abc')
+        self.assertEqual(mock_plan.call_args[0][1], 'F1')
+
+    def test_unknown_arguments_rejected(self):
+        with self.assertRaises(SystemExit):
+            main.main(['plan', '--bogus'])
+
+    def test_bench_forwards_arguments(self):
+        with patch('benchmarks.harness.main') as mock_harness, patch('main.configure_logging'):
+            main.main(['bench', '--shapes', 'small', '--workers', '1,5'])
+        mock_harness.assert_called_with(['--shapes', 'small', '--workers', '1,5'])
+
+
+class TestPlan(unittest.TestCase):
+
+    def test_build_plan(self):
+        tree = {
+            'root': [
+                {'id': 'd1', 'name': 'docs', 'folder': {}},
+                {'id': 'f1', 'name': 'big.iso', 'size': 200 * 1024 * 1024, 'file': {}},
+            ],
+            'd1': [
+                {'id': 'f2', 'name': 'a.txt', 'size': 100, 'file': {}},
+                {'id': 'f3', 'name': 'b.jpg', 'size': 2 * 1024 * 1024, 'file': {}},
+            ],
+        }
+        mock_od_client = MagicMock()
+        mock_od_client.get_drive_items.side_effect = lambda folder_id: iter(tree[folder_id])
+
+        result = plan.build_plan(mock_od_client, workers=2)
+
+        self.assertEqual(result['folders'], 1)
+        self.assertEqual(result['files'], 3)
+        self.assertEqual(result['bytes'], 202 * 1024 * 1024 + 100)
+        self.assertEqual(result['size_classes']['<10KB']['files'], 1)
+        self.assertEqual(result['size_classes']['<100MB']['files'], 1)
+        self.assertEqual(result['size_classes']['>=100MB']['files'], 1)
+        self.assertEqual(result['largest_files'][0], {'path': 'big.iso', 'size': 200 * 1024 * 1024})
+        self.assertIn(os.path.join('docs', 'b.jpg'), [f['path'] for f in result['largest_files']])
+        self.assertIn('Files:   3', plan.format_plan(result))
+
+    @patch('failures.time.sleep')
+    def test_throttled_listing_is_retried(self, mock_sleep):
+        mock_od_client = MagicMock()
+        mock_od_client.get_drive_items.side_effect = [OneDriveError("slow down", 429), iter([{'id': 'f1', 'name': 'a.txt', 'size': 5, 'file': {}}])]
+
+        result = plan.build_plan(mock_od_client)
+
+        self.assertEqual((result['files'], result['errors']), (1, []))
+        mock_sleep.assert_called_once()
+
+    def test_listing_errors_are_collected(self):
+        mock_od_client = MagicMock()
+        mock_od_client.get_drive_items.side_effect = Exception("boom")
+
+        result = plan.build_plan(mock_od_client)
+
+        self.assertEqual(result['files'], 0)
+        self.assertEqual(result['errors'], [{'path': '', 'error': 'boom'}])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import sys
+import unittest
+import urllib.request
+from unittest.mock import MagicMock
+
+# Ensure we can import metrics
+sys.path.append(os.getcwd())
+import metrics
+import google_drive
+from googleapiclient.errors import HttpError
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_counter_and_gauge(self):
+        counter = self.registry.register(metrics.Counter('test_total', 'A counter'))
+        gauge = self.registry.register(metrics.Gauge('test_depth', 'A gauge'))
+        counter.inc()
+        counter.inc(4)
+        gauge.inc(3)
+        gauge.dec()
+
+        self.assertEqual(counter.get(), 5)
+        self.assertEqual(gauge.get(), 2)
+        output = metrics.render_prometheus(self.registry)
+        self.assertIn('# TYPE test_total counter', output)
+        self.assertIn('test_total 5', output)
+        self.assertIn('test_depth 2', output)
+
+    def test_labelled_metric_requires_labels(self):
+        counter = metrics.Counter('test_labelled_total', 'A counter', ('api',))
+        with self.assertRaises(AttributeError):
+            counter.inc()
+        with self.assertRaises(ValueError):
+            counter.labels('graph', 'extra')
+        counter.labels('graph').inc()
+        self.assertIs(counter.labels('graph'), counter.labels('graph'))
+
+    def test_histogram_buckets_and_quantile(self):
+        histogram = self.registry.register(metrics.Histogram('test_seconds', 'Latency', ('api',), buckets=(0.1, 1, 10)))
+        child = histogram.labels('drive')
+        for value in [0.05] * 98 + [0.5, 5]:
+            child.observe(value)
+
+        self.assertEqual(child.quantile(0.5), 0.1)
+        self.assertEqual(child.quantile(0.99), 1)
+        self.assertEqual(child.quantile(1.0), 10)
+
+        output = metrics.render_prometheus(self.registry)
+        self.assertIn('test_seconds_bucket{api="drive",le="0.1"} 98', output)
+        self.assertIn('test_seconds_bucket{api="drive",le="10.0"} 100', output)
+        self.assertIn('test_seconds_bucket{api="drive",le="+Inf"} 100', output)
+        self.assertIn('test_seconds_count{api="drive"} 100', output)
+
+    def test_http_endpoint(self):
+        server = metrics.start_http_server(0)
+        try:
+            port = server.server_address[1]
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics') as response:
+                body = response.read().decode('utf-8')
+            self.assertIn('migration_files_transferred_total', body)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_drive_throttling_is_counted(self):
+        throttled = metrics.API_THROTTLED.labels('drive')
+        before = throttled.get()
+        request = MagicMock()
+        request.execute.side_effect = HttpError(MagicMock(status=429), b'Too Many Requests')
+
+        with self.assertRaises(HttpError):
+            google_drive._execute(request, 'list')
+        self.assertEqual(throttled.get(), before + 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,207 @@
+import hashlib
+import io
+import json
+import os
+import sys
+import tarfile
+import unittest
+from unittest.mock import MagicMock
+
+# Ensure we can import the modules under test
+sys.path.append(os.getcwd())
+import metrics
+import migrate
+import packing
+import verify
+from benchmarks.fake_servers import SyntheticTree, FOLDER_MIME, DRIVE_ROOT_ID
+from tests.helpers import FakeServersTestCase
+
+class TreeClient:
+    """Serves a SyntheticTree like OneDriveClient, without HTTP."""
+    def __init__(self, tree):
+        self.tree = tree
+
+    def get_drive_items(self, folder_id):
+        return self.tree.children(folder_id)
+
+    def get_file_stream(self, file_id):
+        return io.BytesIO(self.tree.content(file_id))
+
+def build(archive, od_client):
+    stream = packing.ArchiveStream(archive, od_client)
+    try:
+        return stream.read()
+    finally:
+        stream.close()
+
+class TestPackPolicy(unittest.TestCase):
+
+    def setUp(self):
+        self.tree = SyntheticTree(depth=2, folders_per_folder=2, files_per_folder=5, min_size=10, max_size=500)
+        self.client = TreeClient(self.tree)
+
+    def test_subtree_of_small_files_is_packed(self):
+        listings = {}
+        archive, reason = packing.PackPolicy(max_file_size=1000, min_files=15).scan(self.client.get_drive_items, 'd.0', listings)
+        self.assertIsNone(reason)
+        self.assertEqual(len(archive), 15)
+        self.assertIn('folder_1/file_4.bin', [entry['path'] for entry in archive.entries])
+        self.assertEqual(sorted(listings), ['d.0', 'd.0.0', 'd.0.1'])
+
+    def test_large_files_and_counts_rule_out_a_subtree(self):
+        self.assertEqual(packing.PackPolicy(max_file_size=100, min_files=1).scan(self.client.get_drive_items, 'd.0'), (None, packing.FILE_TOO_LARGE))
+        self.assertEqual(packing.PackPolicy(max_file_size=1000, min_files=16).scan(self.client.get_drive_items, 'd.0'), (None, packing.TOO_FEW_FILES))
+        self.assertEqual(packing.PackPolicy(max_file_size=1000, min_files=1, max_files=14).scan(self.client.get_drive_items, 'd.0'), (None, packing.TOO_MANY_FILES))
+
+    def test_folder_size_rules_out_a_subtree_before_listing(self):
+        policy = packing.PackPolicy(max_file_size=1000, max_files=10)
+        self.assertFalse(policy.may_qualify({'folder': {}, 'size': 10000}))
+        self.assertTrue(policy.may_qualify({'folder': {}, 'size': 9999}))
+        self.assertTrue(policy.may_qualify({'folder': {}}))
+
+class TestTryPackFolder(unittest.TestCase):
+
+    def setUp(self):
+        self.tree = SyntheticTree(depth=2, folders_per_folder=2, files_per_folder=5, min_size=10, max_size=500)
+        self.client = TreeClient(self.tree)
+        self.folder = next(item for item in self.tree.children('root') if item['name'] == 'folder_0')
+
+    def try_pack(self, min_files, listings, gd_folder_contents=None):
+        packer = packing.PackPolicy(max_file_size=1000, min_files=min_files)
+        return migrate.try_pack_folder(self.client, self.folder, 'gd_root', 'folder_0', gd_folder_contents or {}, MagicMock(), [], packer=packer, listings=listings)
+
+    def test_listings_of_a_packed_folder_are_not_kept(self):
+        # Left by a scan of the parent folder that was ruled out
+        listings = {'d.0.0': self.tree.children('d.0.0'), 'other': []}
+        self.assertEqual(self.try_pack(15, listings), (True, None))
+        self.assertEqual(listings, {'other': []})
+
+    def test_listings_of_a_rejected_folder_are_kept_for_syncing(self):
+        listings = {}
+        self.assertEqual(self.try_pack(16, listings), (False, None))
+        self.assertEqual(sorted(listings), ['d.0', 'd.0.0', 'd.0.1'])
+
+    def test_archive_of_another_size_is_not_taken_as_packed(self):
+        archive, _ = packing.PackPolicy(max_file_size=1000, min_files=15).scan(self.client.get_drive_items, 'd.0')
+        contents = {'folder_0' + packing.MANIFEST_SUFFIX: {'id': 'm'}}
+
+        contents['folder_0' + packing.ARCHIVE_SUFFIX] = {'id': 'a', 'size': str(archive.size)}
+        self.assertEqual(self.try_pack(15, {}, contents), (True, None))
+
+        listings = {}
+        contents['folder_0' + packing.ARCHIVE_SUFFIX] = {'id': 'a', 'size': str(archive.size - 512)}
+        self.assertEqual(self.try_pack(15, listings, contents), (False, None))
+        self.assertEqual(sorted(listings), ['d.0', 'd.0.0', 'd.0.1'])
+
+class TestArchive(unittest.TestCase):
+
+    def test_size_and_offsets_are_exact(self):
+        tree = SyntheticTree(depth=1, folders_per_folder=1, files_per_folder=7, min_size=0, max_size=3000)
+        items = tree.children('root')[1:]
+        # Long and non-ASCII names need PAX headers
+        items[0] = dict(items[0], name='ü' * 150 + '.txt', lastModifiedDateTime='2023-10-27T10:30:00Z')
+        archive = packing.Archive([(f"sub/{item['name']}", item) for item in items])
+
+        data = build(archive, TreeClient(tree))
+
+        self.assertEqual(len(data), archive.size)
+        with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+            members = tar.getmembers()
+            self.assertEqual([m.name for m in members], [e['path'] for e in archive.entries])
+            self.assertEqual(members[0].mtime, 1698402600)
+        for entry, item in zip(archive.entries, items):
+            self.assertEqual(data[entry['offset']:entry['offset'] + entry['size']], tree.content(item['id']))
+
+        manifest = json.loads(archive.manifest('top/sub'))
+        self.assertEqual((manifest['source_path'], manifest['size'], len(manifest['files'])), ('top/sub', archive.size, 7))
+
+    def test_download_error_is_raised_to_the_reader(self):
+        tree = SyntheticTree(depth=0, files_per_folder=3, min_size=100, max_size=200)
+        archive = packing.Archive([(item['name'], item) for item in tree.children('root')])
+        client = MagicMock()
+        streams = {'f.0': io.BytesIO(tree.content('f.0'))}
+        client.get_file_stream.side_effect = lambda file_id: streams[file_id]
+
+        with self.assertRaises(KeyError):
+            build(archive, client)
+
+    def test_short_download_is_an_error(self):
+        tree = SyntheticTree(depth=0, files_per_folder=1, min_size=100, max_size=200)
+        archive = packing.Archive([(item['name'], item) for item in tree.children('root')])
+        client = MagicMock()
+        client.get_file_stream.return_value = io.BytesIO(b'short')
+
+        with self.assertRaises(OSError):
+            build(archive, client)
+
+class TestPackEndToEnd(FakeServersTestCase):
+    tree_shape = {'depth': 2, 'folders_per_folder': 2, 'files_per_folder': 6, 'min_size': 100, 'max_size': 2000}
+
+    def setUp(self):
+        super().setUp()
+        self.config = {'workers': 4, 'pack': {'max_file_size': 4096, 'min_files': 10}, 'failure_ledger': os.devnull}
+
+    def files(self):
+        return [f for f in self.drive.files.values() if f['mimeType'] != FOLDER_MIME]
+
+    def packed(self):
+        return sorted(f['name'] for f in self.files() if f['name'].startswith('folder_'))
+
+    def test_subfolders_are_uploaded_as_archives(self):
+        packed_before = metrics.FILES_PACKED.get()
+        migrate.run_migration(self.od_client, self.creds, self.service, self.config)
+
+        by_name = {f['name']: f for f in self.files()}
+        # Each top-level folder holds 18 files; the 6 at the root stay as they are
+        self.assertEqual(sorted(by_name), sorted(
+            [f'file_{i}.bin' for i in range(6)] +
+            [f'folder_{i}{suffix}' for i in range(2) for suffix in (packing.ARCHIVE_SUFFIX, packing.MANIFEST_SUFFIX)]))
+        self.assertFalse([f for f in self.drive.files.values() if f['mimeType'] == FOLDER_MIME])
+        self.assertEqual(metrics.FILES_PACKED.get() - packed_before, 36)
+
+        # The archive in Drive is byte for byte the one built locally
+        archive, _ = packing.PackPolicy(4096, 10).scan(self.tree.children, 'd.0')
+        expected = build(archive, TreeClient(self.tree))
+        uploaded = by_name['folder_0' + packing.ARCHIVE_SUFFIX]
+        self.assertEqual(int(uploaded['size']), len(expected))
+        self.assertEqual(uploaded['sha1Checksum'], hashlib.sha1(expected).hexdigest())
+
+        report = verify.verify(self.od_client, self.creds, workers=4)
+        self.assertEqual(report['summary']['missing'] + report['summary']['extra'], 0)
+
+        # A second run finds the archives and does not pack again
+        packed = self.packed()
+        migrate.run_migration(self.od_client, self.creds, self.service, self.config)
+        self.assertEqual(self.packed(), packed)
+
+    def test_folders_are_listed_once_when_nothing_qualifies(self):
+        self.config['pack'] = {'max_file_size': 4096, 'min_files': 1000}
+        migrate.run_migration(self.od_client, self.creds, self.service, self.config)
+
+        self.assertEqual(self.graph.requests['list_children'], self.tree.folder_count + 1)
+        self.assertEqual(len(self.files()), self.tree.file_count)
+
+    def test_changed_archive_is_synced_file_by_file(self):
+        migrate.run_migration(self.od_client, self.creds, self.service, self.config)
+        archive = next(f for f in self.files() if f['name'] == 'folder_1' + packing.ARCHIVE_SUFFIX)
+        archive['size'] = str(int(archive['size']) - 512)
+
+        migrate.run_migration(self.od_client, self.creds, self.service, self.config)
+
+        folders = [f for f in self.drive.files.values() if f['mimeType'] == FOLDER_MIME]
+        self.assertEqual(sorted(f['name'] for f in folders if f['parents'] == [DRIVE_ROOT_ID]), ['folder_1'])
+        self.assertEqual(len(self.packed()), 4)
+
+    def test_missing_manifest_is_uploaded_on_its_own(self):
+        migrate.run_migration(self.od_client, self.creds, self.service, self.config)
+        manifest = next(f for f in self.files() if f['name'] == 'folder_1' + packing.MANIFEST_SUFFIX)
+        self.drive.delete(manifest['id'])
+        packed_before = metrics.FILES_PACKED.get()
+
+        migrate.run_migration(self.od_client, self.creds, self.service, self.config)
+
+        self.assertEqual(metrics.FILES_PACKED.get(), packed_before)
+        self.assertEqual(len(self.packed()), 4)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+# Ensure we can import the modules under test
+sys.path.append(os.getcwd())
+import failures
+import migrate
+import pairs
+from benchmarks.fake_servers import SyntheticTree, FakeGraphServer, FakeDriveServer, FOLDER_MIME, DRIVE_ROOT_ID, fake_onedrive_client, use_fake_drive
+
+class TestPairConfig(unittest.TestCase):
+
+    def test_pair_sections_override_top_level(self):
+        config = {'workers': 4, 'microsoft': {'client_id': 'app', 'tenant_id': 't'}, 'google': {'credentials_file': 'c.json'}}
+        spec = {'name': 'sales', 'source': '/sites/s1/drive', 'google': {'token_file': 'token_sales.json'}}
+
+        merged = pairs.pair_config(config, spec)
+
+        self.assertEqual(merged['microsoft'], {'client_id': 'app', 'tenant_id': 't', 'drive': '/sites/s1/drive', 'token_cache': 'token_onedrive_sales.bin'})
+        self.assertEqual(merged['google'], {'credentials_file': 'c.json', 'token_file': 'token_sales.json'})
+        self.assertNotIn('drive', config['microsoft'])
+
+    def test_pairs_get_their_own_token_files(self):
+        config = {'microsoft': {'client_id': 'app', 'token_cache': 'tokens/od.bin'}, 'google': {}}
+
+        alice = pairs.pair_config(config, {'name': 'alice', 'microsoft': {'token_cache': 'shared.bin'}})
+        sales = pairs.pair_config(config, {'name': 'sales/eu'})
+
+        self.assertEqual(alice['microsoft']['token_cache'], 'shared.bin')
+        self.assertEqual(alice['google']['token_file'], 'token_google_alice.json')
+        self.assertEqual(sales['microsoft']['token_cache'], 'tokens/od_sales_eu.bin')
+        self.assertEqual(sales['google']['token_file'], 'token_google_sales_eu.json')
+
+    @patch('pairs.OneDriveClient')
+    @patch('pairs.google_drive')
+    def test_single_pair_without_list_keeps_top_level_tokens(self, mock_gd, mock_od):
+        config = {'microsoft': {'client_id': 'app'}, 'google': {}}
+        pairs.build_pairs(config)
+        mock_gd.get_credentials.assert_called_with(config)
+        self.assertIs(mock_od.call_args[0][0], config)
+
+    def test_names_must_be_unique(self):
+        with self.assertRaises(ValueError):
+            pairs.build_pairs({'migrations': [{'name': 'a'}, {'name': 'a'}]})
+
+    @patch('pairs.OneDriveClient')
+    @patch('pairs.google_drive')
+    def test_pair_that_fails_to_authenticate_is_skipped(self, mock_gd, mock_od):
+        mock_gd.get_credentials.side_effect = [ValueError("no token"), MagicMock()]
+        config = {'microsoft': {'client_id': 'app'}, 'migrations': [
+            {'name': 'a'},
+            {'name': 'b', 'destination': {'shared_drive_id': 'sd1'}, 'max_upload_bytes': 10},
+        ]}
+
+        result = pairs.build_pairs(config)
+
+        self.assertEqual([p.name for p in result], ['b'])
+        self.assertEqual((result[0].gd_root_id, result[0].gd_drive_id, result[0].max_upload_bytes), ('sd1', 'sd1', 10))
+
+class TestQuota(unittest.TestCase):
+
+    def test_reserve_and_release(self):
+        pair = pairs.MigrationPair('quota-test', None, None, max_upload_bytes=100)
+        pair.reserve(60)
+        with self.assertRaises(failures.QuotaExceededError):
+            pair.reserve(50)
+        pair.release(60)
+        pair.reserve(100)
+
+class TestWorkLists(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.ledger = os.path.join(tmp.name, 'failures.jsonl')
+
+    def test_entries_of_pairs_not_run_are_kept(self):
+        entry = failures.folder_entry('d1', 'docs', gd_parent_id='root')
+
+        count = migrate.run_pairs({'workers': 1, 'failure_ledger': self.ledger}, [], {'renamed': [entry]})
+
+        self.assertEqual(count, 1)
+        self.assertEqual(failures.load_work_list(self.ledger), [dict(entry, pair='renamed')])
+
+    @patch('migrate.build_pairs')
+    def test_unnamed_entries_are_rejected_with_several_pairs(self, mock_build):
+        config = {'migrations': [{'name': 'a'}, {'name': 'b'}], 'failure_ledger': self.ledger}
+        work_list = [failures.folder_entry('d1', 'docs', gd_parent_id='root')]
+
+        self.assertEqual(migrate.main(config, work_list), 1)
+
+        mock_build.assert_not_called()
+        self.assertFalse(os.path.exists(self.ledger))
+
+    @patch('migrate.run_pairs', return_value=0)
+    @patch('migrate.build_pairs')
+    def test_unnamed_entries_go_to_the_only_pair(self, mock_build, mock_run):
+        mock_build.return_value = [pairs.MigrationPair('only', None, None)]
+        work_list = [failures.folder_entry('d1', 'docs', gd_parent_id='root')]
+
+        self.assertEqual(migrate.main({'migrations': [{'name': 'only'}]}, work_list), 0)
+
+        self.assertEqual(mock_run.call_args[0][2], {'only': work_list})
+
+class TestMultiplePairsEndToEnd(unittest.TestCase):
+
+    def setUp(self):
+        self.trees = [SyntheticTree(depth=1, folders_per_folder=2, files_per_folder=4, seed=seed) for seed in (1, 2)]
+        self.graphs = [FakeGraphServer(tree).start() for tree in self.trees]
+        self.drive = FakeDriveServer().start()
+        self.creds = use_fake_drive(self.drive.url)
+        self.ledger = tempfile.NamedTemporaryFile(suffix='.jsonl', delete=False).name
+
+    def tearDown(self):
+        use_fake_drive(None)
+        for graph in self.graphs:
+            graph.stop()
+        self.drive.stop()
+        os.remove(self.ledger)
+
+    def make_pair(self, name, graph, drive, **kwargs):
+        return pairs.MigrationPair(name, fake_onedrive_client(graph.url, drive=drive), self.creds, **kwargs)
+
+    def test_pairs_run_together_into_their_own_destinations(self):
+        small = self.trees[1]
+        quota = sum(small.size(f['id']) for f in small.children('root') if 'file' in f)
+        run = [
+            self.make_pair('users', self.graphs[0], '/users/u1/drive'),
+            # Shared drive destination; the quota covers about a third of the files
+            self.make_pair('sales', self.graphs[1], '/sites/s1/drive', gd_root_id='sd1', gd_drive_id='sd1', max_upload_bytes=quota),
+        ]
+
+        migrate.run_pairs({'workers': 4, 'failure_ledger': self.ledger}, run)
+
+        files = [f for f in self.drive.files.values() if f['mimeType'] != FOLDER_MIME]
+        top_level = {parent for f in self.drive.files.values() for parent in f['parents']} & {DRIVE_ROOT_ID, 'sd1'}
+        self.assertEqual(top_level, {DRIVE_ROOT_ID, 'sd1'})
+        self.assertEqual(run[0].files.get(), self.trees[0].file_count)
+        self.assertGreater(run[1].files.get(), 0)
+        self.assertLessEqual(run[1].bytes.get(), quota)
+        self.assertEqual(run[1].files.get() + run[1].failed.get(), small.file_count)
+        self.assertEqual(len(files), self.trees[0].file_count + run[1].files.get())
+
+        with open(self.ledger) as f:
+            entries = [json.loads(line) for line in f]
+        self.assertEqual(len(entries), small.file_count - run[1].files.get())
+        self.assertTrue(all(e['pair'] == 'sales' and e['error_class'] == failures.THROTTLED for e in entries))
+
+        # A later run with a fresh quota picks up where the ledger left off
+        retry = [self.make_pair('sales', self.graphs[1], '/sites/s1/drive', gd_root_id='sd1', gd_drive_id='sd1')]
+        migrate.run_pairs({'workers': 4, 'failure_ledger': os.devnull}, retry, {'sales': failures.load_work_list(self.ledger)})
+        files = [f for f in self.drive.files.values() if f['mimeType'] != FOLDER_MIME]
+        self.assertEqual(len(files), self.trees[0].file_count + small.file_count)
+
+if __name__ == '__main__':
+    unittest.main()
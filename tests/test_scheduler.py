@@ -0,0 +1,43 @@
+import os
+import sys
+import threading
+import unittest
+
+# Ensure we can import the modules under test
+sys.path.append(os.getcwd())
+from scheduler import FairExecutor
+
+class TestFairExecutor(unittest.TestCase):
+
+    def test_tenants_are_served_in_turn(self):
+        order = []
+        started, gate = threading.Event(), threading.Event()
+        with FairExecutor(1) as pool:
+            # Hold the only worker while both queues fill up
+            pool.tenant('big').submit(lambda: (started.set(), gate.wait()))
+            started.wait(1)
+            big, small = pool.tenant('big'), pool.tenant('small')
+            futures = [big.submit(order.append, f'big{i}') for i in range(5)]
+            futures += [small.submit(order.append, f'small{i}') for i in range(2)]
+            pending = (pool.pending('big'), pool.pending('small'))
+            gate.set()
+
+        self.assertEqual(pending, (5, 2))
+        self.assertEqual(order, ['big0', 'small0', 'big1', 'small1', 'big2', 'big3', 'big4'])
+        self.assertTrue(all(f.done() for f in futures))
+
+    def test_results_and_exceptions_reach_futures(self):
+        with FairExecutor(2) as pool:
+            ok = pool.tenant('a').submit(lambda x: x * 2, 21)
+            failed = pool.tenant('b').submit(lambda: 1 / 0)
+        self.assertEqual(ok.result(), 42)
+        self.assertIsInstance(failed.exception(), ZeroDivisionError)
+
+    def test_submit_after_shutdown_fails(self):
+        pool = FairExecutor(1)
+        pool.shutdown()
+        with self.assertRaises(RuntimeError):
+            pool.tenant('a').submit(print)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+import sys
+
+# Ensure we can import spool
+sys.path.append(os.getcwd())
+import spool
+import migrate
+
+class TestSpoolDirectory(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'spool')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_write_and_discard_releases_space(self):
+        s = spool.SpoolDirectory(self.path, 100)
+        spooled = s.reserve(10)
+        self.assertEqual(s.used_bytes, 10)
+
+        spooled.write_from(io.BytesIO(b'0123456789'))
+        with spooled.open() as f:
+            self.assertEqual(f.read(), b'0123456789')
+
+        path = spooled.path
+        spooled.discard()
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(s.used_bytes, 0)
+
+    def test_size_mismatch_is_rejected(self):
+        s = spool.SpoolDirectory(self.path, 100)
+        spooled = s.reserve(5)
+        with self.assertRaises(IOError):
+            spooled.write_from(io.BytesIO(b'0123456789'))
+        spooled.discard()
+        self.assertEqual(os.listdir(s.path), [])
+
+    def test_file_larger_than_cap_does_not_fit(self):
+        s = spool.SpoolDirectory(self.path, 100)
+        self.assertFalse(s.fits(101))
+        with self.assertRaises(spool.SpoolFullError):
+            s.reserve(101)
+
+    def test_reserve_blocks_until_space_is_released(self):
+        s = spool.SpoolDirectory(self.path, 10)
+        first = s.reserve(8)
+        acquired = threading.Event()
+
+        def reserve_second():
+            s.reserve(8)
+            acquired.set()
+
+        t = threading.Thread(target=reserve_second)
+        t.start()
+        # The cap is strict: the second reservation must wait
+        self.assertFalse(acquired.wait(0.1))
+
+        first.discard()
+        self.assertTrue(acquired.wait(2))
+        t.join()
+        self.assertEqual(s.used_bytes, 8)
+
+    def _process_dir(self, pid):
+        path = os.path.join(self.path, f'{spool.PROCESS_DIR_PREFIX}{pid}')
+        os.makedirs(path)
+        with open(os.path.join(path, spool.SPOOL_PREFIX + 'file'), 'wb') as f:
+            f.write(b'x')
+        return path
+
+    @patch('spool._process_alive', side_effect=lambda pid: pid == 1001)
+    def test_only_directories_of_finished_processes_removed_on_startup(self, _):
+        stale = self._process_dir(1000)
+        running = self._process_dir(1001)
+        spool.SpoolDirectory(self.path, 10)
+        self.assertFalse(os.path.exists(stale))
+        # Another migration sharing the path is still using its files
+        self.assertTrue(os.path.exists(running))
+
+    def test_close_removes_own_directory(self):
+        s = spool.SpoolDirectory(self.path, 10)
+        self.assertEqual(os.path.dirname(s.path), self.path)
+        spooled = s.reserve(2)
+        spooled.write_from(io.BytesIO(b'ab'))
+        s.close()
+        self.assertFalse(os.path.exists(s.path))
+        self.assertTrue(os.path.isdir(self.path))
+
+
+class TestMigrateSpool(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.spool = spool.SpoolDirectory(self.tmpdir, 1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    @patch('migrate.google_drive')
+    def test_download_is_spooled_and_upload_handed_off(self, mock_gd):
+        mock_od_client = MagicMock()
+        mock_od_client.get_file_stream.return_value = io.BytesIO(b'hello')
+        mock_upload_executor = MagicMock()
+
+        item = {'name': 'a.txt', 'id': 'od_1', 'file': {'mimeType': 'text/plain'}, 'size': 5}
+        migrate.process_file_upload(mock_od_client, MagicMock(), item, 'gd_root', 'a.txt', {}, self.spool, mock_upload_executor)
+
+        mock_gd.upload_file.assert_not_called()
+        args = mock_upload_executor.submit.call_args[0]
+        self.assertEqual(args[0], migrate.upload_spooled_file)
+        self.assertEqual(self.spool.used_bytes, 5)
+
+    @patch('failures.time.sleep')
+    @patch('migrate.google_drive')
+    def test_upload_retries_from_local_copy(self, mock_gd, mock_sleep):
+        mock_service = MagicMock()
+        uploaded = []
+
+        def upload(service, name, parent, stream, size, mime):
+            uploaded.append(stream.read())
+            if len(uploaded) == 1:
+                raise ConnectionResetError("connection reset")
+
+        mock_gd.upload_file.side_effect = upload
+        spooled = self.spool.reserve(5)
+        spooled.write_from(io.BytesIO(b'hello'))
+
+        with patch('migrate.get_thread_safe_service', return_value=mock_service):
+            migrate.upload_spooled_file(MagicMock(), spooled, 'a.txt', 'gd_root', 'text/plain', 'a.txt')
+
+        self.assertEqual(uploaded, [b'hello', b'hello'])
+        self.assertEqual(self.spool.used_bytes, 0)
+        self.assertEqual(os.listdir(self.spool.path), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+# Ensure we can import tracing
+sys.path.append(os.getcwd())
+import tracing
+
+class TestTracing(unittest.TestCase):
+
+    def tearDown(self):
+        tracing.disable()
+
+    def test_disabled_is_noop(self):
+        def work():
+            return 42
+
+        self.assertFalse(tracing.is_enabled())
+        self.assertIs(tracing.span('a'), tracing.span('b', 'cat', x=1))
+        self.assertIs(tracing.queued(work), work)
+        with tracing.span('noop') as s:
+            s.set(extra=1)
+
+    def test_spans_exported_as_chrome_trace(self):
+        tracing.enable()
+        with tracing.span('outer', 'scan', path='a'):
+            with tracing.span('inner', 'graph') as s:
+                s.set(status=200)
+        tracing.queued(lambda: None, path='a/b')()
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'trace.json')
+            tracing.export_chrome_trace(path)
+            with open(path) as f:
+                trace = json.load(f)
+        finally:
+            shutil.rmtree(tmpdir)
+
+        spans = {e['name']: e for e in trace['traceEvents'] if e['ph'] == 'X'}
+        self.assertEqual(set(spans), {'outer', 'inner'})
+        self.assertEqual(spans['outer']['args'], {'path': 'a'})
+        self.assertEqual(spans['inner']['args'], {'status': 200})
+        # Inner span nests within the outer one
+        self.assertGreaterEqual(spans['inner']['ts'], spans['outer']['ts'])
+        self.assertLessEqual(spans['inner']['ts'] + spans['inner']['dur'], spans['outer']['ts'] + spans['outer']['dur'])
+        self.assertTrue(any(e['ph'] == 'M' for e in trace['traceEvents']))
+
+        # Queue waits are async begin/end pairs, so they never overlap spans on the worker's track
+        begin, end = [e for e in trace['traceEvents'] if e['name'] == 'queue_wait']
+        self.assertEqual((begin['ph'], end['ph']), ('b', 'e'))
+        self.assertEqual(begin['id'], end['id'])
+        self.assertEqual(begin['args'], {'path': 'a/b'})
+        self.assertLessEqual(begin['ts'], end['ts'])
+
+    def test_errors_are_tagged(self):
+        tracer = tracing.enable()
+        with self.assertRaises(ValueError):
+            with tracing.span('failing'):
+                raise ValueError()
+        event = tracer.to_chrome_trace()['traceEvents'][-1]
+        self.assertEqual(event['args'], {'error': 'ValueError'})
+
+    def test_buffer_is_bounded(self):
+        tracer = tracing.enable(max_events=10)
+        for i in range(25):
+            with tracing.span('s', i=i):
+                pass
+
+        trace = tracer.to_chrome_trace()
+        spans = [e for e in trace['traceEvents'] if e['ph'] == 'X']
+        self.assertEqual(len(spans), 10)
+        self.assertEqual(spans[0]['args'], {'i': 15})
+        self.assertEqual(trace['otherData']['dropped_events'], 15)
+
+if __name__ == '__main__':
+    unittest.main()
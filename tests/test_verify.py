@@ -0,0 +1,124 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+# Ensure we can import the modules under test
+sys.path.append(os.getcwd())
+import migrate
+import verify
+from onedrive import OneDriveError
+from benchmarks.fake_servers import FOLDER_MIME, DRIVE_ROOT_ID
+from tests.helpers import FakeServersTestCase
+
+def od_file(item_id, name, size, sha1=None):
+    item = {'id': item_id, 'name': name, 'size': size, 'file': {'mimeType': 'text/plain'}}
+    if sha1:
+        item['file']['hashes'] = {'sha1Hash': sha1}
+    return item
+
+def gd_file(file_id, name, size, sha1=None):
+    return {'id': file_id, 'name': name, 'mimeType': 'text/plain', 'size': str(size), 'sha1Checksum': sha1}
+
+class TestCompareFolder(unittest.TestCase):
+
+    def test_missing_extra_and_mismatched(self):
+        od_items = [
+            od_file('o1', 'same.txt', 10, 'AA'),
+            od_file('o2', 'resized.txt', 10),
+            od_file('o3', 'changed.txt', 10, 'BB'),
+            od_file('o4', 'gone.txt', 10),
+            {'id': 'o5', 'name': 'docs', 'folder': {}},
+            {'id': 'o6', 'name': 'new', 'folder': {}},
+        ]
+        gd_items = [
+            gd_file('g1', 'same.txt', 10, 'aa'),
+            gd_file('g2', 'resized.txt', 11),
+            gd_file('g3', 'changed.txt', 10, 'cc'),
+            {'id': 'g5', 'name': 'docs', 'mimeType': FOLDER_MIME},
+            gd_file('g7', 'stray.txt', 1),
+        ]
+
+        missing, extra, mismatched, subfolders = verify.compare_folder(od_items, gd_items, 'top', 'gp')
+
+        self.assertEqual([(m['type'], m['name']) for m in missing], [('file', 'gone.txt'), ('folder', 'new')])
+        self.assertEqual(missing[0]['gd_parent_id'], 'gp')
+        self.assertEqual(missing[0]['path'], os.path.join('top', 'gone.txt'))
+        self.assertEqual([e['gd_id'] for e in extra], ['g7'])
+        self.assertEqual({m['od_id']: m['reason'] for m in mismatched}, {'o2': 'size 10 != 11', 'o3': 'sha1Hash mismatch'})
+        self.assertEqual(subfolders, [('o5', 'g5', os.path.join('top', 'docs'))])
+
+    def test_timestamped_copy_counts_as_match(self):
+        od_items = [od_file('o1', 'report.pdf', 5)]
+        gd_items = [gd_file('g1', 'report.pdf', 4), gd_file('g2', 'report_20231027_103000.pdf', 5)]
+
+        missing, extra, mismatched, _ = verify.compare_folder(od_items, gd_items, '', 'root')
+
+        self.assertEqual((missing, extra, mismatched), ([], [], []))
+
+class TestVerifyRetries(unittest.TestCase):
+
+    @patch('failures.time.sleep')
+    def test_throttled_listings_are_retried(self, mock_sleep):
+        od_client = MagicMock()
+        od_client.get_drive_items.side_effect = [OneDriveError("slow down", 429), iter([od_file('o1', 'a.txt', 4)])]
+        unavailable = HttpError(httplib2.Response({'status': 503}), b'')
+
+        with patch('verify.get_thread_safe_service'), \
+             patch('google_drive.list_folder_items', side_effect=[unavailable, [gd_file('g1', 'a.txt', 4)]]):
+            report = verify.verify(od_client, None, workers=1)
+
+        self.assertEqual(report['summary']['errors'], 0)
+        self.assertEqual(report['summary']['files_compared'], 1)
+        self.assertEqual(mock_sleep.call_count, 2)
+
+class TestVerifyEndToEnd(FakeServersTestCase):
+
+    def _delete(self, file_id):
+        file = self.drive.files.pop(file_id)
+        for parent in file['parents']:
+            self.drive._children[parent].remove(file_id)
+
+    def test_verify_and_rerun_from_work_list(self):
+        migrate.run_migration(self.od_client, self.creds, self.service, {'workers': 4, 'failure_ledger': os.devnull})
+
+        report = verify.verify(self.od_client, self.creds, workers=4)
+        self.assertEqual(report['summary']['missing'] + report['summary']['mismatched'] + report['summary']['extra'], 0)
+        self.assertEqual(report['summary']['files_compared'], self.tree.file_count)
+        self.assertEqual(report['summary']['folders_compared'], self.tree.folder_count + 1)
+
+        # Lose one file and one whole subtree
+        files = [f for f in self.drive.files.values() if f['mimeType'] != FOLDER_MIME and f['parents'] == [DRIVE_ROOT_ID]]
+        folder = next(f for f in self.drive.files.values() if f['mimeType'] == FOLDER_MIME and f['parents'] == [DRIVE_ROOT_ID])
+        self._delete(files[0]['id'])
+        for child_id in list(self.drive._children[folder['id']]):
+            if self.drive.files[child_id]['mimeType'] == FOLDER_MIME:
+                for grandchild_id in list(self.drive._children[child_id]):
+                    self._delete(grandchild_id)
+            self._delete(child_id)
+        self._delete(folder['id'])
+
+        report = verify.verify(self.od_client, self.creds, workers=4)
+        self.assertEqual(sorted(m['type'] for m in report['missing']), ['file', 'folder'])
+        self.assertEqual(report['summary']['errors'], 0)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'verify.json')
+            verify.write_report(report, path)
+            with open(path) as f:
+                self.assertEqual(json.load(f)['summary'], report['summary'])
+            work_list = verify.load_work_list(path)
+
+        migrate.run_migration(self.od_client, self.creds, self.service, {'workers': 4, 'failure_ledger': os.devnull}, work_list=work_list)
+
+        report = verify.verify(self.od_client, self.creds, workers=4)
+        self.assertEqual(report['summary']['missing'] + report['summary']['mismatched'] + report['summary']['extra'], 0)
+        self.assertIn('0 missing', verify.format_summary(report))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import logging
+import threading
+import functools
+import itertools
+import collections
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on buffered events. When full, the oldest events are dropped.
+DEFAULT_MAX_EVENTS = 1_000_000
+
+class _NullSpan:
+    """Shared no-op context manager returned while tracing is disabled."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **args):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('_tracer', '_name', '_cat', '_args', '_start')
+
+    def __init__(self, tracer, name, cat, args):
+        self._tracer = tracer
+        self._name = name
+        self._cat = cat
+        self._args = args
+
+    def __enter__(self):
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self._args['error'] = exc_type.__name__
+        self._tracer.record(self._name, self._cat, self._start, time.perf_counter_ns(), self._args)
+        return False
+
+    def set(self, **args):
+        """Attaches extra arguments discovered while the span is open."""
+        self._args.update(args)
+
+
+class Tracer:
+    """
+    Collects trace events in a bounded ring buffer. Spans become complete
+    ("X") events on the recording thread. Waits that overlap other work on
+    that thread become async ("b"/"e") pairs, which viewers draw on their own
+    track instead of mis-nesting them.
+    """
+    def __init__(self, max_events=DEFAULT_MAX_EVENTS):
+        self._events = collections.deque(maxlen=max_events)
+        self._thread_names = {}
+        self._origin = time.perf_counter_ns()
+        self._recorded = 0
+        self._async_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def span(self, name, cat, args):
+        return _Span(self, name, cat, args)
+
+    def record(self, name, cat, start_ns, end_ns, args, is_async=False):
+        tid = threading.get_ident()
+        if tid not in self._thread_names:
+            self._thread_names[tid] = threading.current_thread().name
+        # next() on itertools.count is atomic under the GIL
+        async_id = next(self._async_ids) if is_async else None
+        # deque.append with maxlen is atomic; the lock only guards the counter
+        self._events.append((name, cat, start_ns, end_ns, tid, args, async_id))
+        with self._lock:
+            self._recorded += 1
+
+    @property
+    def dropped(self):
+        return max(self._recorded - len(self._events), 0)
+
+    def to_chrome_trace(self):
+        pid = os.getpid()
+        events = []
+        for tid, thread_name in list(self._thread_names.items()):
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': thread_name}})
+
+        for name, cat, start_ns, end_ns, tid, args, async_id in list(self._events):
+            event = {
+                'name': name,
+                'cat': cat,
+                'ts': (start_ns - self._origin) / 1000,
+                'pid': pid,
+                'tid': tid,
+            }
+            if args:
+                event['args'] = args
+            if async_id is None:
+                event['ph'] = 'X'
+                event['dur'] = (end_ns - start_ns) / 1000
+                events.append(event)
+            else:
+                events.append(dict(event, ph='b', id=async_id))
+                events.append({'name': name, 'cat': cat, 'ph': 'e', 'id': async_id, 'ts': (end_ns - self._origin) / 1000, 'pid': pid, 'tid': tid})
+
+        return {'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': {'dropped_events': self.dropped}}
+
+
+# The active tracer, or None when tracing is disabled
+_tracer = None
+
+def enable(max_events=DEFAULT_MAX_EVENTS):
+    global _tracer
+    _tracer = Tracer(max_events)
+    return _tracer
+
+def disable():
+    global _tracer
+    _tracer = None
+
+def is_enabled():
+    return _tracer is not None
+
+def span(name, cat='', **args):
+    """
+    Context manager that records a span around the block.
+    Returns a shared no-op object when tracing is disabled.
+    """
+    tracer = _tracer
+    if tracer is None:
+        return _NULL_SPAN
+    return tracer.span(name, cat, args)
+
+def queued(fn, name='queue_wait', cat='worker', **args):
+    """
+    Wraps a function about to be submitted to an executor so that the time it
+    spends waiting for a worker is recorded, as an async event since it
+    overlaps whatever the worker ran before. Returns `fn` unchanged when disabled.
+    """
+    tracer = _tracer
+    if tracer is None:
+        return fn
+
+    submitted = time.perf_counter_ns()
+
+    @functools.wraps(fn)
+    def wrapper(*fn_args, **fn_kwargs):
+        tracer.record(name, cat, submitted, time.perf_counter_ns(), args, is_async=True)
+        return fn(*fn_args, **fn_kwargs)
+
+    return wrapper
+
+def export_chrome_trace(path):
+    """
+    Writes the collected events as Chrome trace-event JSON, which can be opened
+    in chrome://tracing or https://ui.perfetto.dev.
+    """
+    tracer = _tracer
+    if tracer is None:
+        return
+
+    trace = tracer.to_chrome_trace()
+    with open(path, 'w') as f:
+        json.dump(trace, f)
+
+    dropped = trace['otherData']['dropped_events']
+    logger.info(f"Wrote {len(trace['traceEvents'])} trace events to {path}" + (f" ({dropped} oldest events dropped)" if dropped else ""))
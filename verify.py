@@ -0,0 +1,203 @@
+import os
+import re
+import json
+import logging
+import datetime
+import concurrent.futures
+
+import failures
+import google_drive
+import packing
+from migrate import get_thread_safe_service
+
+logger = logging.getLogger(__name__)
+
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+
+# Folders compared concurrently; each comparison lists one folder on both sides
+DEFAULT_VERIFY_WORKERS = 16
+
+# Names produced by migrate.get_timestamped_name when a file already existed
+TIMESTAMPED_NAME = re.compile(r'^(?P<stem>.*)_\d{8}_\d{6}(?P<ext>\.[^.]*)?$')
+
+# OneDrive hash name -> equivalent Drive checksum field
+HASH_FIELDS = [
+    ('sha256Hash', 'sha256Checksum'),
+    ('sha1Hash', 'sha1Checksum'),
+]
+
+def compare_file(od_item, gd_file):
+    """
+    Compares a OneDrive file with a Drive file using only listing metadata.
+    Returns None if they match, otherwise the reason they differ.
+    Falls back to size alone when no checksum is available on both sides
+    (OneDrive for Business only provides quickXorHash, which Drive does not compute).
+    """
+    od_size = od_item.get('size', 0)
+    gd_size = int(gd_file.get('size', -1))
+    if od_size != gd_size:
+        return f"size {od_size} != {gd_size}"
+
+    hashes = od_item.get('file', {}).get('hashes', {})
+    for od_field, gd_field in HASH_FIELDS:
+        if hashes.get(od_field) and gd_file.get(gd_field):
+            if hashes[od_field].lower() != gd_file[gd_field].lower():
+                return f"{od_field} mismatch"
+            return None
+    return None
+
+def _original_name(name):
+    """'report_20231027_103000.pdf' -> 'report.pdf', or None for other names."""
+    match = TIMESTAMPED_NAME.match(name)
+    if not match:
+        return None
+    return match.group('stem') + (match.group('ext') or '')
+
+def _entry(kind, path, od_item=None, gd_parent_id=None, gd_file=None, reason=None):
+    entry = {'type': kind, 'path': path}
+    if od_item is not None:
+        entry['od_id'] = od_item.get('id')
+        entry['name'] = od_item.get('name')
+        if kind == 'file':
+            entry['size'] = od_item.get('size', 0)
+            entry['mime_type'] = od_item.get('file', {}).get('mimeType', 'application/octet-stream')
+    if gd_parent_id is not None:
+        entry['gd_parent_id'] = gd_parent_id
+    if gd_file is not None:
+        entry['gd_id'] = gd_file['id']
+    if reason:
+        entry['reason'] = reason
+    return entry
+
+def compare_folder(od_items, gd_items, path, gd_folder_id):
+    """
+    Compares the direct children of one folder on both sides.
+    Returns (missing, extra, mismatched, subfolders) where subfolders is a list
+    of (od_folder_id, gd_folder_id, path) pairs that exist on both sides.
+    A folder uploaded as a tar archive counts as present.
+    """
+    missing, extra, mismatched, subfolders = [], [], [], []
+
+    by_name = {}
+    renamed = {}
+    for gd_file in gd_items:
+        by_name.setdefault(gd_file['name'], []).append(gd_file)
+        original = _original_name(gd_file['name'])
+        if original is not None:
+            renamed.setdefault(original, []).append(gd_file)
+
+    matched_ids = set()
+    for od_item in od_items:
+        name = od_item.get('name')
+        item_path = os.path.join(path, name)
+        candidates = by_name.get(name, [])
+
+        if 'folder' in od_item:
+            folder = next((f for f in candidates if f['mimeType'] == FOLDER_MIME), None)
+            archives = by_name.get(name + packing.ARCHIVE_SUFFIX, [])
+            if folder is None and archives:
+                # Packed into one archive; its contents are not compared
+                matched_ids.update(f['id'] for f in archives + by_name.get(name + packing.MANIFEST_SUFFIX, []))
+            elif folder is None:
+                missing.append(_entry('folder', item_path, od_item, gd_folder_id))
+            else:
+                matched_ids.add(folder['id'])
+                subfolders.append((od_item.get('id'), folder['id'], item_path))
+            continue
+
+        # A conflicting upload is stored under a timestamped name, so those count too
+        files = [f for f in candidates + renamed.get(name, []) if f['mimeType'] != FOLDER_MIME]
+        if not files:
+            missing.append(_entry('file', item_path, od_item, gd_folder_id))
+            continue
+
+        matched_ids.update(f['id'] for f in files)
+        reasons = [compare_file(od_item, f) for f in files]
+        if None not in reasons:
+            mismatched.append(_entry('file', item_path, od_item, gd_folder_id, files[0], reasons[0]))
+
+    for gd_file in gd_items:
+        if gd_file['id'] not in matched_ids:
+            item_path = os.path.join(path, gd_file['name'])
+            kind = 'folder' if gd_file['mimeType'] == FOLDER_MIME else 'file'
+            extra.append(_entry(kind, item_path, gd_parent_id=gd_folder_id, gd_file=gd_file))
+
+    return missing, extra, mismatched, subfolders
+
+def verify(od_client, creds, od_root_id='root', gd_root_id='root', workers=DEFAULT_VERIFY_WORKERS):
+    """
+    Walks the source and destination trees together, comparing many folders
+    concurrently, and returns a machine-readable diff.
+    Nothing is downloaded; files are compared by path, size and checksum.
+    Throttled and transient listing errors are retried before a folder is
+    reported as an error.
+    """
+    report = {
+        'generated': datetime.datetime.now().isoformat(timespec='seconds'),
+        'source_root': od_root_id,
+        'destination_root': gd_root_id,
+        'missing': [],
+        'extra': [],
+        'mismatched': [],
+        'errors': [],
+    }
+    folders = files = 0
+
+    def compare(od_folder_id, gd_folder_id, path):
+        od_items = failures.call_with_retries(lambda: list(od_client.get_drive_items(od_folder_id)), f"Listing folder {path or 'Root'}")
+        gd_items = failures.call_with_retries(
+            lambda: google_drive.list_folder_items(get_thread_safe_service(creds), gd_folder_id, google_drive.CHECKSUM_FIELDS), f"Listing Google Drive folder {gd_folder_id}")
+        file_count = sum(1 for item in od_items if 'folder' not in item)
+        return file_count, compare_folder(od_items, gd_items, path, gd_folder_id)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(compare, od_root_id, gd_root_id, ''): ''}
+        while pending:
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                try:
+                    count, (missing, extra, mismatched, subfolders) = future.result()
+                except Exception as e:
+                    logger.error(f"Failed to compare folder {path or 'Root'}: {e}")
+                    report['errors'].append({'path': path, 'error': str(e)})
+                    continue
+
+                folders += 1
+                files += count
+                report['missing'].extend(missing)
+                report['extra'].extend(extra)
+                report['mismatched'].extend(mismatched)
+                for od_id, gd_id, sub_path in subfolders:
+                    pending[pool.submit(compare, od_id, gd_id, sub_path)] = sub_path
+
+    report['summary'] = {
+        'folders_compared': folders,
+        'files_compared': files,
+        'missing': len(report['missing']),
+        'extra': len(report['extra']),
+        'mismatched': len(report['mismatched']),
+        'errors': len(report['errors']),
+    }
+    return report
+
+def write_report(report, path):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+def load_work_list(path):
+    """
+    Reads a verify report and returns the entries a later run should transfer:
+    missing files and folders, and files whose content differs.
+    """
+    with open(path, 'r') as f:
+        report = json.load(f)
+    return report.get('missing', []) + report.get('mismatched', [])
+
+def format_summary(report):
+    summary = report['summary']
+    return (
+        f"Compared {summary['files_compared']} files in {summary['folders_compared']} folders: "
+        f"{summary['missing']} missing, {summary['mismatched']} mismatched, "
+        f"{summary['extra']} extra, {summary['errors']} folders could not be listed"
+    )